@@ -1,106 +1,52 @@
-import pandas as pd
-import json
-from math import radians, sin, cos, sqrt, atan2
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
-import numpy as np
 import requests
-import os
-from dotenv import load_dotenv
 
 from gemini_api import call_gemini_for_suggestion
-
-nlp = False
- 
-if nlp:
-    from transformers import pipeline
-    origins = [
-        'https://projmednav.onrender.com',
-        'https://mednav.sunhow123.cc',
-    ]
-else:
-    origins = ['*']
+import metrics
+from metrics import span
+import services
+from services import API_KEY, GEOCODE_API_URL, GEOCODE_ERROR_MESSAGE, origins
 
 app = Flask(__name__)
-CORS(app, origins = origins)
+CORS(app, origins = origins, expose_headers=['X-Next-Cursor', 'X-Total-Count', 'Server-Timing', 'X-Profile-File'])
 app.config['JSON_AS_ASCII'] = False
 
-load_dotenv()  
-API_KEY = os.getenv("API_KEY")
-GEOCODE_API_URL = "https://maps.googleapis.com/maps/api/geocode/json"
-# GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={API_KEY}"
-
-
-# --- Helper Function ---
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """計算兩個經緯度座標之間的直線距離（公里）"""
-    R = 6371  # 地球半徑（公里）
-    dLat = radians(lat2 - lat1)
-    dLon = radians(lon2 - lon1)
-    lat1 = radians(lat1)
-    lat2 = radians(lat2)
-    a = sin(dLat/2)**2 + cos(lat1) * cos(lat2) * sin(dLon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
-
-
-
-# --- 資料載入 ---
-try:
-    df = pd.read_csv('medical_data_geocoded.csv', 
-                     encoding='utf-8-sig', 
-                     dtype={'機構代碼': str})
-    print("成功讀取含有經緯度的醫療機構資料！")
-except FileNotFoundError:
-    print("錯誤：找不到 medical_data_geocoded.csv 檔案！請確認檔名與路徑。")
-    df = pd.DataFrame()
-except Exception as e:
-    print(f"讀取 CSV 時發生未知錯誤: {e}")
-    df = pd.DataFrame()
-
-try:
-    with open('departments_list.json', 'r', encoding='utf-8') as f:
-        # 我們將使用這個科別列表，作為 NLP 模型的分類候選標籤
-        departments_list = json.load(f)
-    print("成功載入科別列表！")
-except Exception as e:
-    print(f"讀取 departments_list.json 時發生錯誤: {e}")
-    departments_list = []
-
-# 【新增】在伺服器啟動時，載入症狀對照表
-try:
-    with open('symptom_map.json', 'r', encoding='utf-8') as f:
-        symptom_map = json.load(f)
-    print("成功載入症狀對照表！")
-except Exception as e:
-    print(f"讀取 symptom_map.json 時發生錯誤: {e}")
-    symptom_map = {}
-
-try:
-    with open('emergency_keywords.json', 'r', encoding='utf-8') as f:
-        emergency_keywords = json.load(f)
-    print("成功載入急症對照表！")
-except Exception as e:
-    print(f"讀取 emergency_keywords.json 時發生錯誤: {e}")
-    emergency_keywords = {}
-
-
-
-if nlp:
-    try:
-        
-        print("正在載入本地 NLP 模型 (第一次啟動會需要較長時間下載)...")
-        # 使用 "zero-shot-classification" 任務，它可以在沒有特別訓練的情況下，對文本進行分類
-        # 我們選用一個表現優異的中文 RoBERTa 模型
-        nlp_classifier = pipeline("zero-shot-classification", model="hfl/chinese-roberta-wwm-ext")
-        print("NLP 模型載入成功！")
 
-    except Exception as e:
-        print(f"載入 NLP 模型時發生錯誤: {e}")
-        nlp_classifier = None
-else:
-    nlp_classifier = None
-    print("本地 NLP 模型先停用，不然部屬上去的RAM 會爆炸。將依賴關鍵字與 Gemini API。")
+@app.before_request
+def start_trace():
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.trace, g.trace_token = metrics.start_request(route)
+    g.profiler = None
+    if metrics.profiling_requested(request.headers.get('X-Profile')):
+        g.profiler = metrics.SamplingProfiler().start(g.trace)
+
+
+@app.after_request
+def finish_trace(response):
+    trace = g.pop('trace', None)
+    if trace is None:
+        return response
+    # 各步驟耗時放在 Server-Timing，瀏覽器開發者工具可以直接看到
+    response.headers['Server-Timing'] = trace.server_timing()
+    metrics.finish_request(trace, g.pop('trace_token'), response.status_code)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        response.headers['X-Profile-File'] = profiler.stop(trace.route)
+    return response
+
+
+def respond(result):
+    """把 services 回傳的 (body, status, headers) 轉成 Flask 回應"""
+    body, status, headers = result
+    if isinstance(body, bytes):
+        # 預先編碼好的靜態資料，headers 已包含 Content-Type／Content-Encoding
+        return Response(body, status=status, headers=headers)
+    response = jsonify(body)
+    response.status_code = status
+    response.headers.update(headers)
+    return response
+
 
 # --- API 端點 (Endpoints) ---
 @app.route('/api/geocode', methods=['GET'])
@@ -109,166 +55,101 @@ def geocode_address():
     address = request.args.get('address', '')
     if not address:
         return jsonify({'error': '請提供地址'}), 400
-    params = { 'address': address, 'key': API_KEY, 'language': 'zh-TW'}
+
+    cached = services.geocode_from_cache(address)
+    if cached is not None:
+        return respond(cached)
+
     try:
-        res = requests.get(GEOCODE_API_URL, params=params)
-        res.raise_for_status()
-        data = res.json()
-        if data['status'] == 'OK':
-            location = data['results'][0]['geometry']['location']
-            return jsonify(location) # 回傳 {'lat': ..., 'lng': ...}
-        else:
-            return jsonify({'error': f"無法解析地址: {data['status']}"}), 404
+        with span('geocode_upstream'):
+            res = requests.get(GEOCODE_API_URL, params=services.geocode_params(address), timeout=10)
+            res.raise_for_status()
+        return respond(services.geocode_from_response(address, res.json()))
     except Exception as e:
         # 在後端伺服器控制台印出詳細錯誤，方便自己除錯
-        print(f"Geocoding API 發生錯誤: {e}") 
+        print(f"Geocoding API 發生錯誤: {e}")
+        fallback = services.geocode_fallback(address)
+        if fallback is not None:
+            return respond(fallback)
         # 【修正】回傳給前端一個通用的、安全的訊息
-        return jsonify({'error': '地理編碼服務暫時無法使用，請稍後再試。'}), 500
+        return jsonify({'error': GEOCODE_ERROR_MESSAGE}), 500
+
+
+@app.route('/api/geocode/stats', methods=['GET'])
+def geocode_stats():
+    """地理編碼快取的命中率與 Google API 呼叫次數（每月免費額度一萬筆）"""
+    return jsonify(services.geocode_cache.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文字格式的計時與計數（這個 worker 的）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/snapshot', methods=['GET'])
+def get_snapshot_info():
+    """目前資料版本、建置時間與記憶體用量（需要 X-Admin-Token）"""
+    return respond(services.snapshot_info(request.headers.get('X-Admin-Token')))
+
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_snapshot():
+    """重新載入院所資料並替換，不必重啟（需要 X-Admin-Token）"""
+    return respond(services.reload_snapshot(request.headers.get('X-Admin-Token')))
+
+
 @app.route('/api/departments', methods=['GET'])
 def get_all_departments():
-    try:
-        with open('departments_list.json', 'r', encoding='utf-8') as f:
-            departments_data = json.load(f)
-        return jsonify(departments_data)
-    except FileNotFoundError:
-        return jsonify({"error": "找不到科別列表檔案 (departments_list.json)"}), 404
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return respond(services.static_json('departments_list.json', "找不到科別列表檔案 (departments_list.json)",
+                                        request.headers.get('Accept-Encoding', ''), request.headers.get('If-None-Match', '')))
 
 
 @app.route('/api/districts', methods=['GET'])
 def get_all_districts():
-    """讀取 admin_districts.json 並回傳。"""
-    try:
-        with open('admin_districts.json', 'r', encoding='utf-8') as f:
-            districts_data = json.load(f)
-        return jsonify(districts_data)
-    except FileNotFoundError:
-        return jsonify({"error": "找不到地區列表檔案 (admin_districts.json)"}), 404
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    """回傳 admin_districts.json 的內容（記憶體中預先壓縮好的版本）。"""
+    return respond(services.static_json('admin_districts.json', "找不到地區列表檔案 (admin_districts.json)",
+                                        request.headers.get('Accept-Encoding', ''), request.headers.get('If-None-Match', '')))
 
 # 【新增】依症狀推薦科別的 API
 @app.route('/api/suggest-department', methods=['POST'])
 def suggest_department():
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return respond(services.error(services.SUGGEST_BODY_ERROR))
     symptom_text = data.get('symptoms', '')
     if not symptom_text:
         return jsonify({'departments': []})
 
-    # --- 【核心修改】層級 0: 緊急狀況判斷 ---
-    for keyword in emergency_keywords:
-        if keyword in symptom_text:
-            print(f"偵測到緊急關鍵字: {keyword}")
-            # 回傳一個特殊的緊急狀態物件
-            return jsonify({"emergency": True, "matched_keyword": keyword})
-
-    # --- 層級 1: 優先使用 symptom_map.json 進行關鍵字匹配 ---
-    found_departments = set()
-    if symptom_map:
-        for symptom_keyword, department in symptom_map.items():
-            if symptom_keyword in symptom_text:
-                found_departments.add(department)
-    if found_departments:
-        print(f"Symptom Map 高優先度分析結果: {list(found_departments)}")
-        return jsonify({'departments': list(found_departments)})
-    print("關鍵字無匹配，轉交其他模型進行分析...")
-
-    # --- 層級 2: 如果關鍵字無匹配，且非雲端部屬模式，則使用本地 NLP 模型 ---
-    if nlp:
-        print("非雲端部屬，檢查 NLP 服務。")
-
-        if not nlp_classifier or not departments_list:
-            return jsonify({"error": "關鍵字無匹配，且 NLP 服務未準備就緒"}), 500
-
-        print("使用本地 NLP 模型進行分析...")
-        result = nlp_classifier(symptom_text, departments_list, multi_label=True)
-        
-        top_label = result['labels'][0]
-        top_score = result['scores'][0]
-
-        CONFIDENCE_THRESHOLD = 0.9  # 設定信心度門檻
-    
-        if top_score >= CONFIDENCE_THRESHOLD:
-            print(f"本地 NLP 分析結果: {top_label} (信心分數: {top_score:.2f})")
-            return jsonify({'departments': [top_label]})
-
-    # --- 層級 3: 如果本地模型信心度不足，則請求 Gemini 專家分析 ---
-    print("本地 NLP 模型信心度不足，或未使用本地 NLP ，請求 Gemini API 進行分析...")
-    gemini_result = call_gemini_for_suggestion(symptom_text, departments_list, API_KEY)
-    return jsonify({'departments': gemini_result})      
-
+    result, fallback = services.suggest_locally(symptom_text)
+    if result is not None:
+        return respond(result)
+    with span('gemini'):
+        gemini_result = call_gemini_for_suggestion(symptom_text, services.snapshots.current.departments_list, API_KEY,
+                                                   fallback=fallback)
+    return jsonify({'departments': gemini_result})
 
 
 @app.route('/search', methods=['GET'])
 def search_clinic():
-    department_query = request.args.get('department', '')
-    city_query = request.args.get('city', '')
-    district_query = request.args.get('district', '')
-    if df.empty or not department_query or not city_query:
-        return jsonify({'error': '資料不完整或伺服器資料讀取失敗'}), 400
-    full_address_prefix = city_query + district_query
-
-    result_df = df[df['縣市區名'].str.startswith(full_address_prefix, na=False)].copy()
-    result_df = result_df[result_df['科別'].str.contains(department_query, na=False)]
-
-    if not result_df.empty:
-        result_df = result_df.dropna(subset=['latitude', 'longitude'])
-    
-    if not result_df.empty:
-        result_df[result_df.isna()]
-        clinics = (result_df[['機構名稱', '地址', '縣市區名', '電話', 'latitude', 'longitude']]
-            .head(100)
-            .replace({
-                '地址': {np.nan: '未提供地址', '': '未提供地址'}, 
-                '電話': {np.nan: '未提供電話', '': '未提供電話'}})
-            .to_dict('records')
-        )
-
-    else:
-        clinics = []
-    
-    print(f"查詢: {full_address_prefix} - {department_query}，找到 {len(clinics)} 筆資料。")
-
-   
-    return jsonify(clinics)
+    return respond(services.search_area(request.args))
 
 @app.route('/search/nearby', methods=['GET'])
 def search_nearby_clinics():
-    try:
-        user_lat = float(request.args.get('lat'))
-        user_lon = float(request.args.get('lon'))
-        radius_km = float(request.args.get('radius', 1)) 
-        department_query = request.args.get('department', '')
-    except (TypeError, ValueError):
-        return jsonify({'error': '緯度、經度與半徑必須是有效的數字'}), 400
-
-    if df.empty or not department_query:
-        return jsonify({'error': '科別為必填欄位'}), 400
-
-    distances = df.apply(
-        lambda row: haversine_distance(user_lat, user_lon, row['latitude'], row['longitude']),
-        axis=1
-    )
-    nearby_df = df[distances <= radius_km].copy()
-    result_df = nearby_df[nearby_df['科別'].str.contains(department_query, na=False)]
-    if not result_df.empty:
-        result_df[result_df.isna()]
-        clinics = (result_df[['機構名稱', '地址', '縣市區名', '電話', 'latitude', 'longitude']]
-            .head(100)
-            .replace({
-                '地址': {np.nan: '未提供地址', '': '未提供地址'}, 
-                '電話': {np.nan: '未提供電話', '': '未提供電話'}})
-            .to_dict('records')
-        )
-    else:
-        clinics = []
-        
-    print(f"附近查詢: ({user_lat}, {user_lon}) 半徑 {radius_km}km - {department_query}，找到 {len(clinics)} 筆資料。")
-    return jsonify(clinics)
-
- 
+    return respond(services.search_nearby(request.args))
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """一次查詢多個科別／地點，例如症狀分析推薦了好幾個科別時"""
+    return respond(services.search_batch(request.get_json(silent=True)))
+
+@app.route('/map/clusters', methods=['GET'])
+def map_clusters():
+    """地圖目前畫面範圍內的院所聚合（縮小時）或院所（放大時）"""
+    return respond(services.map_view(request.args))
+
+
 
 # --- 主程式執行區 ---
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    app.run(debug=True, port=5001)
@@ -0,0 +1,69 @@
+import numpy as np
+
+from department_index import EMPTY_ROWS
+
+
+def normalize_area(text):
+    """統一「台／臺」寫法，讓兩種拼法查到同一個桶"""
+    return text.replace('台', '臺').strip()
+
+
+def _union_rows(arrays):
+    arrays = [a for a in arrays if len(a)]
+    if not arrays:
+        return EMPTY_ROWS
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.unique(np.concatenate(arrays))
+
+
+class AreaIndex:
+    """
+    縣市 → 鄉鎮市區 → 列位置的兩層索引。
+    以 admin_districts.json（與 preprocessedData/行政區/admin_districts.py 的 area_data 相同）為標準鍵，
+    查詢時直接查表，不需要對每一列做 startswith。
+    """
+
+    def __init__(self, by_value, area_data):
+        # by_value: 正規化後的「縣市區名」→ 列位置
+        self.by_value = by_value
+        self.cities = {}
+        self.districts = {}
+        for city, districts in area_data.items():
+            city = normalize_area(city)
+            self.cities[city] = self._prefix_rows(city)
+            self.districts[city] = {
+                normalize_area(district): self._prefix_rows(city + normalize_area(district))
+                for district in districts
+            }
+
+    @classmethod
+    def from_codes(cls, area_codes, areas, area_data):
+        """由 ClinicStore 的縣市區類別代碼建立索引，正規化後相同的名稱會合併成同一個桶"""
+        area_codes = np.asarray(area_codes)
+        order = np.argsort(area_codes, kind='stable')
+        bounds = np.searchsorted(area_codes[order], np.arange(len(areas) + 1))
+        grouped = {}
+        for code, value in enumerate(areas):
+            value = normalize_area(value)
+            if value:
+                grouped.setdefault(value, []).append(order[bounds[code]:bounds[code + 1]].astype(np.int64))
+        by_value = {value: _union_rows(parts) for value, parts in grouped.items()}
+        return cls(by_value, area_data)
+
+    def _prefix_rows(self, prefix):
+        # 只掃描不重複的縣市區名（幾百個），不是整個資料表
+        return _union_rows([rows for value, rows in self.by_value.items() if value.startswith(prefix)])
+
+    def lookup(self, city, district=''):
+        """回傳該縣市（與鄉鎮市區）內所有院所的列位置（已排序、不重複）"""
+        city = normalize_area(city)
+        district = normalize_area(district)
+        if city in self.cities:
+            if not district:
+                return self.cities[city]
+            rows = self.districts[city].get(district)
+            if rows is not None:
+                return rows
+        # 非標準名稱（例如只打了區名的前幾個字）時，退回與舊版相同的前綴比對
+        return self._prefix_rows(city + district)
@@ -0,0 +1,212 @@
+"""
+ASGI 版本的後端：路由與回傳格式和 app.py 完全相同，資料與查詢邏輯都來自 services.py。
+Gemini 與 Google Geocoding 的請求用共用的 httpx.AsyncClient 非同步送出，
+等待上游回應時不會佔住 worker；CPU 為主的搜尋則丟到執行緒池，不阻塞事件迴圈。
+
+啟動方式（在 backend 目錄下）：
+    uvicorn asgi_app:app --port 5001                                     # 開發用
+    gunicorn -w 2 -k uvicorn.workers.UvicornWorker asgi_app:app          # 部署用，多個 worker
+"""
+import contextlib
+
+import httpx
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from gemini_api import async_call_gemini_for_suggestion
+import metrics
+from metrics import span
+import services
+from services import API_KEY, GEOCODE_API_URL, GEOCODE_ERROR_MESSAGE, origins
+
+MAX_CONNECTIONS = 100  # 對外連線池大小（Gemini 與 Google 共用）
+
+
+def respond(result):
+    """把 services 回傳的 (body, status, headers) 轉成 JSONResponse"""
+    body, status, headers = result
+    if isinstance(body, bytes):
+        return Response(body, status_code=status, headers=headers)
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+# --- API 端點 (Endpoints) ---
+async def geocode_address(request: Request):
+    """使用 Google Geocoding API 將地址轉換為經緯度"""
+    address = request.query_params.get('address', '')
+    if not address:
+        return JSONResponse({'error': '請提供地址'}, status_code=400)
+
+    cached = await run_in_threadpool(services.geocode_from_cache, address)
+    if cached is not None:
+        return respond(cached)
+
+    try:
+        # geocode_params 會寫 SQLite 的月用量計數（可能要等其他 worker 的鎖），和其他同步呼叫一樣丟到執行緒池
+        params = await run_in_threadpool(services.geocode_params, address)
+        with span('geocode_upstream'):
+            res = await request.app.state.client.get(GEOCODE_API_URL, params=params, timeout=10)
+            res.raise_for_status()
+        return respond(await run_in_threadpool(services.geocode_from_response, address, res.json()))
+    except Exception as e:
+        print(f"Geocoding API 發生錯誤: {e}")
+        fallback = await run_in_threadpool(services.geocode_fallback, address)
+        if fallback is not None:
+            return respond(fallback)
+        return JSONResponse({'error': GEOCODE_ERROR_MESSAGE}, status_code=500)
+
+
+async def geocode_stats(request: Request):
+    """地理編碼快取的命中率與 Google API 呼叫次數（每月免費額度一萬筆）"""
+    return JSONResponse(await run_in_threadpool(services.geocode_cache.stats))
+
+
+async def get_metrics(request: Request):
+    """Prometheus 文字格式的計時與計數（這個 worker 的）"""
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+async def get_snapshot_info(request: Request):
+    """目前資料版本、建置時間與記憶體用量（需要 X-Admin-Token）"""
+    return respond(await run_in_threadpool(services.snapshot_info, request.headers.get('x-admin-token')))
+
+
+async def reload_snapshot(request: Request):
+    """重新載入院所資料並替換，不必重啟（需要 X-Admin-Token）；建置在執行緒池中進行，不阻塞事件迴圈"""
+    return respond(await run_in_threadpool(services.reload_snapshot, request.headers.get('x-admin-token')))
+
+
+async def get_all_departments(request: Request):
+    return respond(await run_in_threadpool(
+        services.static_json, 'departments_list.json', "找不到科別列表檔案 (departments_list.json)",
+        request.headers.get('accept-encoding', ''), request.headers.get('if-none-match', '')))
+
+
+async def get_all_districts(request: Request):
+    """回傳 admin_districts.json 的內容（記憶體中預先壓縮好的版本）。"""
+    return respond(await run_in_threadpool(
+        services.static_json, 'admin_districts.json', "找不到地區列表檔案 (admin_districts.json)",
+        request.headers.get('accept-encoding', ''), request.headers.get('if-none-match', '')))
+
+
+async def suggest_department(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return respond(services.error(services.SUGGEST_BODY_ERROR))
+    symptom_text = data.get('symptoms', '')
+    if not symptom_text:
+        return JSONResponse({'departments': []})
+
+    result, fallback = await run_in_threadpool(services.suggest_locally, symptom_text)
+    if result is not None:
+        return respond(result)
+    with span('gemini'):
+        gemini_result = await async_call_gemini_for_suggestion(
+            request.app.state.client, symptom_text, services.snapshots.current.departments_list, API_KEY,
+            fallback=fallback)
+    return JSONResponse({'departments': gemini_result})
+
+
+async def search_clinic(request: Request):
+    return respond(await run_in_threadpool(services.search_area, request.query_params))
+
+
+async def search_nearby_clinics(request: Request):
+    return respond(await run_in_threadpool(services.search_nearby, request.query_params))
+
+
+async def search_batch(request: Request):
+    """一次查詢多個科別／地點，例如症狀分析推薦了好幾個科別時"""
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    return respond(await run_in_threadpool(services.search_batch, body))
+
+
+async def map_clusters(request: Request):
+    """地圖目前畫面範圍內的院所聚合（縮小時）或院所（放大時）"""
+    return respond(await run_in_threadpool(services.map_view, request.query_params))
+
+
+class TraceMiddleware:
+    """與 app.py 的 before_request／after_request 相同：記錄請求耗時、加上 Server-Timing，需要時啟動取樣分析器"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        route = scope['path'] if scope['path'] in ROUTE_PATHS else 'unmatched'
+        trace, token = metrics.start_request(route)
+        headers = dict(scope['headers'])
+        profiler = None
+        if metrics.profiling_requested(headers.get(b'x-profile', b'').decode('latin-1')):
+            profiler = metrics.SamplingProfiler().start(trace, sample_current=False)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                extra = [(b'server-timing', trace.server_timing().encode('latin-1'))]
+                if profiler is not None:
+                    extra.append((b'x-profile-file', profiler.stop(route).encode('utf-8')))
+                message = dict(message, headers=list(message.get('headers', [])) + extra)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            metrics.finish_request(trace, token, status)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # 整個 worker 共用一個有連線池的 client，避免每個請求重新建立 TLS 連線
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=20)
+    async with httpx.AsyncClient(limits=limits) as client:
+        app.state.client = client
+        yield
+
+
+routes = [
+    Route('/api/geocode', geocode_address, methods=['GET']),
+    Route('/api/geocode/stats', geocode_stats, methods=['GET']),
+    Route('/api/departments', get_all_departments, methods=['GET']),
+    Route('/api/districts', get_all_districts, methods=['GET']),
+    Route('/api/suggest-department', suggest_department, methods=['POST']),
+    Route('/search', search_clinic, methods=['GET']),
+    Route('/search/nearby', search_nearby_clinics, methods=['GET']),
+    Route('/search/batch', search_batch, methods=['POST']),
+    Route('/map/clusters', map_clusters, methods=['GET']),
+    Route('/metrics', get_metrics, methods=['GET']),
+    Route('/admin/snapshot', get_snapshot_info, methods=['GET']),
+    Route('/admin/reload', reload_snapshot, methods=['POST']),
+]
+ROUTE_PATHS = {route.path for route in routes}
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=origins, allow_methods=['*'], allow_headers=['*'],
+                   expose_headers=['X-Next-Cursor', 'X-Total-Count', 'Server-Timing', 'X-Profile-File']),
+        Middleware(TraceMiddleware),
+    ],
+    lifespan=lifespan,
+)
+
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=5001)
@@ -0,0 +1,355 @@
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from department_index import split_departments
+
+MAGIC = b'MNSTORE1'
+ALIGN = 64
+TEXT_COLUMNS = ['機構代碼', '機構名稱', '地址', '電話']
+# 每列預先編好的 JSON 物件，存成和其他字串欄位一樣的 offsets + bytes
+RECORD_COLUMN = 'record.json'
+# 缺少的地址與電話回傳給前端時補上的文字
+TEXT_DEFAULTS = {'地址': '未提供地址', '電話': '未提供電話'}
+# preprocessedData/build_dataset.py 合併進來的欄位：服務項目明細的代碼（逗號串接）與固定服務時段遮罩
+CODE_COLUMNS = ['診療科別代碼', '服務項目代碼']
+# 診療科別代碼依 department_codes.json 解碼後的名稱（逗號串接，順序同代碼）；與科別文字分開存放，不影響 department= 的比對
+DECODED_DEPARTMENTS_COLUMN = '診療科別名稱'
+SCHEDULE_COLUMN = '看診遮罩'
+
+# 座標存成 float32（在台灣的誤差不到 1 公尺），回傳時取到小數第 6 位（約 0.1 公尺），避免 25.03299903869629 這種數字
+COORDINATE_DTYPE = np.float32
+COORDINATE_DECIMALS = 6
+
+CSV_PATH = 'medical_data_geocoded.csv'
+STORE_PATH = 'clinic_store.bin'
+
+
+def read_clinic_csv(path):
+    """讀取 medical_data_geocoded.csv，並把經緯度統一轉成數值"""
+    # pandas 只在建檔與 CSV 備援路徑才需要，memmap 路徑不載入以節省每個 worker 的記憶體
+    import pandas as pd
+
+    df = pd.read_csv(path, encoding='utf-8-sig', dtype={'機構代碼': str, '電話': str})
+    # get_geocode.py 會把失敗原因寫進 longitude 欄，這裡統一轉成數值
+    for col in ['latitude', 'longitude']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df.reset_index(drop=True)
+
+
+def _padded(nbytes):
+    return -(-nbytes // ALIGN) * ALIGN
+
+
+def _pack_bytes(encoded):
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, blob
+
+
+def _pack_text(series):
+    """把字串欄位壓成 offsets + bytes，缺值一律存成空字串"""
+    return _pack_bytes([value.encode('utf-8') for value in series.fillna('').astype(str)])
+
+
+def encode_json(value):
+    """與 Flask jsonify 相同的編碼方式（鍵排序、不轉義中文、緊湊分隔符）"""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def coordinate_values(values):
+    """float32 座標轉成回傳用的 Python float 列表"""
+    return np.round(np.asarray(values, dtype=np.float64), COORDINATE_DECIMALS).tolist()
+
+
+def distance_values(distances):
+    """距離（公里）四捨五入到公尺；JSON 沒有 NaN／Infinity，遇到非有限值直接拋出 ValueError，不輸出無效的 JSON"""
+    values = np.asarray(distances, dtype=float)
+    if not np.isfinite(values).all():
+        raise ValueError('距離必須是有限的數字')
+    return [round(distance, 3) for distance in values.tolist()]
+
+
+class ClinicStore:
+    """
+    院所資料的欄式儲存：座標為數值陣列、縣市區名為類別代碼、科別為位元遮罩，
+    其餘字串欄位為 offsets + bytes。可以從 DataFrame 建立，也可以用 np.memmap 開啟建好的檔案，
+    讓多個 worker 透過作業系統快取共用同一份記憶體。
+    """
+
+    def __init__(self, latitude, longitude, area_codes, areas, dept_mask, departments, texts, meta=None,
+                 schedule=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.area_codes = area_codes
+        self.areas = areas
+        self.dept_mask = dept_mask
+        self.departments = departments
+        self.texts = texts
+        self.meta = meta or {}
+        # 每列的 21-bit 看診遮罩；資料檔沒有合併服務時段時為 None，由 service_hours.json 補上
+        self.schedule = schedule
+        # open() 開啟的檔案路徑；從 DataFrame 建立時為 None
+        self.path = None
+        self.size = len(latitude)
+        if RECORD_COLUMN not in self.texts:
+            # 舊版資料檔沒有這一欄，或是剛從 DataFrame 建立：載入時編一次，之後每個請求只需要接起來
+            self.texts[RECORD_COLUMN] = _pack_bytes([encode_json(record).encode('utf-8')
+                                                     for record in self.records(range(self.size))])
+        self._record_offsets, record_blob = self.texts[RECORD_COLUMN]
+        self._record_view = memoryview(record_blob)
+
+    @property
+    def empty(self):
+        return self.size == 0
+
+    @classmethod
+    def from_dataframe(cls, df, meta=None):
+        import pandas as pd
+
+        df = df.reset_index(drop=True)
+        n = len(df)
+
+        area_codes, areas = pd.factorize(df['縣市區名'])
+
+        departments = split_departments(df['科別'])
+        dept_codes, dept_names = pd.factorize(departments)
+        words = max(1, -(-len(dept_names) // 64))
+        dept_mask = np.zeros((n, words), dtype=np.uint64)
+        bits = np.left_shift(np.uint64(1), (dept_codes % 64).astype(np.uint64))
+        np.bitwise_or.at(dept_mask, (departments.index.to_numpy(), dept_codes // 64), bits)
+
+        texts = {col: _pack_text(df[col] if col in df else pd.Series([''] * n)) for col in TEXT_COLUMNS}
+        for col in CODE_COLUMNS + [DECODED_DEPARTMENTS_COLUMN]:
+            if col in df:
+                texts[col] = _pack_text(df[col])
+        schedule = df[SCHEDULE_COLUMN].fillna(0).to_numpy(dtype=np.uint32) if SCHEDULE_COLUMN in df else None
+        return cls(
+            latitude=df['latitude'].to_numpy(dtype=COORDINATE_DTYPE),
+            longitude=df['longitude'].to_numpy(dtype=COORDINATE_DTYPE),
+            area_codes=area_codes.astype(np.int32),
+            areas=list(areas),
+            dept_mask=dept_mask,
+            departments=list(dept_names),
+            texts=texts,
+            meta=meta,
+            schedule=schedule,
+        )
+
+    @classmethod
+    def empty_store(cls):
+        empty_text = (np.zeros(1, dtype=np.uint32), np.empty(0, dtype=np.uint8))
+        return cls(
+            latitude=np.empty(0, dtype=COORDINATE_DTYPE),
+            longitude=np.empty(0, dtype=COORDINATE_DTYPE),
+            area_codes=np.empty(0, dtype=np.int32),
+            areas=[],
+            dept_mask=np.zeros((0, 1), dtype=np.uint64),
+            departments=[],
+            texts={col: empty_text for col in TEXT_COLUMNS},
+        )
+
+    def _arrays(self):
+        arrays = {
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'area_codes': self.area_codes,
+            'dept_mask': self.dept_mask,
+        }
+        for col, (offsets, blob) in self.texts.items():
+            arrays[f'{col}.offsets'] = offsets
+            arrays[f'{col}.blob'] = blob
+        if self.schedule is not None:
+            arrays['schedule'] = self.schedule
+        return arrays
+
+    def save(self, path):
+        """
+        寫成單一二進位檔：MAGIC + 表頭長度 + JSON 表頭，之後每個陣列對齊 64 bytes。
+        表頭的 meta['checksum'] 是資料區（含對齊補的 0）的 sha256，建置完成後用 open(verify=True) 檢查一次。
+        """
+        sections = {}
+        offset = 0
+        arrays = self._arrays()
+        digest = hashlib.sha256()
+        for name, array in arrays.items():
+            sections[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            padded = _padded(array.nbytes)
+            digest.update(np.ascontiguousarray(array).tobytes())
+            digest.update(bytes(padded - array.nbytes))
+            offset += padded
+        self.meta = {**self.meta, 'checksum': digest.hexdigest()}
+        header = json.dumps({
+            'size': self.size,
+            'areas': self.areas,
+            'departments': self.departments,
+            'text_columns': list(self.texts),
+            'sections': sections,
+            'meta': self.meta,
+        }, ensure_ascii=False).encode('utf-8')
+        data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.uint64(len(header)).tobytes())
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + sections[name]['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path, verify=False):
+        """
+        以唯讀 np.memmap 開啟，陣列都是檔案的視圖，不會複製到各個 worker 的記憶體。
+        平常只檢查表頭與檔案大小（寫到一半的檔案大小會不符）；verify=True 時另外算整個資料區的 sha256，
+        會讀過檔案的每一頁，只在建置完成或發布時使用。
+        """
+        mm = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(mm[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} 不是有效的院所資料檔")
+        header_len = int(np.frombuffer(mm, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        header_start = len(MAGIC) + 8
+        header = json.loads(bytes(mm[header_start:header_start + header_len]).decode('utf-8'))
+        data_start = -(-(header_start + header_len) // ALIGN) * ALIGN
+        data_end = data_start + max((spec['offset'] + _padded(np.dtype(spec['dtype']).itemsize * int(np.prod(spec['shape'])))
+                                     for spec in header['sections'].values()), default=0)
+        if len(mm) != data_end:
+            raise ValueError(f"{path} 的大小不符（{len(mm)} bytes，表頭記錄 {data_end} bytes），檔案可能不完整")
+        checksum = header['meta'].get('checksum')
+        if verify and checksum and hashlib.sha256(mm[data_start:]).hexdigest() != checksum:
+            raise ValueError(f"{path} 的 checksum 不符，檔案可能不完整")
+
+        def section(name):
+            spec = header['sections'][name]
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            array = np.frombuffer(mm, dtype=dtype, count=count, offset=data_start + spec['offset'])
+            return array.reshape(spec['shape'])
+
+        texts = {col: (section(f'{col}.offsets'), section(f'{col}.blob')) for col in header['text_columns']}
+        store = cls(
+            latitude=section('latitude'),
+            longitude=section('longitude'),
+            area_codes=section('area_codes'),
+            areas=header['areas'],
+            dept_mask=section('dept_mask'),
+            departments=header['departments'],
+            texts=texts,
+            meta=header['meta'],
+            schedule=section('schedule') if 'schedule' in header['sections'] else None,
+        )
+        store.path = path
+        return store
+
+    def text(self, col, row):
+        offsets, blob = self.texts[col]
+        return bytes(blob[offsets[row]:offsets[row + 1]]).decode('utf-8')
+
+    def text_values(self, col, rows):
+        """一次取出多列的字串欄位"""
+        offsets, blob = self.texts[col]
+        view = memoryview(blob)
+        return [str(view[start:end], 'utf-8')
+                for start, end in zip(offsets[rows].tolist(), offsets[rows + 1].tolist())]
+
+    def area_name(self, row):
+        code = self.area_codes[row]
+        return self.areas[code] if code >= 0 else ''
+
+    def records(self, rows):
+        """把指定列轉成 API 回傳用的 dict，缺少的地址與電話補上預設文字"""
+        rows = np.asarray(rows, dtype=np.int64)
+        latitudes = coordinate_values(self.latitude[rows])
+        longitudes = coordinate_values(self.longitude[rows])
+        return [
+            {
+                '機構名稱': self.text('機構名稱', row),
+                '地址': self.text('地址', row) or TEXT_DEFAULTS['地址'],
+                '縣市區名': self.area_name(row),
+                '電話': self.text('電話', row) or TEXT_DEFAULTS['電話'],
+                'latitude': latitude,
+                'longitude': longitude,
+            }
+            for row, latitude, longitude in zip(rows.tolist(), latitudes, longitudes)
+        ]
+
+    def records_json(self, rows, distances=None):
+        """
+        直接把預先編好的 JSON 片段接成陣列，內容與 jsonify(records(rows)) 相同；
+        有距離時在每個物件最前面插入 distance_km（鍵排序後它本來就排第一個）。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self._record_offsets[rows].tolist()
+        ends = self._record_offsets[rows + 1].tolist()
+        view = self._record_view
+        if distances is None:
+            parts = [view[start:end] for start, end in zip(starts, ends)]
+        else:
+            distances = distance_values(distances)
+            parts = [b'{"distance_km":%b,%b' % (repr(distance).encode(), view[start + 1:end])
+                     for start, end, distance in zip(starts, ends, distances)]
+        return b'[' + b','.join(parts) + b']'
+
+    def columns(self, rows, distances=None):
+        """欄式格式：每個欄位一個列表，前端可以直接依索引取用，不必為每間院所建一個物件"""
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = self.area_codes[rows].tolist()
+        columns = {
+            '機構名稱': self.text_values('機構名稱', rows),
+            '地址': [value or TEXT_DEFAULTS['地址'] for value in self.text_values('地址', rows)],
+            '縣市區名': [self.areas[code] if code >= 0 else '' for code in codes],
+            '電話': [value or TEXT_DEFAULTS['電話'] for value in self.text_values('電話', rows)],
+            'latitude': coordinate_values(self.latitude[rows]),
+            'longitude': coordinate_values(self.longitude[rows]),
+        }
+        if distances is not None:
+            columns['distance_km'] = distance_values(distances)
+        return columns
+
+
+def build_store(csv_path=CSV_PATH, store_path=STORE_PATH):
+    df = read_clinic_csv(csv_path)
+    store = ClinicStore.from_dataframe(df, meta={'source': os.path.basename(csv_path)})
+    store.save(store_path)
+    # 寫完後完整檢查一次 checksum，之後每次載入只需要檢查表頭與大小
+    ClinicStore.open(store_path, verify=True)
+    return store
+
+
+def load_store(csv_path=CSV_PATH, store_path=STORE_PATH, verify=False):
+    """
+    優先開啟建好的二進位檔；檔案不存在、比 CSV 舊或讀取失敗時，退回直接讀 CSV。
+    verify=True 時會完整檢查資料檔的 checksum（讀過整個檔案，啟動與重新載入都會變慢）。
+    """
+    if os.path.exists(store_path):
+        stale = os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(store_path)
+        if stale:
+            print(f"{store_path} 比 {csv_path} 舊，改用 CSV 載入。")
+        else:
+            try:
+                store = ClinicStore.open(store_path, verify=verify)
+                version = store.meta.get('version')
+                print(f"成功以 memmap 開啟院所資料檔 {store_path}！" + (f"（資料版本 {version}）" if version else ''))
+                return store
+            except Exception as e:
+                print(f"開啟 {store_path} 時發生錯誤，改用 CSV 載入: {e}")
+
+    df = read_clinic_csv(csv_path)
+    print("成功讀取含有經緯度的醫療機構資料！")
+    return ClinicStore.from_dataframe(df)
+
+
+if __name__ == "__main__":
+    INPUT_PATH = sys.argv[1] if len(sys.argv) > 1 else CSV_PATH
+    OUTPUT_PATH = sys.argv[2] if len(sys.argv) > 2 else STORE_PATH
+
+    print(f"reading '{INPUT_PATH}' ...")
+    store = build_store(INPUT_PATH, OUTPUT_PATH)
+    print(f"successfully saved '{OUTPUT_PATH}' ({store.size} rows)！")
@@ -0,0 +1,154 @@
+import numpy as np
+
+MIN_ZOOM = 5  # 全台灣大約在 zoom 7 的一個畫面內，再小就沒有意義
+CLUSTER_MAX_ZOOM = 15  # 超過這個縮放等級直接回傳院所
+CELL_PX = 64  # 每個聚合格子在畫面上的大小（像素）
+CELLS_PER_TILE = 256 // CELL_PX
+TOP_DEPARTMENTS = 3
+MAX_LAT = 85.05112878
+
+
+def mercator(lat, lon):
+    """經緯度 → Web Mercator 的 (x, y)，範圍都是 0～1，y 往南增加，與 Leaflet 的圖磚座標相同"""
+    lat = np.radians(np.clip(np.asarray(lat, dtype=float), -MAX_LAT, MAX_LAT))
+    x = (np.asarray(lon, dtype=float) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return x, y
+
+
+def cell_scale(zoom):
+    return (1 << zoom) * CELLS_PER_TILE
+
+
+def cell_range(low, high, scale):
+    """Mercator 座標範圍 → 格子編號範圍，先夾在 0～1 附近再取整數，超出地圖的範圍不會溢位"""
+    low, high = np.clip(low, -1.0, 2.0), np.clip(high, -1.0, 2.0)
+    return max(int(np.floor(low * scale)), 0), min(int(np.floor(high * scale)), scale - 1)
+
+
+def slices_in_box(keys, scale, x0, x1, y0, y1):
+    """
+    已排序的格子鍵（iy * scale + ix）中，落在 ix0..ix1、iy0..iy1 範圍內的位置。
+    同一列的鍵是連續的，所以每一列只要兩次二分搜尋。
+    """
+    ix0, ix1 = cell_range(x0, x1, scale)
+    iy0, iy1 = cell_range(y0, y1, scale)
+    if ix0 > ix1 or iy0 > iy1:
+        return np.empty(0, dtype=np.int64)
+    row_base = np.arange(iy0, iy1 + 1, dtype=np.int64) * scale
+    starts = np.searchsorted(keys, row_base + ix0, side='left')
+    ends = np.searchsorted(keys, row_base + ix1, side='right')
+    spans = [np.arange(s, e) for s, e in zip(starts, ends) if e > s]
+    if not spans:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(spans)
+
+
+class ClusterLevel:
+    """一個縮放等級的聚合結果：每個有院所的格子一筆，依格子鍵排序"""
+
+    def __init__(self, keys, counts, latitude, longitude, top_codes, top_counts):
+        self.keys = keys
+        self.counts = counts
+        self.latitude = latitude
+        self.longitude = longitude
+        self.top_codes = top_codes
+        self.top_counts = top_counts
+
+
+class ClusterPyramid:
+    """
+    地圖瀏覽用的多層聚合：啟動時為 MIN_ZOOM～CLUSTER_MAX_ZOOM 每一層，把院所依 Web Mercator 格子
+    （畫面上 CELL_PX 像素見方）分組，預先算好每格的院所數、中心點與最多的幾個科別。
+    查詢時只需要依畫面範圍做幾次二分搜尋；院所本身另外依最細的一層排序，放大後直接回傳院所。
+    """
+
+    def __init__(self, latitudes, longitudes, dept_mask, departments):
+        lat = np.asarray(latitudes, dtype=float)
+        lon = np.asarray(longitudes, dtype=float)
+        rows = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        lat, lon = lat[rows], lon[rows]
+        x, y = mercator(lat, lon)
+        self.departments = departments
+        self.size = len(rows)
+
+        # 每個科別一個 0/1 向量，各層用 bincount 加總
+        dept_bits = [((dept_mask[rows, code // 64] >> np.uint64(code % 64)) & np.uint64(1)).astype(np.float64)
+                     for code in range(len(departments))]
+
+        self.levels = {}
+        for zoom in range(MIN_ZOOM, CLUSTER_MAX_ZOOM + 1):
+            self.levels[zoom] = self._build_level(zoom, x, y, lat, lon, dept_bits)
+
+        point_scale = cell_scale(CLUSTER_MAX_ZOOM + 1)
+        point_keys = self._keys(x, y, point_scale)
+        order = np.argsort(point_keys, kind='stable')
+        self._point_keys = point_keys[order]
+        self._point_rows = rows[order]
+        self._point_x = x[order]
+        self._point_y = y[order]
+
+    @staticmethod
+    def _keys(x, y, scale):
+        ix = np.minimum(np.floor(x * scale).astype(np.int64), scale - 1)
+        iy = np.minimum(np.floor(y * scale).astype(np.int64), scale - 1)
+        return iy * scale + ix
+
+    def _build_level(self, zoom, x, y, lat, lon, dept_bits):
+        keys, cell_ids = np.unique(self._keys(x, y, cell_scale(zoom)), return_inverse=True)
+        counts = np.bincount(cell_ids, minlength=len(keys))
+        latitude = np.bincount(cell_ids, weights=lat, minlength=len(keys)) / np.maximum(counts, 1)
+        longitude = np.bincount(cell_ids, weights=lon, minlength=len(keys)) / np.maximum(counts, 1)
+        if dept_bits:
+            per_department = np.stack([np.bincount(cell_ids, weights=bits, minlength=len(keys)) for bits in dept_bits],
+                                      axis=1)
+            top_codes = np.argsort(-per_department, axis=1, kind='stable')[:, :TOP_DEPARTMENTS]
+            top_counts = np.take_along_axis(per_department, top_codes, axis=1)
+        else:
+            top_codes = np.zeros((len(keys), 0), dtype=np.int64)
+            top_counts = np.zeros((len(keys), 0))
+        return ClusterLevel(keys, counts.astype(np.int32), latitude, longitude,
+                            top_codes.astype(np.int16), top_counts.astype(np.int32))
+
+    def visible_cells(self, zoom, box):
+        """畫面範圍在這一層涵蓋的格子數（不論有沒有院所），用來限制回傳的聚合數量"""
+        x0, x1, y0, y1 = box
+        scale = cell_scale(zoom)
+        ix0, ix1 = cell_range(x0, x1, scale)
+        iy0, iy1 = cell_range(y0, y1, scale)
+        return max(ix1 - ix0 + 1, 0) * max(iy1 - iy0 + 1, 0)
+
+    @staticmethod
+    def box(south, west, north, east):
+        """經緯度範圍 → Mercator 的 (x0, x1, y0, y1)"""
+        x0, y1 = mercator(south, west)
+        x1, y0 = mercator(north, east)
+        return float(x0), float(x1), float(y0), float(y1)
+
+    def clusters(self, zoom, box):
+        """回傳 (level, 位置)：這一層在畫面範圍內的聚合"""
+        level = self.levels[zoom]
+        x0, x1, y0, y1 = box
+        return level, slices_in_box(level.keys, cell_scale(zoom), x0, x1, y0, y1)
+
+    def rows(self, box):
+        """畫面範圍內所有院所的原始列位置（已排序）"""
+        x0, x1, y0, y1 = box
+        slots = slices_in_box(self._point_keys, cell_scale(CLUSTER_MAX_ZOOM + 1), x0, x1, y0, y1)
+        inside = ((self._point_x[slots] >= x0) & (self._point_x[slots] <= x1) &
+                  (self._point_y[slots] >= y0) & (self._point_y[slots] <= y1))
+        return np.sort(self._point_rows[slots[inside]])
+
+    def describe(self, level, positions):
+        """聚合轉成回應用的 dict 列表"""
+        clusters = []
+        for i in positions.tolist():
+            departments = {self.departments[code]: int(count)
+                           for code, count in zip(level.top_codes[i].tolist(), level.top_counts[i].tolist()) if count}
+            clusters.append({
+                'lat': round(float(level.latitude[i]), 6),
+                'lng': round(float(level.longitude[i]), 6),
+                'count': int(level.counts[i]),
+                'departments': departments,
+            })
+        return clusters
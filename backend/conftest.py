@@ -0,0 +1,70 @@
+import contextlib
+import io
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_FILES = ['departments_list.json', 'admin_districts.json', 'department_codes.json', 'department_aliases.json',
+              'emergency_keywords.json', 'symptom_map.json']
+AREAS = [('臺北市', '大安區', '復興南路', 25.033, 121.543), ('臺北市', '中正區', '羅斯福路', 25.027, 121.522),
+         ('新北市', '板橋區', '文化路', 25.014, 121.465), ('臺中市', '西區', '民權路', 24.143, 120.667)]
+DEPARTMENTS = [('內科', '02'), ('家醫科', '01'), ('牙醫一般科', '40'), ('兒童牙科', '45'), ('中醫一般科', '60'),
+               ('內科,家醫科', '02,01')]
+
+
+def clinic_frame(n=600, seed=7):
+    """合成的院所資料：四個行政區、幾個常見科別，座標散在各區中心附近"""
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        city, district, road, lat, lon = AREAS[i % len(AREAS)]
+        department, code = DEPARTMENTS[i % len(DEPARTMENTS)]
+        rows.append({
+            '機構代碼': f'{i:010d}',
+            '機構名稱': f'測試診所{i}',
+            '縣市區名': city + district,
+            '地址': f'{city}{district}{road}{i % 300 + 1}號',
+            '電話': f'02-{i:08d}',
+            '科別': department,
+            'latitude': lat + rng.normal(0, 0.01),
+            'longitude': lon + rng.normal(0, 0.01),
+            '診療科別代碼': code,
+            '服務項目代碼': '',
+            '看診遮罩': int(rng.integers(0, 1 << 21)),
+        })
+    frame = pd.DataFrame(rows)
+    frame.loc[5, ['latitude', 'longitude']] = np.nan
+    return frame
+
+
+@pytest.fixture(scope='session')
+def services_module(tmp_path_factory):
+    """在暫存目錄放一份合成資料檔後載入 services；services 以目前目錄讀寫資料檔，所以整個測試期間切換到那裡"""
+    from clinic_store import ClinicStore, STORE_PATH
+
+    data_dir = tmp_path_factory.mktemp('data')
+    for name in DATA_FILES:
+        shutil.copy(os.path.join(BACKEND_DIR, name), data_dir / name)
+    ClinicStore.from_dataframe(clinic_frame()).save(str(data_dir / STORE_PATH))
+
+    os.environ['API_KEY'] = ''
+    os.environ['SNAPSHOT_CHECK_INTERVAL'] = '0'
+    os.environ.pop('NLP_SERVICE_URL', None)
+    previous = os.getcwd()
+    os.chdir(data_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import services
+    yield services
+    os.chdir(previous)
+
+
+@pytest.fixture(scope='session')
+def client(services_module):
+    import app
+
+    return app.app.test_client()
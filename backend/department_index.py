@@ -0,0 +1,95 @@
+import numpy as np
+
+MATCH_MODES = ('exact', 'prefix', 'substring')
+# API 沒有帶 match 時沿用原本 str.contains 的子字串比對，exact／prefix 需要明確指定
+DEFAULT_MATCH = 'substring'
+
+EMPTY_ROWS = np.empty(0, dtype=np.int64)
+
+
+def split_departments(series):
+    """把以逗號串接的科別欄位拆開，規則與 preprocessedData/get_departments.py 相同"""
+    departments = series.str.split(',').explode().dropna()
+    return departments[departments != '']
+
+
+def intersect_rows(a, b):
+    """兩個已排序、不重複的列位置陣列取交集"""
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+class DepartmentIndex:
+    """
+    科別 → 列位置的倒排索引。
+    載入資料時拆一次科別欄位，查詢時只需要在科別名稱（幾十個）中比對，再取對應的列位置。
+    """
+
+    def __init__(self, postings):
+        self.postings = postings
+
+    @classmethod
+    def from_mask(cls, dept_mask, departments):
+        """由 ClinicStore 的科別位元遮罩建立倒排索引"""
+        postings = {}
+        for code, name in enumerate(departments):
+            word, bit = divmod(code, 64)
+            hits = dept_mask[:, word] & np.uint64(1 << bit)
+            postings[name] = np.flatnonzero(hits).astype(np.int64)
+        return cls(postings)
+
+    @property
+    def names(self):
+        return list(self.postings)
+
+    def matching_names(self, query, match='exact'):
+        if match == 'exact':
+            return [query] if query in self.postings else []
+        if match == 'prefix':
+            return [name for name in self.postings if name.startswith(query)]
+        if match == 'substring':
+            return [name for name in self.postings if query in name]
+        raise ValueError(f"不支援的比對方式: {match}")
+
+    def lookup(self, query, match='exact'):
+        """回傳符合科別的列位置（已排序、不重複）"""
+        names = self.matching_names(query, match)
+        if not names:
+            return EMPTY_ROWS
+        if len(names) == 1:
+            return self.postings[names[0]]
+        return np.unique(np.concatenate([self.postings[name] for name in names]))
+
+
+class CodeIndex:
+    """
+    代碼 → 列位置的倒排索引，代碼來自 build_dataset.py 合併進資料檔的服務項目明細
+    （診療科別代碼、服務項目代碼，每列以逗號串接）。查詢多個代碼時取各自列位置的聯集。
+    """
+
+    def __init__(self, postings):
+        self.postings = postings
+
+    @classmethod
+    def from_store(cls, store, column):
+        """資料檔沒有這個欄位（舊的資料檔或直接讀 CSV）時回傳空的索引"""
+        if column not in store.texts:
+            return cls({})
+        postings = {}
+        for row, value in enumerate(store.text_values(column, np.arange(store.size))):
+            if value:
+                for code in value.split(','):
+                    postings.setdefault(code, []).append(row)
+        return cls({code: np.asarray(rows, dtype=np.int64) for code, rows in postings.items()})
+
+    @property
+    def empty(self):
+        return not self.postings
+
+    def lookup(self, codes):
+        """回傳擁有任一代碼的列位置（已排序、不重複）"""
+        arrays = [self.postings[code] for code in codes if code in self.postings]
+        if not arrays:
+            return EMPTY_ROWS
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.unique(np.concatenate(arrays))
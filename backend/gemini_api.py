@@ -1,18 +1,159 @@
-import json, os, requests
+import asyncio, json, os, random, re, requests, threading, time
+from collections import OrderedDict
 
-def call_gemini_for_suggestion(symptom_text, candidate_departments, API_KEY):
+import metrics
+
+GEMINI_API_URL = os.getenv(
+    "GEMINI_API_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent",
+)
+REQUEST_TIMEOUT = (3.05, 15)  # (連線, 讀取) 秒數
+MAX_RETRIES = 2
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def normalize_symptom_text(text):
+    """快取用的症狀鍵：去掉空白與標點、英文轉小寫，讓只差標點或空白的描述共用同一個結果"""
+    text = re.sub(r'[\s，。、！？!?,.;；:：~～]+', '', text)
+    return text.lower()
+
+
+class TTLCache:
+    """有容量上限的 LRU 快取，每筆資料在 ttl 秒後過期"""
+
+    def __init__(self, max_entries=1024, ttl=24 * 3600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, self.clock() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SingleFlight:
+    """同一個鍵同時只會有一個上游呼叫，其他同時到達的請求等待並共用它的結果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+
+
+class CircuitBreaker:
     """
-    當本地模型信心度不足時，呼叫 Gemini API 進行專家分析。
+    連續失敗 failure_threshold 次後斷路 reset_timeout 秒，期間直接走備援；
+    時間到之後放一個請求試探（half-open），成功才恢復。
+    allow() 放行時回傳這次的狀態，呼叫端不論結果如何都要在結束時交給 release()，
+    試探的請求沒有打到上游（例如直接命中快取）時試探權才會釋放，不會一直卡在斷路。
     """
-    if not API_KEY:
-        print("錯誤：未提供 Gemini API Key。")
-        return []
 
-    GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={API_KEY}"
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """拒絕時回傳 None，放行時回傳 'closed' 或 'half-open'（試探）"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return state
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return state
+            return None
 
-    print("本地模型信心度不足，正在請求 Gemini 專家分析...")
-    
-    prompt = f"""
+    def release(self, permit):
+        """allow() 放行的呼叫結束；試探沒有記錄成功或失敗就結束時，讓下一個請求重新試探"""
+        if permit == 'half-open':
+            with self._lock:
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+# 共用的連線池、快取與斷路器（每個 worker 一份）
+session = requests.Session()
+session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16))
+session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16))
+suggestion_cache = TTLCache()
+single_flight = SingleFlight()
+breaker = CircuitBreaker()
+
+
+class GeminiError(Exception):
+    """HTTP 或網路層級的失敗，會計入斷路器"""
+
+
+def build_prompt(symptom_text, candidate_departments):
+    return f"""
     你是一個專業且謹慎的台灣醫療導航助理。你的唯一任務是根據使用者提供的「症狀描述」，從「候選科別列表」中，選擇出最適合的一個科別。
 
     **規則：**
@@ -30,43 +171,250 @@ def call_gemini_for_suggestion(symptom_text, candidate_departments, API_KEY):
 
     請根據以上資訊，生成你的推薦。
     """
-    
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
+
+
+def build_payload(symptom_text, candidate_departments):
+    return {
+        "contents": [{"parts": [{"text": build_prompt(symptom_text, candidate_departments)}]}],
         "generationConfig": {
             "responseMimeType": "application/json"
         }
     }
-    
+
+
+def retry_delay(attempt):
+    """第 attempt 次重試前等待的秒數（帶抖動的指數退避）"""
+    return 0.3 * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+
+def parse_gemini_response(data):
+    """從 Gemini 的回應取出推薦科別；格式或 JSON 錯誤時回傳空列表"""
+    # 【關鍵修改 1】在解析前，先取出原始文字並印出來
     try:
-        response = requests.post(GEMINI_API_URL, json=payload)
-        response.raise_for_status() # 如果 HTTP 狀態碼是 4xx 或 5xx，這會拋出錯誤
-        data = response.json()
-        
-        # 【關鍵修改 1】在解析前，先取出原始文字並印出來
         raw_text_from_gemini = data['candidates'][0]['content']['parts'][0]['text']
-        print(f"從 Gemini 收到的原始回應文字: {raw_text_from_gemini}")
+    except (KeyError, IndexError, TypeError) as e:
+        print(f"Gemini 回應格式不符預期: {e}")
+        metrics.inc('mednav_gemini_requests_total', outcome='format_error')
+        return []
+    print(f"從 Gemini 收到的原始回應文字: {raw_text_from_gemini}")
 
-        # 【關鍵修改 2】針對 JSON 解析增加更具體的錯誤處理
-        try:
-            recommended_dept_json = json.loads(raw_text_from_gemini)
-            department = recommended_dept_json.get("department")
-            
-            if department:
-                print(f"Gemini 專家分析結果: {department}")
-                return [department]
-            else:
-                print("Gemini 回應中未找到 'department' 鍵。")
-                return []
-        
-        except json.JSONDecodeError as json_err:
-            print(f"解析 Gemini 回應時發生 JSON 格式錯誤: {json_err}")
-            return []
-
-    except requests.exceptions.RequestException as req_err:
-        print(f"請求 Gemini API 時發生網路錯誤: {req_err}")
+    # 【關鍵修改 2】針對 JSON 解析增加更具體的錯誤處理
+    try:
+        recommended_dept_json = json.loads(raw_text_from_gemini)
+    except json.JSONDecodeError as json_err:
+        print(f"解析 Gemini 回應時發生 JSON 格式錯誤: {json_err}")
+        metrics.inc('mednav_gemini_requests_total', outcome='json_error')
         return []
+
+    department = recommended_dept_json.get("department") if isinstance(recommended_dept_json, dict) else None
+    if department:
+        print(f"Gemini 專家分析結果: {department}")
+        metrics.inc('mednav_gemini_requests_total', outcome='success')
+        return [department]
+    print("Gemini 回應中未找到 'department' 鍵。")
+    metrics.inc('mednav_gemini_requests_total', outcome='no_department')
+    return []
+
+
+def request_gemini(symptom_text, candidate_departments, API_KEY, api_url=None):
+    """
+    送出請求並解析回應，回傳科別列表；HTTP／網路錯誤會以帶抖動的指數退避重試，最後仍失敗則拋出 GeminiError。
+    JSON 格式錯誤不重試，直接回傳空列表。
+    """
+    payload = build_payload(symptom_text, candidate_departments)
+
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(retry_delay(attempt))
+        try:
+            response = session.post(api_url or GEMINI_API_URL, params={'key': API_KEY},
+                                    json=payload, timeout=REQUEST_TIMEOUT)
+            if response.status_code in RETRY_STATUS_CODES:
+                last_error = f"HTTP {response.status_code}"
+                print(f"Gemini API 回應 {response.status_code}，第 {attempt + 1} 次嘗試失敗。")
+                continue
+            response.raise_for_status() # 如果 HTTP 狀態碼是 4xx 或 5xx，這會拋出錯誤
+            data = response.json()
+            break
+        except requests.exceptions.HTTPError as req_err:
+            metrics.inc('mednav_gemini_requests_total', outcome='http_error')
+            raise GeminiError(f"請求 Gemini API 時發生錯誤: {req_err}")
+        except (requests.exceptions.RequestException, ValueError) as req_err:
+            last_error = req_err
+            print(f"請求 Gemini API 時發生網路錯誤 (第 {attempt + 1} 次嘗試): {req_err}")
+    else:
+        # 重試後仍是可重試的 HTTP 狀態（429、5xx）或網路錯誤
+        metrics.inc('mednav_gemini_requests_total',
+                    outcome='http_error' if isinstance(last_error, str) else 'network_error')
+        raise GeminiError(f"請求 Gemini API 失敗: {last_error}")
+
+    return parse_gemini_response(data)
+
+
+def call_gemini_for_suggestion(symptom_text, candidate_departments, API_KEY, fallback=None, api_url=None):
+    """
+    當本地模型信心度不足時，呼叫 Gemini API 進行專家分析。
+    相同（正規化後）的症狀描述直接用快取；同時間的相同請求只會打一次 Gemini；
+    Gemini 連續失敗時斷路，期間直接回傳 fallback（本地 NLP 信心度不足時的最佳猜測，沒有則為空列表）。
+    """
+    if not API_KEY:
+        print("錯誤：未提供 Gemini API Key。")
+        metrics.inc('mednav_gemini_requests_total', outcome='no_api_key')
+        return list(fallback or [])
+
+    key = (normalize_symptom_text(symptom_text), tuple(candidate_departments))
+    cached = suggestion_cache.get(key)
+    if cached is not None:
+        print(f"Gemini 建議快取命中: {cached}")
+        metrics.inc('mednav_cache_hits_total', cache='gemini_suggestion')
+        return list(cached)
+    metrics.inc('mednav_cache_misses_total', cache='gemini_suggestion')
+
+    permit = breaker.allow()
+    if permit is None:
+        print("Gemini API 目前不穩定（斷路中），改用本地分析結果。")
+        metrics.inc('mednav_gemini_requests_total', outcome='circuit_open')
+        return list(fallback or [])
+
+    def ask():
+        # 共用結果的其他請求可能在快取寫入前就到達，所以在這裡再檢查一次快取
+        cached = suggestion_cache.get(key)
+        if cached is not None:
+            return cached
+        print("本地模型信心度不足，正在請求 Gemini 專家分析...")
+        try:
+            result = request_gemini(symptom_text, candidate_departments, API_KEY, api_url)
+        except Exception:
+            # 只有實際打出請求的那一個呼叫計入斷路器，共用結果的請求不重複計算
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        if result:
+            suggestion_cache.put(key, result)
+        return result
+
+    try:
+        return list(single_flight.do(key, ask))
+    except GeminiError as e:
+        print(e)
+        return list(fallback or [])
     except Exception as e:
         # 這個 Exception 會捕捉到 RecursionError 等其他所有未預期的錯誤
         print(f"呼叫 Gemini API 時發生未預期錯誤: {e}")
-        return []
\ No newline at end of file
+        return list(fallback or [])
+    finally:
+        breaker.release(permit)
+
+
+# --- ASGI 模式（asgi_app.py）使用的非同步版本，共用上面的快取與斷路器 ---
+class AsyncSingleFlight:
+    """SingleFlight 的 asyncio 版本：同一個鍵同時只會有一個上游呼叫，其他請求 await 同一個 Future"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        call = self._calls.get(key)
+        if call is not None:
+            return await asyncio.shield(call)
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        try:
+            result = await fn()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            # 包含連線中斷造成的 CancelledError，等待中的請求才不會永遠卡住
+            call.set_exception(e if isinstance(e, Exception) else GeminiError("Gemini 請求被取消"))
+            # 沒有其他人等待時，避免 asyncio 警告「Future exception was never retrieved」
+            call.exception()
+            raise
+        finally:
+            self._calls.pop(key, None)
+
+
+async_single_flight = AsyncSingleFlight()
+
+
+async def async_request_gemini(client, symptom_text, candidate_departments, API_KEY, api_url=None):
+    """request_gemini 的非同步版本，client 為共用的 httpx.AsyncClient；等待上游時不佔用 worker"""
+    import httpx
+
+    payload = build_payload(symptom_text, candidate_departments)
+
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(retry_delay(attempt))
+        try:
+            response = await client.post(api_url or GEMINI_API_URL, params={'key': API_KEY},
+                                         json=payload, timeout=httpx.Timeout(REQUEST_TIMEOUT[1], connect=REQUEST_TIMEOUT[0]))
+            if response.status_code in RETRY_STATUS_CODES:
+                last_error = f"HTTP {response.status_code}"
+                print(f"Gemini API 回應 {response.status_code}，第 {attempt + 1} 次嘗試失敗。")
+                continue
+            response.raise_for_status()
+            data = response.json()
+            break
+        except httpx.HTTPStatusError as req_err:
+            metrics.inc('mednav_gemini_requests_total', outcome='http_error')
+            raise GeminiError(f"請求 Gemini API 時發生錯誤: {req_err}")
+        except (httpx.HTTPError, ValueError) as req_err:
+            last_error = req_err
+            print(f"請求 Gemini API 時發生網路錯誤 (第 {attempt + 1} 次嘗試): {req_err}")
+    else:
+        # 重試後仍是可重試的 HTTP 狀態（429、5xx）或網路錯誤
+        metrics.inc('mednav_gemini_requests_total',
+                    outcome='http_error' if isinstance(last_error, str) else 'network_error')
+        raise GeminiError(f"請求 Gemini API 失敗: {last_error}")
+
+    return parse_gemini_response(data)
+
+
+async def async_call_gemini_for_suggestion(client, symptom_text, candidate_departments, API_KEY, fallback=None, api_url=None):
+    """call_gemini_for_suggestion 的非同步版本，快取、斷路器與備援邏輯相同"""
+    if not API_KEY:
+        print("錯誤：未提供 Gemini API Key。")
+        metrics.inc('mednav_gemini_requests_total', outcome='no_api_key')
+        return list(fallback or [])
+
+    key = (normalize_symptom_text(symptom_text), tuple(candidate_departments))
+    cached = suggestion_cache.get(key)
+    if cached is not None:
+        print(f"Gemini 建議快取命中: {cached}")
+        metrics.inc('mednav_cache_hits_total', cache='gemini_suggestion')
+        return list(cached)
+    metrics.inc('mednav_cache_misses_total', cache='gemini_suggestion')
+
+    permit = breaker.allow()
+    if permit is None:
+        print("Gemini API 目前不穩定（斷路中），改用本地分析結果。")
+        metrics.inc('mednav_gemini_requests_total', outcome='circuit_open')
+        return list(fallback or [])
+
+    async def ask():
+        cached = suggestion_cache.get(key)
+        if cached is not None:
+            return cached
+        print("本地模型信心度不足，正在請求 Gemini 專家分析...")
+        try:
+            result = await async_request_gemini(client, symptom_text, candidate_departments, API_KEY, api_url)
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        if result:
+            suggestion_cache.put(key, result)
+        return result
+
+    try:
+        return list(await async_single_flight.do(key, ask))
+    except GeminiError as e:
+        print(e)
+        return list(fallback or [])
+    except Exception as e:
+        print(f"呼叫 Gemini API 時發生未預期錯誤: {e}")
+        return list(fallback or [])
+    finally:
+        breaker.release(permit)
@@ -0,0 +1,196 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from clinic_store import coordinate_values
+
+MISS = object()
+BUSY_TIMEOUT = 2  # 秒；其他 worker 正在寫入時最多等這麼久，之後放棄 SQLite 這一層
+
+
+def clean_address(address):
+    """與 preprocessedData/get_geocode.py 的 clean_address 相同：去掉括號備註與多個地址"""
+    address = re.sub(r'\(.*\)|（.*）', '', address)
+    address = address.split('、')[0].split(',')[0]
+    return address.strip()
+
+
+def normalize_address(address):
+    """快取用的地址鍵：先做 clean_address，再去掉空白並統一「台／臺」"""
+    return re.sub(r'\s+', '', clean_address(address)).replace('台', '臺')
+
+
+class GeocodeCache:
+    """
+    兩層地理編碼快取：行程內 LRU + 本機 SQLite，都有 TTL。
+    查無結果（ZERO_RESULTS）也會以較短的 TTL 快取起來；院所本身的地址則從資料檔預先載入，不會過期。
+    SQLite 只是加速用的一層：讀寫失敗（例如其他 worker 鎖住資料庫）時記錄下來並只用記憶體，不影響請求本身。
+    """
+
+    def __init__(self, db_path='geocode_cache.sqlite3', max_entries=2048,
+                 ttl=30 * 24 * 3600, negative_ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._seed = {}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {
+            'seed_hits': 0,
+            'memory_hits': 0,
+            'sqlite_hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'upstream_calls': 0,
+            'sqlite_errors': 0,
+        }
+        self._monthly_calls = 0
+
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+                # WAL 模式下讀取不會被其他 worker 的寫入擋住
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS geocode ('
+                    ' address TEXT PRIMARY KEY, lat REAL, lng REAL, expires_at REAL)'
+                )
+                # 每月的 Google API 呼叫次數，所有 worker 與重啟之間共用，用來追蹤免費額度
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS upstream_usage (month TEXT PRIMARY KEY, calls INTEGER)'
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"無法開啟地理編碼快取資料庫 {db_path}，只使用記憶體快取: {e}")
+                self._db = None
+
+    def seed_from_store(self, store):
+        """把院所資料檔裡已經有座標的地址放進不會過期的種子表；重新載入資料時整個換成新的"""
+        seed = {}
+        rows = np.flatnonzero(np.isfinite(store.latitude) & np.isfinite(store.longitude))
+        latitudes = coordinate_values(store.latitude[rows])
+        longitudes = coordinate_values(store.longitude[rows])
+        for row, lat, lng in zip(rows, latitudes, longitudes):
+            address = store.text('地址', row)
+            if address:
+                seed.setdefault(normalize_address(address), {'lat': lat, 'lng': lng})
+        self._seed = seed
+        return len(seed)
+
+    def _remember(self, key, location, expires_at):
+        self._memory[key] = (location, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _count_hit(self, tier, location):
+        self.counters['negative_hits' if location is None else tier] += 1
+
+    def _sqlite_failed(self, action, e):
+        """SQLite 讀寫失敗：記錄下來並放棄這次未完成的交易，呼叫端改用記憶體的結果（需持有 _lock）"""
+        self.counters['sqlite_errors'] += 1
+        print(f"地理編碼快取資料庫{action}失敗，改用記憶體快取: {e}")
+        try:
+            self._db.rollback()
+        except sqlite3.Error:
+            pass
+
+    def get(self, address):
+        """
+        回傳快取的位置 {'lat': ..., 'lng': ...}；查無結果的負快取回傳 None；沒有快取則回傳 MISS。
+        """
+        key = normalize_address(address)
+        now = time.time()
+        with self._lock:
+            if key in self._seed:
+                self.counters['seed_hits'] += 1
+                return self._seed[key]
+
+            entry = self._memory.get(key)
+            if entry is not None:
+                location, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._count_hit('memory_hits', location)
+                    return location
+                del self._memory[key]
+
+            row = None
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        'SELECT lat, lng, expires_at FROM geocode WHERE address = ?', (key,)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    self._sqlite_failed('讀取', e)
+                if row is not None and row[2] > now:
+                    location = None if row[0] is None else {'lat': row[0], 'lng': row[1]}
+                    self._remember(key, location, row[2])
+                    self._count_hit('sqlite_hits', location)
+                    return location
+
+            self.counters['misses'] += 1
+            return MISS
+
+    def put(self, address, location):
+        """存入查詢結果；location 為 None 代表查無結果（負快取）"""
+        key = normalize_address(address)
+        expires_at = time.time() + (self.negative_ttl if location is None else self.ttl)
+        with self._lock:
+            self._remember(key, location, expires_at)
+            if self._db is not None:
+                lat = lng = None
+                if location is not None:
+                    lat, lng = location['lat'], location['lng']
+                try:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO geocode (address, lat, lng, expires_at) VALUES (?, ?, ?, ?)',
+                        (key, lat, lng, expires_at),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    self._sqlite_failed('寫入', e)
+
+    def count_upstream_call(self):
+        with self._lock:
+            self.counters['upstream_calls'] += 1
+            self._monthly_calls += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        'INSERT INTO upstream_usage (month, calls) VALUES (?, 1)'
+                        ' ON CONFLICT(month) DO UPDATE SET calls = calls + 1',
+                        (time.strftime('%Y-%m'),),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    self._sqlite_failed('寫入', e)
+
+    def monthly_upstream_calls(self):
+        """本月呼叫 Google API 的次數；沒有 SQLite（或讀取失敗）時只能算這個行程自己的"""
+        with self._lock:
+            if self._db is None:
+                return self._monthly_calls
+            try:
+                row = self._db.execute(
+                    'SELECT calls FROM upstream_usage WHERE month = ?', (time.strftime('%Y-%m'),)
+                ).fetchone()
+            except sqlite3.Error as e:
+                self._sqlite_failed('讀取', e)
+                return self._monthly_calls
+            return row[0] if row else 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['seed_entries'] = len(self._seed)
+            stats['memory_entries'] = len(self._memory)
+        hits = stats['seed_hits'] + stats['memory_hits'] + stats['sqlite_hits'] + stats['negative_hits']
+        total = hits + stats['misses']
+        stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+        return stats
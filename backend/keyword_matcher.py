@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    多關鍵字比對自動機：建好之後只要掃過症狀文字一次，就能找出所有命中的關鍵字與位置，
+    不需要對每個關鍵字各做一次子字串搜尋。
+    """
+
+    def __init__(self, keywords):
+        # 每個狀態：轉移表、失敗連結、在此結束的關鍵字
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword in keywords:
+            self._add(keyword)
+        self._build_fail_links()
+
+    def _add(self, keyword):
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        if keyword not in self.output[state]:
+            self.output[state].append(keyword)
+
+    def _build_fail_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find_all(self, text):
+        """回傳 [(起始位置, 結束位置, 關鍵字), ...]，依結束位置排序，重疊的命中也會全部列出"""
+        matches = []
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for keyword in self.output[state]:
+                matches.append((end - len(keyword), end, keyword))
+        return matches
+
+
+class SymptomMatcher:
+    """
+    把 emergency_keywords.json 與 symptom_map.json 編進同一個自動機。
+    每次查詢前會（最多每 check_interval 秒一次）檢查兩個檔案的修改時間，有變動就重新編譯並整個替換。
+    """
+
+    def __init__(self, emergency_path='emergency_keywords.json', symptom_path='symptom_map.json', check_interval=2.0):
+        self.emergency_path = emergency_path
+        self.symptom_path = symptom_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._mtimes = None
+        self.emergency_keywords = []
+        self.symptom_map = {}
+        self._compiled = (AhoCorasick([]), {}, {})
+        self.reload()
+
+    def _file_mtimes(self):
+        return tuple(
+            os.path.getmtime(path) if os.path.exists(path) else None
+            for path in (self.emergency_path, self.symptom_path)
+        )
+
+    @staticmethod
+    def _load_json(path, default, label):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            print(f"成功載入{label}！")
+            return data
+        except Exception as e:
+            print(f"讀取 {path} 時發生錯誤: {e}")
+            return default
+
+    def reload(self):
+        """重新讀取兩個 JSON 檔並編譯自動機，完成後才一次替換掉舊的"""
+        mtimes = self._file_mtimes()
+        emergency_keywords = self._load_json(self.emergency_path, [], '急症對照表')
+        symptom_map = self._load_json(self.symptom_path, {}, '症狀對照表')
+
+        # 急症關鍵字保留檔案中的順序，命中多個時回報最前面的一個（與逐一比對時相同）
+        emergency_rank = {keyword: rank for rank, keyword in reversed(list(enumerate(emergency_keywords)))}
+        automaton = AhoCorasick(list(emergency_rank) + list(symptom_map))
+        with self._lock:
+            self.emergency_keywords = emergency_keywords
+            self.symptom_map = symptom_map
+            self._compiled = (automaton, emergency_rank, symptom_map)
+            self._mtimes = mtimes
+            self._checked_at = time.monotonic()
+
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        if self._file_mtimes() == self._mtimes:
+            return False
+        print("偵測到關鍵字檔案變更，重新編譯比對自動機...")
+        self.reload()
+        return True
+
+    def match(self, text):
+        """
+        掃描一次症狀文字，回傳 (急症命中列表, 科別命中列表)。
+        每個命中為 {'keyword', 'start', 'end'}，科別命中另外帶 'department'。
+        """
+        self.reload_if_changed()
+        automaton, emergency_rank, symptom_map = self._compiled
+        emergency_hits = []
+        department_hits = []
+        for start, end, keyword in automaton.find_all(text):
+            hit = {'keyword': keyword, 'start': start, 'end': end}
+            if keyword in emergency_rank:
+                emergency_hits.append(hit)
+            if keyword in symptom_map:
+                department_hits.append(dict(hit, department=symptom_map[keyword]))
+        emergency_hits.sort(key=lambda hit: (emergency_rank[hit['keyword']], hit['start']))
+        department_hits.sort(key=lambda hit: hit['start'])
+        return emergency_hits, department_hits
@@ -0,0 +1,219 @@
+import math
+import re
+
+import numpy as np
+
+from area_index import normalize_area
+from geocode_cache import normalize_address
+from spatial_index import haversine_km
+
+# 由精確到粗略；address 為同一個門牌，street_number 為同一條路（巷、弄）上相鄰門牌的內插
+TIERS = ('address', 'street_number', 'lane', 'road', 'district', 'city')
+NEAR_NUMBER = 20  # 門牌號碼超出已知號碼的兩端時，差距在這個範圍內才用最近的門牌
+MAX_NUMBER_GAP = 2 * NEAR_NUMBER  # 兩側已知門牌相差超過這個數時，內插的位置可能偏很遠，只當備援
+ROAD_MAX_EXTENT_KM = 1.5  # 路段的院所分布超過這個範圍時，路段中心點不夠準，先問 Google
+
+FULL_WIDTH = str.maketrans('０１２３４５６７８９－．，', '0123456789-.,')
+DISTRICT_SUFFIXES = '鄉鎮市區'
+CHINESE_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+CHINESE_NUMBER = re.compile(r'[零〇一二三四五六七八九十百]+(?=段|巷|弄|號|之|-)')
+# 村里名稱後面要接著鄰或路名才當成村里，否則「新村路」、「中村路」的「新村」、「中村」會被當成村里吃掉；
+# 門牌後面的「之 1」、「號」、樓層不影響位置，一起吃掉，rest 是剩下沒有解析的文字
+ROAD = r'\D+?(?:大道|路|街)'
+HOUSE_SUFFIX = r'(?:[-之]\d+)*號?(?:[-之]\d+)*(?:(?:(?:地下|B)\d+(?:樓|F)?|\d+(?:樓|F))(?:[-之]\d+)?)?'
+ADDRESS_PATTERN = re.compile(
+    rf'(?:\D{{1,4}}[里村](?=\d+鄰|{ROAD}))?(?:\d+鄰)?'
+    rf'(?P<road>{ROAD}(?:\d+段)?)?'
+    r'(?:(?P<lane>\d+)巷)?(?:(?P<alley>\d+)弄)?'
+    rf'(?:(?P<number>\d+)(?=[-之、.,號]|$){HOUSE_SUFFIX})?'
+    r'(?P<rest>.*)'
+)
+
+
+def chinese_to_int(text):
+    """「三一八」、「三十二」、「一百零五」→ 數字"""
+    if '十' not in text and '百' not in text:
+        return int(''.join(str(CHINESE_DIGITS[c]) for c in text))
+    total = 0
+    digit = 0
+    for c in text:
+        if c == '百':
+            total += (digit or 1) * 100
+            digit = 0
+        elif c == '十':
+            total += (digit or 1) * 10
+            digit = 0
+        else:
+            digit = CHINESE_DIGITS[c]
+    return total + digit
+
+
+def normalize_numbers(text):
+    """全形數字轉半形，段、巷、弄、號前面的國字數字轉成阿拉伯數字（路名裡的「八德路」不受影響）"""
+    text = text.translate(FULL_WIDTH)
+    return CHINESE_NUMBER.sub(lambda m: str(chinese_to_int(m.group())), text)
+
+
+class Node:
+    """地址樹的一個節點：子節點與底下所有座標的總和、範圍，用來算中心點"""
+    __slots__ = ('children', 'count', 'lat_sum', 'lng_sum', 'min_lat', 'max_lat', 'min_lng', 'max_lng')
+
+    def __init__(self):
+        self.children = {}
+        self.count = 0
+        self.lat_sum = self.lng_sum = 0.0
+        self.min_lat = self.min_lng = math.inf
+        self.max_lat = self.max_lng = -math.inf
+
+    def add(self, lat, lng):
+        self.count += 1
+        self.lat_sum += lat
+        self.lng_sum += lng
+        self.min_lat = min(self.min_lat, lat)
+        self.max_lat = max(self.max_lat, lat)
+        self.min_lng = min(self.min_lng, lng)
+        self.max_lng = max(self.max_lng, lng)
+
+    def child(self, key):
+        node = self.children.get(key)
+        if node is None:
+            node = self.children[key] = Node()
+        return node
+
+    def centroid(self):
+        return {'lat': self.lat_sum / self.count, 'lng': self.lng_sum / self.count}
+
+    def extent_km(self):
+        """座標範圍的對角線長度"""
+        return float(haversine_km(self.min_lat, self.min_lng, self.max_lat, self.max_lng))
+
+
+class LocalGeocoder:
+    """
+    由院所資料檔裡已經有座標的地址建成的離線地理編碼器。
+    地址正規化後拆成 縣市區 → 路（段）→ 巷 → 弄 → 門牌 一層層的樹，每個節點記錄底下座標的中心點；
+    查詢時由最精確的一層往上找：同門牌、相鄰門牌內插、巷／路段中心點、行政區中心點。
+    lookup() 回傳 (位置, 層級, 是否可信)；不可信的結果只在 Google 查不到時才拿來用。
+    """
+
+    def __init__(self, area_data):
+        # 縣市 → [(地址裡的寫法, 標準名稱)]，長的先比對；鄉鎮改制為市（例如頭份鎮→頭份市）時兩種寫法都認得
+        self.cities = {}
+        for city, districts in area_data.items():
+            names = {}
+            for district in districts:
+                district = normalize_area(district)
+                names[district] = district
+                if len(district) > 2:
+                    for suffix in DISTRICT_SUFFIXES:
+                        names.setdefault(district[:-1] + suffix, district)
+            self.cities[normalize_area(city)] = sorted(names.items(), key=lambda item: len(item[0]), reverse=True)
+        self.root = Node()
+        self.size = 0
+
+    @classmethod
+    def from_store(cls, store, area_data):
+        geocoder = cls(area_data)
+        if '地址' not in store.texts:
+            return geocoder
+        rows = np.flatnonzero(np.isfinite(store.latitude) & np.isfinite(store.longitude))
+        for row, address in zip(rows, store.text_values('地址', rows)):
+            if address:
+                geocoder.add(address, float(store.latitude[row]), float(store.longitude[row]))
+        return geocoder
+
+    def parse(self, address):
+        """回傳 (縣市, 區, 路, 巷, 弄, 門牌, 剩下沒有解析的文字)；沒有的部分為 None，門牌為整數"""
+        text = normalize_numbers(normalize_address(address))
+        city = district = None
+        for name in self.cities:
+            if text.startswith(name):
+                city, text = name, text[len(name):]
+                break
+        if city is not None:
+            for written, name in self.cities[city]:
+                if text.startswith(written):
+                    district, text = name, text[len(written):]
+                    break
+        match = ADDRESS_PATTERN.match(text)
+        number = match.group('number')
+        return (city, district, match.group('road'), match.group('lane'), match.group('alley'),
+                None if number is None else int(number), match.group('rest'))
+
+    def add(self, address, lat, lng):
+        city, district, road, lane, alley, number, _ = self.parse(address)
+        if city is None or district is None:
+            return
+        path = [city, district]
+        if road is not None:
+            path.append(road)
+            if lane is not None:
+                path.append(lane + '巷')
+                if alley is not None:
+                    path.append(alley + '弄')
+            if number is not None:
+                path.append(number)
+        node = self.root
+        node.add(lat, lng)
+        for key in path:
+            node = node.child(key)
+            node.add(lat, lng)
+        self.size += 1
+
+    def _nearest_number(self, node, number):
+        """
+        同一條路（巷、弄）上的門牌位置與是否可信：號碼在已知號碼之間時，依兩側最接近的門牌線性內插，
+        兩側相差超過 MAX_NUMBER_GAP 時不可信；超出兩端時只在差距不超過 NEAR_NUMBER 時用最近的門牌，
+        否則回傳 None（不知道在路的哪一段）
+        """
+        numbers = [key for key in node.children if isinstance(key, int)]
+        lower = max((n for n in numbers if n < number), default=None)
+        upper = min((n for n in numbers if n > number), default=None)
+        if lower is None or upper is None:
+            nearest = lower if upper is None else upper
+            if nearest is None or abs(nearest - number) > NEAR_NUMBER:
+                return None
+            return node.children[nearest].centroid(), True
+        a, b = node.children[lower].centroid(), node.children[upper].centroid()
+        t = (number - lower) / (upper - lower)
+        location = {'lat': a['lat'] + (b['lat'] - a['lat']) * t, 'lng': a['lng'] + (b['lng'] - a['lng']) * t}
+        return location, upper - lower <= MAX_NUMBER_GAP
+
+    def lookup(self, address):
+        """
+        回傳 (位置, 層級, 是否可信)；連縣市都認不出來時回傳 (None, None, False)。
+        地址裡有沒解析的文字（例如認不得的路名）時，不管對到哪一層都不可信
+        """
+        city, district, road, lane, alley, number, rest = self.parse(address)
+        # 查詢只寫到這一層（例如「臺北市大安區」）時，該層的中心點就是答案
+        has_detail = bool(rest) or any(part is not None for part in (lane, alley, number))
+        city_node = self.root.children.get(city)
+        if city_node is None:
+            return None, None, False
+        district_node = city_node.children.get(district)
+        if district_node is None:
+            return city_node.centroid(), 'city', district is None and road is None and not has_detail
+        road_node = district_node.children.get(road)
+        if road_node is None:
+            return district_node.centroid(), 'district', road is None and not has_detail
+
+        node, tier, exact_path = road_node, 'road', True
+        for key in (None if lane is None else lane + '巷', None if alley is None or lane is None else alley + '弄'):
+            if key is None:
+                break
+            child = node.children.get(key)
+            if child is None:
+                exact_path = False
+                break
+            node, tier = child, 'lane'
+        if number is not None and exact_path:
+            leaf = node.children.get(number)
+            if leaf is not None:
+                return leaf.centroid(), 'address', not rest
+            nearby = self._nearest_number(node, number)
+            if nearby is not None:
+                location, confident = nearby
+                return location, 'street_number', confident and not rest
+        # 查詢有門牌（或巷弄）卻對不上已知的門牌時，路段中心點可能離實際位置很遠，只當備援
+        confident = exact_path and number is None and not rest and node.extent_km() <= ROAD_MAX_EXTENT_KM
+        return node.centroid(), tier, confident
@@ -0,0 +1,234 @@
+"""
+請求路徑的計時與計數，輸出成 Prometheus 文字格式（/metrics）。
+
+- span('area_filter')：記錄某個步驟花的時間，同時累加到直方圖與這個請求的 Server-Timing header
+- inc('mednav_gemini_requests_total', outcome='success')：計數器
+- register_collector(fn)：輸出 /metrics 時才取值的指標（例如地理編碼快取的統計）
+
+沒有另外依賴 prometheus_client；每個 worker 各自累計，多個 worker 時由 Prometheus 端加總。
+"""
+import contextlib
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+# 秒；涵蓋從索引查詢（微秒級）到 Gemini（數秒）
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'mednav_request_duration_seconds': 'HTTP 請求處理時間',
+    'mednav_stage_duration_seconds': '請求中各步驟的處理時間',
+    'mednav_cache_hits_total': '各快取的命中次數',
+    'mednav_cache_misses_total': '各快取未命中的次數',
+    'mednav_gemini_requests_total': 'Gemini 建議的結果（success、json_error、http_error 等）',
+    'mednav_search_results_total': '搜尋找到的院所筆數累計',
+    'mednav_geocode_tier_total': '地理編碼由哪一層回答（本地地址樹的各層、cache 或 google）',
+    'mednav_nlp_requests_total': '本地 NLP 服務的結果（success、error；confident 為信心足夠、不必再問 Gemini 的次數）',
+}
+TYPES = {
+    'mednav_request_duration_seconds': 'histogram',
+    'mednav_stage_duration_seconds': 'histogram',
+}
+
+_lock = threading.Lock()
+_counters = Counter()
+_histograms = {}
+_collectors = []
+_current = contextvars.ContextVar('mednav_request_trace', default=None)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _counters[(name, _labels(labels))] += value
+
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+                break
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+
+def register_collector(fn):
+    """fn() 回傳 [(名稱, 類型, 說明, {標籤}, 值), ...]，輸出 /metrics 時才呼叫"""
+    _collectors.append(fn)
+
+
+class RequestTrace:
+    """一個請求中各步驟的耗時（毫秒），用來產生 Server-Timing header"""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.spans = []
+        # 這個請求帶 X-Profile 時的 SamplingProfiler
+        self.profiler = None
+
+    def server_timing(self):
+        total = (time.perf_counter() - self.started) * 1000
+        parts = [f'{name};dur={ms:.2f}' for name, ms in self.spans]
+        parts.append(f'total;dur={total:.2f}')
+        return ', '.join(parts)
+
+
+def start_request(route):
+    trace = RequestTrace(route)
+    return trace, _current.set(trace)
+
+
+def finish_request(trace, token, status):
+    _current.reset(token)
+    observe('mednav_request_duration_seconds', time.perf_counter() - trace.started,
+            route=trace.route, status=str(status))
+
+
+@contextlib.contextmanager
+def span(stage):
+    """記錄一個步驟的耗時；不在請求中（例如效能測試直接呼叫）時只記到直方圖"""
+    trace = _current.get()
+    # 請求在別的執行緒（例如 ASGI 的執行緒池）裡執行這個步驟時，取樣分析器也要取樣那個執行緒
+    attached = trace is not None and trace.profiler is not None and trace.profiler.attach()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if attached:
+            trace.profiler.detach()
+        seconds = time.perf_counter() - started
+        route = trace.route if trace is not None else ''
+        observe('mednav_stage_duration_seconds', seconds, route=route, stage=stage)
+        if trace is not None:
+            trace.spans.append((stage, seconds * 1000))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def render():
+    """輸出 Prometheus 文字格式（text/plain; version=0.0.4）"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                      for key, h in _histograms.items()}
+
+    families = defaultdict(list)
+    types = dict(TYPES)
+    helps = dict(HELP)
+    for (name, labels), value in counters.items():
+        families[name].append((labels, value))
+        types.setdefault(name, 'counter')
+    for fn in _collectors:
+        for name, kind, help_text, labels, value in fn():
+            families[name].append((_labels(labels), value))
+            types.setdefault(name, kind)
+            helps.setdefault(name, help_text)
+
+    lines = []
+    for name in sorted(set(families) | {name for name, _ in histograms}):
+        lines.append(f'# HELP {name} {helps.get(name, name)}')
+        lines.append(f'# TYPE {name} {types.get(name, "untyped")}')
+        for labels, value in sorted(families.get(name, [])):
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (hist_name, labels), histogram in sorted(histograms.items()):
+            if hist_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram["sum"]:.6f}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- 取樣分析器 ---
+# 設定環境變數 PROFILE_TOKEN 後，帶 X-Profile: <token> 的請求會在處理期間每隔 PROFILE_INTERVAL 秒
+# 取樣一次處理這個請求的執行緒的呼叫堆疊，寫成 flamegraph 可用的 collapsed stack 檔案，檔名放在 X-Profile-File header。
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = 0.001
+
+
+def profiling_requested(header_value):
+    return bool(PROFILE_TOKEN) and header_value == PROFILE_TOKEN
+
+
+class SamplingProfiler:
+    """
+    只取樣處理這個請求的執行緒，同時進行的其他請求不會混進來：
+    start() 的執行緒（Flask 的請求執行緒），以及請求執行 span() 期間所在的其他執行緒（ASGI 的執行緒池）。
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.threads = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def attach(self):
+        """開始取樣目前的執行緒；已經在取樣時回傳 False"""
+        ident = threading.get_ident()
+        if ident in self.threads:
+            return False
+        self.threads.add(ident)
+        return True
+
+    def detach(self):
+        self.threads.discard(threading.get_ident())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.threads):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self, trace=None, sample_current=True):
+        """
+        trace 為這個請求的 RequestTrace，請求在其他執行緒進入 span() 時會把那個執行緒加進來。
+        ASGI 的事件迴圈執行緒同時在處理其他請求，所以用 sample_current=False 不取樣它。
+        """
+        if sample_current:
+            self.attach()
+        if trace is not None:
+            trace.profiler = self
+        self._thread.start()
+        return self
+
+    def stop(self, route):
+        """停止取樣並寫檔，回傳檔名"""
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        filename = os.path.join(PROFILE_DIR, f"{route.strip('/').replace('/', '_') or 'root'}-{time.time_ns()}.collapsed")
+        with open(filename, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        return filename
@@ -0,0 +1,428 @@
+"""
+本地 NLP 科別分類服務：獨立的一個行程，所有 web worker 共用同一份模型。
+
+原本每個 Flask worker 各自載入 zero-shot pipeline，RAM 不夠；而且每次分類要把每個科別
+各當成一個假設句跑一次模型。這裡改成：
+- 模型只在這個行程裡載入一次，預設在第一個分類請求時才載入；設定 NLP_EAGER_WARMUP=1（或 --warm-up）時
+  改成啟動後就在背景載入並算好科別向量，web worker 重新載入資料時也會通知這裡預熱
+- 用 onnxruntime 跑 int8 量化的句向量模型（不需要 torch），只用 CPU
+- 科別名稱的向量第一次用到時算好並保留，之後每次分類只需要把症狀文字跑一次模型，再和科別向量算相似度
+- 同時進來的請求在 BATCH_WINDOW 秒內湊成一批，一起跑一次模型；整批失敗時逐一重跑，只讓出錯的請求失敗
+- /health 回報最近 LATENCY_SAMPLES 個分類請求的 p50／p95 延遲，可以和 web worker /metrics 裡
+  mednav_stage_duration_seconds 的 stage="gemini" 比較
+
+啟動方式（在 backend 目錄下）：
+    python nlp_service.py --export shibing624/text2vec-base-chinese   # 第一次：匯出並量化模型到 nlp_model/
+    python nlp_service.py --calibrate labelled.jsonl                   # 用標註過的症狀校準信心度門檻
+    python nlp_service.py                                              # 啟動服務，預設 127.0.0.1:5002
+web worker 設定 NLP_SERVICE_URL=http://127.0.0.1:5002 後，suggest-department 才會使用本地 NLP。
+
+分數是科別相似度經過 TEMPERATURE 的 softmax，不是機率，同一個門檻換了模型或溫度意義就不同。
+信心度門檻依序取環境變數 NLP_CONFIDENCE_THRESHOLD、--calibrate 寫出的 nlp_model/calibration.json；
+兩者都沒有時不回傳門檻，web worker 一律再問 Gemini，本地結果只當 Gemini 無法使用時的備援。
+"""
+import argparse
+import collections
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+MODEL_DIR = os.getenv('NLP_MODEL_DIR', 'nlp_model')
+MODEL_FILE = 'model_int8.onnx'
+TOKENIZER_FILE = 'tokenizer.json'
+NLP_THREADS = int(os.getenv('NLP_THREADS', '2'))  # onnxruntime 使用的 CPU 執行緒數
+BATCH_WINDOW = float(os.getenv('NLP_BATCH_WINDOW', '0.005'))  # 秒；第一個請求進來後最多再等這麼久湊批次
+MAX_BATCH = 32
+MAX_TOKENS = 128
+LABEL_TEMPLATE = '{}的症狀'  # 科別名稱套進這個句子再算向量，和症狀描述比較接近
+TEMPERATURE = 0.05  # 相似度轉成機率時的溫度，越小分數越集中在最相近的科別
+CALIBRATION_FILE = 'calibration.json'
+TARGET_PRECISION = 0.9  # 校準時要求：分數超過門檻的查詢中，第一名正確的比例至少這麼高
+LABELS_FILE = 'departments_list.json'  # 啟動時預熱用的科別列表（與 web worker 讀的是同一個檔案）
+EAGER_WARMUP = os.getenv('NLP_EAGER_WARMUP', '').lower() in ('1', 'true', 'yes')  # 預設等第一個請求才載入模型
+LATENCY_SAMPLES = 1000  # /health 的延遲百分位數依最近這麼多個分類請求計算
+
+
+class SentenceEncoder:
+    """int8 ONNX 句向量模型：token 向量依 attention mask 取平均，再正規化成單位向量"""
+
+    def __init__(self, model_dir=MODEL_DIR, threads=NLP_THREADS):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, MODEL_FILE), options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(MAX_TOKENS)
+        self.tokenizer.enable_padding()
+
+    def encode(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class MicroBatcher:
+    """
+    把同時進來的項目湊成一批交給 run_batch。背景執行緒取到第一個項目後，
+    最多再等 window 秒（或湊滿 max_batch 個）就送出；run_batch 回傳與輸入等長的結果列表。
+    整批出錯時不知道是哪個項目造成的，改成一個一個重跑，其他項目照常回傳結果。
+    """
+
+    def __init__(self, run_batch, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='nlp-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item, timeout=None):
+        future = Future()
+        started = time.perf_counter()
+        self._queue.put((item, future))
+        result = future.result(timeout)
+        self.latencies.append(time.perf_counter() - started)
+        return result
+
+    def latency_ms(self):
+        """最近的請求從送出到拿到結果（包含湊批次的等待）的 p50、p95，單位毫秒；還沒有請求時回傳 None"""
+        if not self.latencies:
+            return None
+        p50, p95 = np.percentile(list(self.latencies), [50, 95]) * 1000
+        return {'p50': round(float(p50), 2), 'p95': round(float(p95), 2)}
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    print(f"NLP 批次（{len(batch)} 筆）失敗，改為逐筆重跑: {type(e).__name__}: {e}")
+                    self._run_each(batch)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _run_each(self, batch):
+        for item, future in batch:
+            try:
+                result = self.run_batch([item])[0]
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += 1
+            future.set_result(result)
+
+
+def load_threshold(model_dir=MODEL_DIR):
+    """信心度門檻：環境變數優先，其次是校準檔；校準時用的溫度和現在不同時不採用。沒有可用的門檻時回傳 None"""
+    if os.getenv('NLP_CONFIDENCE_THRESHOLD'):
+        return float(os.getenv('NLP_CONFIDENCE_THRESHOLD'))
+    path = os.path.join(model_dir, CALIBRATION_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            calibration = json.load(f)
+    except FileNotFoundError:
+        print(f"找不到 {path}，尚未校準信心度門檻，所有分類結果都會再交給 Gemini 確認。")
+        return None
+    if calibration.get('temperature') != TEMPERATURE:
+        print(f"{path} 是用 TEMPERATURE={calibration.get('temperature')} 校準的，與目前的 {TEMPERATURE} 不同，請重新校準。")
+        return None
+    return calibration.get('threshold')
+
+
+def calibrate_threshold(scored, target_precision=TARGET_PRECISION):
+    """
+    scored 為 [(第一名的分數, 第一名是否正確)]。回傳能讓「分數 >= 門檻的查詢」正確率至少 target_precision
+    的最低門檻（涵蓋最多查詢），以及該門檻的正確率與涵蓋率；沒有任何門檻達標時門檻為 None。
+    """
+    ordered = sorted(scored, key=lambda item: -item[0])
+    best = (None, None, 0.0)
+    correct = 0
+    for accepted, (score, is_correct) in enumerate(ordered, 1):
+        correct += bool(is_correct)
+        # 同分的查詢必須一起接受或一起拒絕，只在分數改變的位置評估
+        if accepted < len(ordered) and ordered[accepted][0] == score:
+            continue
+        if correct / accepted >= target_precision:
+            best = (score, correct / accepted, accepted / len(ordered))
+    threshold, precision, coverage = best
+    return threshold, precision, coverage
+
+
+class DepartmentClassifier:
+    """
+    模型與科別向量在第一個分類請求時載入；有呼叫 warm_up()（NLP_EAGER_WARMUP 或 /warmup）時就先載入好。
+    科別向量依科別列表快取，科別列表更新後會重新計算一次。
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, threshold=None):
+        self.model_dir = model_dir
+        self.threshold = threshold
+        self.encoder = None
+        self.load_seconds = None
+        self.load_error = None
+        self._label_vectors = {}
+        self._lock = threading.Lock()
+        self.batcher = MicroBatcher(self._classify_batch)
+
+    def _load(self):
+        with self._lock:
+            if self.encoder is None:
+                print(f"正在載入本地 NLP 模型（{self.model_dir}）...")
+                started = time.perf_counter()
+                try:
+                    self.encoder = SentenceEncoder(self.model_dir)
+                except Exception as e:
+                    self.load_error = f"{type(e).__name__}: {e}"
+                    raise
+                self.load_seconds = time.perf_counter() - started
+                self.load_error = None
+                print(f"NLP 模型載入成功！（{self.load_seconds:.1f} 秒）")
+        return self.encoder
+
+    def label_vectors(self, labels):
+        key = tuple(labels)
+        vectors = self._label_vectors.get(key)
+        if vectors is None:
+            vectors = self._load().encode([LABEL_TEMPLATE.format(label) for label in labels])
+            # 科別列表很少變動，只保留最新的一份
+            self._label_vectors = {key: vectors}
+        return vectors
+
+    def warm_up(self, labels=None):
+        """載入模型並算好科別向量，之後的第一個分類請求不必等待"""
+        started = time.perf_counter()
+        self._load()
+        if labels:
+            self.label_vectors(labels)
+        print(f"NLP 服務預熱完成（{len(labels or [])} 個科別，{time.perf_counter() - started:.1f} 秒）")
+
+    def _classify_batch(self, items):
+        texts = self._load().encode([text for text, _ in items])
+        results = []
+        for vector, (_, labels) in zip(texts, items):
+            similarity = self.label_vectors(labels) @ vector
+            weights = np.exp((similarity - similarity.max()) / TEMPERATURE)
+            scores = weights / weights.sum()
+            order = np.argsort(-scores)
+            results.append({'labels': [labels[i] for i in order], 'scores': scores[order].round(4).tolist(),
+                            'threshold': self.threshold})
+        return results
+
+    def classify(self, text, labels, timeout=10):
+        """
+        回傳 {'labels': [...], 'scores': [...], 'threshold': 門檻}，依分數由高到低（labels、scores 與 transformers 的
+        zero-shot pipeline 相同）；第一名的分數達到門檻才算可信，門檻為 None 代表尚未校準
+        """
+        return self.batcher.submit((text, tuple(labels)), timeout)
+
+    def stats(self):
+        batcher = self.batcher
+        return {
+            'model_loaded': self.encoder is not None,
+            'labels_ready': bool(self._label_vectors),
+            'threshold': self.threshold,
+            'load_seconds': None if self.load_seconds is None else round(self.load_seconds, 3),
+            'load_error': self.load_error,
+            'batches': batcher.batches,
+            'requests': batcher.items,
+            'avg_batch_size': round(batcher.items / batcher.batches, 2) if batcher.batches else None,
+            'latency_ms': batcher.latency_ms(),
+        }
+
+
+class NLPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 預設的 listen backlog 只有 5，多個 worker 同時送出時會等 TCP 重送（約 1 秒）
+    request_queue_size = 128
+
+
+def serve(host, port, classifier, labels=None, warm_up=EAGER_WARMUP):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._reply(200, classifier.stats())
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path == '/warmup':
+                self._warm_up()
+                return
+            if self.path != '/classify':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                text, labels = body['text'], body['labels']
+            except (ValueError, KeyError, TypeError):
+                self._reply(400, {'error': '請提供 text 與 labels'})
+                return
+            if not text or not labels:
+                self._reply(400, {'error': '請提供 text 與 labels'})
+                return
+            try:
+                self._reply(200, classifier.classify(text, labels))
+            except Exception as e:
+                self._reply(500, {'error': f"{type(e).__name__}: {e}"})
+
+        def _warm_up(self):
+            """web worker 載入（或重新載入）資料後送來新的科別列表，先算好向量"""
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                classifier.warm_up(body.get('labels'))
+            except (ValueError, AttributeError) as e:
+                self._reply(400, {'error': f'格式錯誤: {e}'})
+                return
+            except Exception as e:
+                self._reply(500, {'error': f"{type(e).__name__}: {e}"})
+                return
+            self._reply(200, classifier.stats())
+
+    server = NLPServer((host, port), Handler)
+    if not warm_up:
+        print(f"本地 NLP 服務啟動於 http://{host}:{port}（模型在第一個分類請求時載入）")
+        server.serve_forever()
+        return
+    print(f"本地 NLP 服務啟動於 http://{host}:{port}（模型在背景載入中）")
+
+    def background_warm_up():
+        try:
+            classifier.warm_up(labels)
+        except Exception as e:
+            print(f"NLP 服務預熱失敗，改由第一個請求載入: {e}")
+    threading.Thread(target=background_warm_up, name='nlp-warmup', daemon=True).start()
+    server.serve_forever()
+
+
+def read_labels(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"找不到 {path}，預熱時只載入模型。")
+        return None
+
+
+def calibrate(labelled_path, labels, model_dir=MODEL_DIR, target_precision=TARGET_PRECISION):
+    """
+    labelled_path 為 JSON Lines，每行 {"text": 症狀描述, "department": 正確科別}。
+    用目前的模型與 TEMPERATURE 分類每一筆，找出達到 target_precision 的最低門檻，寫到 model_dir/calibration.json。
+    """
+    if not labels:
+        raise SystemExit('校準需要科別列表，請用 --labels 指定 departments_list.json')
+    print(f"reading {labelled_path} ...")
+    with open(labelled_path, 'r', encoding='utf-8') as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+    classifier = DepartmentClassifier(model_dir)
+    scored = []
+    for start in range(0, len(examples), MAX_BATCH):
+        batch = examples[start:start + MAX_BATCH]
+        results = classifier._classify_batch([(example['text'], tuple(labels)) for example in batch])
+        scored += [(result['scores'][0], result['labels'][0] == example['department'])
+                   for example, result in zip(batch, results)]
+    threshold, precision, coverage = calibrate_threshold(scored, target_precision)
+    accuracy = sum(is_correct for _, is_correct in scored) / len(scored)
+    print(f"{len(scored)} queries, top-1 accuracy {accuracy:.3f}")
+    if threshold is None:
+        print(f"no threshold reaches precision {target_precision}; the local model will always defer to Gemini")
+    else:
+        print(f"threshold {threshold:.4f}: precision {precision:.3f}, answers {coverage:.1%} of queries locally")
+    path = os.path.join(model_dir, CALIBRATION_FILE)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'threshold': threshold, 'temperature': TEMPERATURE, 'target_precision': target_precision,
+                   'precision': precision, 'coverage': coverage, 'queries': len(scored)}, f, indent=2)
+    print(f"successfully saved {path}")
+
+
+def export_model(model_name, model_dir=MODEL_DIR):
+    """把 Hugging Face 上的句向量模型匯出成 ONNX，再做動態 int8 量化；只在匯出時需要 optimum"""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from transformers import AutoTokenizer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"reading {model_name} ...")
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(tmp)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp)
+        os.makedirs(model_dir, exist_ok=True)
+        quantize_dynamic(os.path.join(tmp, 'model.onnx'), os.path.join(model_dir, MODEL_FILE),
+                         weight_type=QuantType.QInt8)
+        shutil.copy(os.path.join(tmp, TOKENIZER_FILE), os.path.join(model_dir, TOKENIZER_FILE))
+    size = os.path.getsize(os.path.join(model_dir, MODEL_FILE)) / 1e6
+    print(f"successfully saved {model_dir}/{MODEL_FILE} ({size:.1f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='本地 NLP 科別分類服務')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5002)
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--labels', default=LABELS_FILE, help='科別列表（啟動時預熱、校準時的分類候選）')
+    parser.add_argument('--export', metavar='MODEL', help='匯出並量化指定的 Hugging Face 模型後結束')
+    parser.add_argument('--calibrate', metavar='JSONL', help='用標註過的症狀（{"text", "department"}）校準信心度門檻後結束')
+    parser.add_argument('--target-precision', type=float, default=TARGET_PRECISION, help='校準時要求的正確率')
+    parser.add_argument('--warm-up', action='store_true', default=EAGER_WARMUP,
+                        help='啟動後就在背景載入模型（預設等第一個分類請求才載入；也可以設定 NLP_EAGER_WARMUP=1）')
+    args = parser.parse_args()
+    if args.export:
+        export_model(args.export, args.model_dir)
+    elif args.calibrate:
+        calibrate(args.calibrate, read_labels(args.labels), args.model_dir, args.target_precision)
+    else:
+        classifier = DepartmentClassifier(args.model_dir, load_threshold(args.model_dir))
+        serve(args.host, args.port, classifier, read_labels(args.labels) if args.warm_up else None, args.warm_up)
@@ -0,0 +1,74 @@
+import json
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+TAIPEI = ZoneInfo('Asia/Taipei')
+
+# 與 preprocessedData/get_service_hours.py 相同的位元配置：第 (時段 * 7 + 星期) 位代表有看診
+# 時段 0 = 上午、1 = 下午、2 = 晚上；星期 0 = 星期一
+PERIODS = [
+    (8, 12),   # 上午
+    (12, 18),  # 下午
+    (18, 22),  # 晚上
+]
+
+
+def load_schedule(path='service_hours.json'):
+    """讀取建置時編好的 {機構代碼: 21-bit 看診遮罩}"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            schedule = json.load(f)
+        print(f"成功載入 {len(schedule)} 筆院所固定服務時段！")
+        return schedule
+    except FileNotFoundError:
+        print(f"找不到 {path}，營業時間篩選將不會有結果。請先執行 preprocessedData/get_service_hours.py")
+    except Exception as e:
+        print(f"讀取 {path} 時發生錯誤: {e}")
+    return {}
+
+
+def schedule_masks(store, schedule):
+    """依照資料列順序排好的看診遮罩；沒有服務時段資料的院所為 0"""
+    masks = np.zeros(store.size, dtype=np.uint32)
+    if schedule:
+        for row in range(store.size):
+            masks[row] = schedule.get(store.text('機構代碼', row), 0)
+    return masks
+
+
+def parse_time(value):
+    """解析 open_at 參數（ISO 8601），沒有時區時視為台灣時間"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=TAIPEI)
+    return moment.astimezone(TAIPEI)
+
+
+def slot_bit(moment):
+    """回傳該時間所在的看診時段位元；不在任何時段內（深夜、清晨）則回傳 None"""
+    for period, (start, end) in enumerate(PERIODS):
+        if start <= moment.hour < end:
+            return period * 7 + moment.weekday()
+    return None
+
+
+def open_rows(rows, masks, moment):
+    """從候選列中挑出在該時間有看診的院所，回傳布林遮罩"""
+    bit = slot_bit(moment)
+    if bit is None:
+        return np.zeros(len(rows), dtype=bool)
+    return (masks[rows] & np.uint32(1 << bit)) != 0
+
+
+def requested_time(args):
+    """
+    由查詢參數取得要篩選的時間：open_at=ISO 時間優先，其次 open_now=1 代表現在；
+    兩者都沒有時回傳 None。格式錯誤會拋出 ValueError。
+    """
+    if args.get('open_at'):
+        return parse_time(args['open_at'])
+    if args.get('open_now', '').lower() in ('1', 'true', 'yes'):
+        return datetime.now(TAIPEI)
+    return None
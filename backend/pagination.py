@@ -0,0 +1,55 @@
+import numpy as np
+
+SORT_MODES = ('distance', 'open_first')
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+
+def parse_page(args):
+    """讀取 limit 與 cursor（目前是結果的起始位置）；格式錯誤會拋出 ValueError"""
+    limit = int(args.get('limit', DEFAULT_LIMIT))
+    offset = int(args.get('cursor') or 0)
+    if not 1 <= limit <= MAX_LIMIT or offset < 0:
+        raise ValueError('limit 或 cursor 超出範圍')
+    return offset, limit
+
+
+def sort_keys(sort_mode, distances=None, is_open=None):
+    """
+    依排序方式產生排序鍵；回傳 None 代表維持資料原本的順序。
+    open_first：營業中的排前面，其次依距離（沒有距離時依原順序）。
+    """
+    if sort_mode == 'distance':
+        return distances
+    if sort_mode == 'open_first':
+        secondary = distances if distances is not None else np.arange(len(is_open), dtype=float)
+        return np.where(is_open, 0.0, 1e9) + secondary
+    return None
+
+
+def select_page(keys, offset, limit, total=None):
+    """
+    回傳排序後第 offset 到 offset + limit 筆的索引。
+    只用 argpartition 挑出前 offset + limit 筆再排序，不對全部結果做完整排序。
+    """
+    total = len(keys) if total is None else total
+    need = min(offset + limit, total)
+    if offset >= need:
+        return np.empty(0, dtype=np.int64)
+    if keys is None:
+        return np.arange(offset, need)
+
+    if need < len(keys):
+        boundary = keys[np.argpartition(keys, need - 1)[need - 1]]
+        # 和第 need 筆的鍵相同的可能不只一筆，argpartition 會任意挑，全部納入後再依原順序決定，分頁才不會重複或漏掉
+        candidates = np.flatnonzero(keys <= boundary)
+    else:
+        candidates = np.arange(len(keys))
+    # 距離相同時依原順序排，讓分頁結果穩定
+    ordered = candidates[np.lexsort((candidates, keys[candidates]))]
+    return ordered[offset:need]
+
+
+def next_cursor(offset, limit, total):
+    """還有下一頁時回傳下一頁的 cursor，否則回傳空字串"""
+    return str(offset + limit) if offset + limit < total else ''
@@ -0,0 +1,95 @@
+import math
+import threading
+from collections import Counter, OrderedDict
+
+from spatial_index import haversine_km, valid_coordinates
+
+ENTRY_OVERHEAD = 256  # 每筆的鍵、dict 節點等額外記憶體（估計值）
+GRID_DEG = 0.005  # 附近搜尋的位置對齊到約 500 公尺的網格
+RADIUS_STEP_KM = 0.5
+
+
+def snapped_circle(lat, lon, radius_km):
+    """
+    附近搜尋的快取鍵：位置對齊到最近的網格中心、半徑無條件進位到 RADIUS_STEP_KM 的倍數。
+    回傳 (網格座標, 半徑級距, 網格中心緯度, 網格中心經度, 涵蓋半徑)；以網格中心為圓心、涵蓋半徑畫的圓
+    一定包含這一格內任何位置、級距內任何半徑的查詢圓，結果再用實際位置與半徑過濾即可。
+    經緯度超出範圍或半徑是 NaN 時拋出 ValueError。
+    """
+    if not valid_coordinates(lat, lon) or math.isnan(radius_km):
+        raise ValueError(f'無效的查詢位置: ({lat}, {lon}) 半徑 {radius_km}')
+    grid = (round(lat / GRID_DEG), round(lon / GRID_DEG))
+    center_lat, center_lon = grid[0] * GRID_DEG, grid[1] * GRID_DEG
+    bucket = math.ceil(radius_km / RADIUS_STEP_KM) * RADIUS_STEP_KM if math.isfinite(radius_km) else radius_km
+    # 格子內離中心最遠的是靠赤道那一側的角落（經度一度比較長）
+    half = GRID_DEG / 2
+    corner_lat = center_lat - half if center_lat >= 0 else center_lat + half
+    margin = float(haversine_km(center_lat, center_lon, corner_lat, center_lon + half))
+    return grid, bucket, center_lat, center_lon, bucket + margin + 1e-6
+
+
+class ResultCache:
+    """
+    熱門搜尋的候選列位置快取：以位元組數為上限的 LRU，太大的結果（超過上限的 1/8）不快取，
+    避免一個大範圍的查詢把其他熱門查詢全部擠掉。
+    列位置只對建出它的那份 Snapshot 有效：reset() 換成新的 Snapshot 時整個清空，
+    get／put 帶的 Snapshot 不是目前這份（重新載入前就開始的請求）時直接略過。
+    鍵的第一個元素是查詢種類（area、nearby），命中率依種類分開統計。
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.counters = Counter()
+        self._snapshot = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reset(self, snapshot):
+        with self._lock:
+            self._snapshot = snapshot
+            self._entries.clear()
+            self.bytes = 0
+            self.counters['invalidations'] += 1
+
+    def get(self, snapshot, key):
+        """回傳快取的陣列；沒有時回傳 None"""
+        with self._lock:
+            if snapshot is not self._snapshot:
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters[(key[0], 'misses')] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters[(key[0], 'hits')] += 1
+            return entry[0]
+
+    def put(self, snapshot, key, value):
+        size = value.nbytes + ENTRY_OVERHEAD
+        if size > self.max_bytes // 8:
+            return
+        with self._lock:
+            if snapshot is not self._snapshot:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            stats = {'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                     'evictions': counters.get('evictions', 0), 'invalidations': counters.get('invalidations', 0)}
+        for kind in sorted({key[0] for key in counters if isinstance(key, tuple)}):
+            hits = counters.get((kind, 'hits'), 0)
+            misses = counters.get((kind, 'misses'), 0)
+            stats[kind] = {'hits': hits, 'misses': misses,
+                           'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0}
+        return stats
@@ -0,0 +1,823 @@
+"""
+資料載入與各 API 的核心邏輯。
+Flask（app.py）與 ASGI（asgi_app.py）兩種伺服器模式共用這裡的函式，
+每個函式都回傳 (body, status, headers)，由各自的框架轉成回應。
+"""
+import json
+from datetime import datetime
+import numpy as np
+import os
+import threading
+import requests
+from dotenv import load_dotenv
+
+from spatial_index import GridIndex, haversine_km, valid_coordinates
+from department_index import DepartmentIndex, CodeIndex, MATCH_MODES, DEFAULT_MATCH, intersect_rows
+from area_index import AreaIndex, normalize_area
+from clinic_store import ClinicStore, load_store, encode_json, distance_values, CODE_COLUMNS, CSV_PATH, STORE_PATH
+from geocode_cache import GeocodeCache, MISS
+from local_geocoder import LocalGeocoder
+from cluster_pyramid import ClusterPyramid, MIN_ZOOM, CLUSTER_MAX_ZOOM
+from result_cache import ResultCache, snapped_circle
+from opening_hours import load_schedule, schedule_masks, open_rows, requested_time, TAIPEI
+from keyword_matcher import SymptomMatcher
+from pagination import SORT_MODES, parse_page, sort_keys, select_page, next_cursor
+from static_payload import StaticPayload
+from snapshot import Snapshot, SnapshotManager
+import metrics
+from metrics import span
+
+load_dotenv()
+# 本地 NLP 在另一個行程（nlp_service.py）裡執行，所有 worker 共用一份模型；沒有設定時只用關鍵字與 Gemini
+NLP_SERVICE_URL = os.getenv('NLP_SERVICE_URL')
+NLP_TIMEOUT = float(os.getenv('NLP_TIMEOUT', '2'))  # 秒；超過就直接改問 Gemini
+NLP_WARMUP_TIMEOUT = 120  # 秒；預熱要載入模型，在背景執行，不受 NLP_TIMEOUT 限制
+# 預設讓 NLP 服務在第一次分類時才載入模型；設定後每次載入資料都請它先預熱（與 nlp_service.py 同一個環境變數）
+NLP_EAGER_WARMUP = os.getenv('NLP_EAGER_WARMUP', '').lower() in ('1', 'true', 'yes')
+nlp = bool(NLP_SERVICE_URL)
+
+if nlp:
+    origins = [
+        'https://projmednav.onrender.com',
+        'https://mednav.sunhow123.cc',
+    ]
+else:
+    origins = ['*']
+
+API_KEY = os.getenv("API_KEY")
+GEOCODE_API_URL = os.getenv("GEOCODE_API_URL", "https://maps.googleapis.com/maps/api/geocode/json")
+GEOCODE_ERROR_MESSAGE = '地理編碼服務暫時無法使用，請稍後再試。'
+SUGGEST_BODY_ERROR = '請以 JSON 物件提供症狀描述，例如 {"symptoms": "頭痛"}'
+RESPONSE_FORMATS = ('records', 'columns')
+BATCH_MAX_QUERIES = 20
+MAP_MAX_CELLS = 1024  # 地圖一次最多涵蓋的聚合格子數，範圍太大時改用較粗的一層
+MAP_MAX_CLINICS = 300  # 畫面內的院所不超過這個數量時直接回傳院所，不聚合
+GEOCODE_MONTHLY_QUOTA = 10000  # google geocoding API 一個月免費一萬筆
+
+
+# --- 資料載入 ---
+# 院所資料與由它建出的索引都放在一個 Snapshot 裡；來源檔案變更或呼叫 /admin/reload 時，
+# 在背景建好新的一份再整個替換，不必重啟 worker。進行中的請求會用舊的那份做完。
+SNAPSHOT_FILES = [STORE_PATH, CSV_PATH, 'service_hours.json', 'departments_list.json', 'admin_districts.json',
+                  'department_codes.json', 'department_aliases.json']
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv('SNAPSHOT_CHECK_INTERVAL', '5'))  # 秒；0 代表不自動檢查
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+RESULT_CACHE_MB = float(os.getenv('RESULT_CACHE_MB', '32'))  # 熱門搜尋候選結果快取的上限；0 代表不快取
+# 載入時完整檢查 clinic_store.bin 的 checksum；會讀過整個檔案，預設只檢查表頭與大小（建置時已經檢查過）
+STORE_VERIFY = os.getenv('STORE_VERIFY', '').lower() in ('1', 'true', 'yes')
+
+
+def load_specialties():
+    """專科名稱（department_codes.json）與常用別名（department_aliases.json）→ 診療科別代碼列表"""
+    specialties = {}
+    try:
+        with open('department_codes.json', 'r', encoding='utf-8') as f:
+            for code, name in json.load(f).items():
+                specialties.setdefault(name, []).append(code)
+        with open('department_aliases.json', 'r', encoding='utf-8') as f:
+            for alias, codes in json.load(f).items():
+                specialties[alias] = codes
+    except Exception as e:
+        print(f"讀取專科代碼對照表時發生錯誤: {e}")
+    return specialties
+
+
+def build_snapshot():
+    # 優先 memmap 開啟 clinic_store.py 建好的 clinic_store.bin，沒有的話退回讀 CSV
+    try:
+        store = load_store(verify=STORE_VERIFY)
+    except FileNotFoundError:
+        print("錯誤：找不到 medical_data_geocoded.csv 檔案！請確認檔名與路徑。")
+        store = ClinicStore.empty_store()
+    except Exception as e:
+        print(f"讀取院所資料時發生未知錯誤: {e}")
+        store = ClinicStore.empty_store()
+
+    try:
+        with open('departments_list.json', 'r', encoding='utf-8') as f:
+            # 我們將使用這個科別列表，作為 NLP 模型的分類候選標籤
+            departments_list = json.load(f)
+        print("成功載入科別列表！")
+    except Exception as e:
+        print(f"讀取 departments_list.json 時發生錯誤: {e}")
+        departments_list = []
+
+    try:
+        with open('admin_districts.json', 'r', encoding='utf-8') as f:
+            area_data = json.load(f)
+    except Exception as e:
+        print(f"讀取 admin_districts.json 時發生錯誤: {e}")
+        area_data = {}
+
+    # 建立空間索引、科別倒排索引與縣市區索引，查詢時不再逐筆掃描整個資料表
+    spatial_index = GridIndex(store.latitude, store.longitude)
+    department_index = DepartmentIndex.from_mask(store.dept_mask, store.departments)
+    area_index = AreaIndex.from_codes(store.area_codes, store.areas, area_data)
+    if not store.empty:
+        print(f"索引建立完成：{spatial_index.size} 筆有座標的院所、"
+              f"{len(department_index.postings)} 個科別、{len(area_index.by_value)} 個縣市區名。")
+
+    # 固定服務時段：每間院所一個 21-bit 遮罩，營業時間篩選只需要做位元運算
+    # build_dataset.py 建的資料檔已經合併好遮罩；舊的資料檔或 CSV 才另外讀 service_hours.json
+    if store.schedule is not None:
+        service_hours = store.schedule
+    else:
+        service_hours = schedule_masks(store, load_schedule())
+
+    # 服務項目明細的診療科別代碼與服務項目代碼（build_dataset.py 建的資料檔才有），專科篩選用代碼取交集，不比對科別文字
+    department_code_index = CodeIndex.from_store(store, CODE_COLUMNS[0])
+    service_item_index = CodeIndex.from_store(store, CODE_COLUMNS[1])
+    specialties = load_specialties()
+
+    # 離線地理編碼：院所地址本身就有座標，常見的查詢不必呼叫 Google
+    geocoder = LocalGeocoder.from_store(store, area_data)
+
+    # 地圖瀏覽用的多層聚合，平移、縮放時只需要查表
+    cluster_pyramid = ClusterPyramid(store.latitude, store.longitude, store.dept_mask, store.departments)
+
+    return Snapshot(store, departments_list, area_data, spatial_index, department_index, area_index, service_hours,
+                    department_code_index, service_item_index, specialties, geocoder, cluster_pyramid)
+
+
+# 【新增】在伺服器啟動時，把症狀對照表與急症對照表編成同一個比對自動機，檔案修改後會自動重新編譯
+symptom_matcher = SymptomMatcher('emergency_keywords.json', 'symptom_map.json')
+
+# 地理編碼快取：院所本身的地址直接用資料檔裡的座標，不必再呼叫 Google
+geocode_cache = GeocodeCache()
+
+
+# 熱門搜尋（同樣的縣市區＋科別、車站附近等固定地點）的候選列位置；資料重新載入時整個清空
+result_cache = ResultCache(int(RESULT_CACHE_MB * 1024 * 1024))
+
+
+def nlp_warm_up(departments_list):
+    """請 NLP 服務先載入模型並算好這份科別列表的向量，之後的分類請求才不會因為載入超過 NLP_TIMEOUT"""
+    try:
+        requests.post(f"{NLP_SERVICE_URL}/warmup", json={'labels': departments_list},
+                      timeout=NLP_WARMUP_TIMEOUT).raise_for_status()
+    except Exception as e:
+        print(f"本地 NLP 服務預熱失敗: {e}")
+
+
+def on_snapshot_swap(snapshot):
+    print(f"地理編碼快取預載 {geocode_cache.seed_from_store(snapshot.store)} 筆院所地址。")
+    result_cache.reset(snapshot)
+    if nlp and NLP_EAGER_WARMUP and snapshot.departments_list:
+        threading.Thread(target=nlp_warm_up, args=(snapshot.departments_list,), name='nlp-warmup', daemon=True).start()
+
+
+snapshots = SnapshotManager(build_snapshot, SNAPSHOT_FILES, SNAPSHOT_CHECK_INTERVAL, on_swap=on_snapshot_swap)
+snapshots.start_watching()
+
+
+def snapshot_metrics():
+    """目前資料版本的建置時間與記憶體用量"""
+    info = snapshots.current.info()
+    return [
+        ('mednav_snapshot_info', 'gauge', '目前使用的資料版本', {'version': info['version']}, 1),
+        ('mednav_snapshot_rows', 'gauge', '目前資料版本的院所筆數', {}, info['rows']),
+        ('mednav_snapshot_build_seconds', 'gauge', '目前資料版本的建置時間', {}, info['build_seconds']),
+        ('mednav_snapshot_bytes', 'gauge', '目前資料版本的陣列大小（store 為 memmap 時由作業系統快取共用）',
+         {'part': 'store'}, info['store_bytes']),
+        ('mednav_snapshot_bytes', 'gauge', '', {'part': 'index'}, info['index_bytes']),
+    ]
+
+
+def geocode_metrics():
+    """地理編碼快取的計數與本月 Google API 用量（輸出 /metrics 時才讀取）"""
+    stats = geocode_cache.stats()
+    samples = [
+        ('mednav_cache_hits_total', 'counter', '', {'cache': f'geocode_{tier}'}, stats[f'{tier}_hits'])
+        for tier in ('seed', 'memory', 'sqlite', 'negative')
+    ]
+    samples.append(('mednav_cache_misses_total', 'counter', '', {'cache': 'geocode'}, stats['misses']))
+    samples.append(('mednav_geocode_sqlite_errors_total', 'counter',
+                    '地理編碼快取資料庫讀寫失敗、改用記憶體快取的次數', {}, stats['sqlite_errors']))
+    samples.append(('mednav_geocode_upstream_calls_total', 'counter',
+                    '這個 worker 啟動後呼叫 Google Geocoding API 的次數', {}, stats['upstream_calls']))
+    samples.append(('mednav_geocode_quota_used', 'gauge',
+                    '本月已使用的 Google Geocoding API 呼叫次數（所有 worker 共用）', {}, geocode_cache.monthly_upstream_calls()))
+    samples.append(('mednav_geocode_quota_limit', 'gauge',
+                    'Google Geocoding API 每月免費額度', {}, GEOCODE_MONTHLY_QUOTA))
+    return samples
+
+
+def result_cache_metrics():
+    """搜尋結果快取的命中次數與記憶體用量"""
+    stats = result_cache.stats()
+    samples = []
+    for kind in ('area', 'nearby'):
+        counts = stats.get(kind, {'hits': 0, 'misses': 0})
+        samples.append(('mednav_cache_hits_total', 'counter', '', {'cache': f'search_{kind}'}, counts['hits']))
+        samples.append(('mednav_cache_misses_total', 'counter', '', {'cache': f'search_{kind}'}, counts['misses']))
+    samples.append(('mednav_result_cache_bytes', 'gauge', '搜尋結果快取目前的大小', {}, stats['bytes']))
+    samples.append(('mednav_result_cache_entries', 'gauge', '搜尋結果快取目前的筆數', {}, stats['entries']))
+    samples.append(('mednav_result_cache_evictions_total', 'counter', '搜尋結果快取因容量上限淘汰的筆數', {},
+                    stats['evictions']))
+    return samples
+
+
+metrics.register_collector(geocode_metrics)
+metrics.register_collector(result_cache_metrics)
+metrics.register_collector(snapshot_metrics)
+
+if nlp:
+    print(f"使用本地 NLP 服務 {NLP_SERVICE_URL}（模型在該服務第一次分類時載入）。")
+else:
+    print("未設定 NLP_SERVICE_URL，本地 NLP 停用，將依賴關鍵字與 Gemini API。")
+
+# 連線重複使用；多個執行緒共用同一個 Session 只做 POST 是安全的
+nlp_session = requests.Session()
+
+
+def nlp_classifier(symptom_text, departments_list):
+    """請本地 NLP 服務分類；服務沒有回應或出錯時回傳 None，由 Gemini 接手"""
+    try:
+        res = nlp_session.post(f"{NLP_SERVICE_URL}/classify", json={'text': symptom_text, 'labels': departments_list},
+                               timeout=NLP_TIMEOUT)
+        res.raise_for_status()
+        result = res.json()
+    except Exception as e:
+        print(f"本地 NLP 服務發生錯誤: {e}")
+        metrics.inc('mednav_nlp_requests_total', outcome='error')
+        return None
+    metrics.inc('mednav_nlp_requests_total', outcome='success')
+    return result
+
+
+def paged_result(store, rows, distances, offset, limit, total, response_format='records'):
+    """
+    回傳院所列表；分頁資訊放在 header，維持原本回傳陣列的格式。
+    內容由 store 預先編好的 JSON 片段直接接成，不必每次為每間院所建 dict 再 jsonify；
+    format=columns 時改回傳 {欄位: [值, ...]}。
+    """
+    if response_format == 'columns':
+        body = encode_json(store.columns(rows, distances)).encode('utf-8')
+    else:
+        body = store.records_json(rows, distances)
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Total-Count': str(total),
+        'X-Next-Cursor': next_cursor(offset, limit, total),
+    }
+    return body, 200, headers
+
+
+def error(message, status=400):
+    return {'error': message}, status, {}
+
+
+# --- 資料版本管理 ---
+def admin_authorized(token):
+    """沒有設定 ADMIN_TOKEN 時管理端點一律關閉"""
+    return bool(ADMIN_TOKEN) and token == ADMIN_TOKEN
+
+
+def snapshot_info(token):
+    if not admin_authorized(token):
+        return error('未授權', 403)
+    return dict(snapshots.info(), result_cache=result_cache.stats()), 200, {}
+
+
+def reload_snapshot(token):
+    """在這個請求的執行緒上重建並替換資料（只影響收到請求的 worker；其他 worker 會在檔案變更時自己重新載入）"""
+    if not admin_authorized(token):
+        return error('未授權', 403)
+    swapped, snapshot = snapshots.reload('/admin/reload')
+    return dict(snapshots.info(), reloaded=swapped), 200 if swapped else 500, {}
+
+
+# --- 地理編碼 ---
+# 回應的 tier 標示由哪一層回答：本地地址樹的 address、street_number、lane、road、district、city，
+# 之前問過 Google 的快取 cache，或這次才問的 google
+def geocoded(location, tier):
+    metrics.inc('mednav_geocode_tier_total', tier=tier)
+    return dict(location, tier=tier), 200, {}
+
+
+def geocode_from_cache(address):
+    """本地地址樹有把握或快取命中時回傳結果；都沒有時回傳 None，由呼叫端去問 Google"""
+    with span('geocode_local'):
+        location, tier, confident = snapshots.current.geocoder.lookup(address)
+    if confident:
+        return geocoded(location, tier)
+    cached = geocode_cache.get(address)
+    if cached is None:
+        return geocode_fallback(address) or error("無法解析地址: ZERO_RESULTS", 404)
+    if cached is not MISS:
+        return geocoded(cached, 'cache')
+    return None
+
+
+def geocode_fallback(address):
+    """Google 查不到或無法使用時，退回本地較粗略的結果（路段或行政區的中心點）；也沒有時回傳 None"""
+    location, tier, _ = snapshots.current.geocoder.lookup(address)
+    if location is None:
+        return None
+    return geocoded(location, tier)
+
+
+def geocode_params(address):
+    geocode_cache.count_upstream_call()
+    return { 'address': address, 'key': API_KEY, 'language': 'zh-TW'}
+
+
+def geocode_from_response(address, data):
+    """解析 Google Geocoding API 的回應並寫入快取"""
+    if data['status'] == 'OK':
+        location = data['results'][0]['geometry']['location']
+        geocode_cache.put(address, location)
+        return geocoded(location, 'google') # 回傳 {'lat': ..., 'lng': ..., 'tier': 'google'}
+    if data['status'] == 'ZERO_RESULTS':
+        geocode_cache.put(address, None)
+    return geocode_fallback(address) or error(f"無法解析地址: {data['status']}", 404)
+
+
+# --- 靜態資料 ---
+# 科別與行政區列表每次開頁面都會抓，啟動時先序列化、壓縮好，檔案有變動才重新載入
+static_payloads = {
+    'departments_list.json': StaticPayload('departments_list.json'),
+    'admin_districts.json': StaticPayload('admin_districts.json'),
+}
+
+
+def static_json(filename, missing_message, accept_encoding='', if_none_match=''):
+    """回傳預先編碼好的 bytes；讀檔失敗時回傳錯誤訊息"""
+    payload = static_payloads[filename]
+    result = payload.respond(accept_encoding, if_none_match)
+    if result is not None:
+        if result[1] == 304:
+            metrics.inc('mednav_cache_hits_total', cache='static_etag')
+        return result
+    if isinstance(payload.error, FileNotFoundError):
+        return error(missing_message, 404)
+    return error(str(payload.error), 500)
+
+
+# --- 依症狀推薦科別 ---
+def suggest_locally(symptom_text):
+    """
+    執行不需要呼叫外部服務的層級（急症判斷、症狀對照表、本地 NLP）。
+    回傳 (結果, 備援科別)；結果為 None 代表需要再請求 Gemini，Gemini 失敗或斷路時回傳備援科別：
+    本地 NLP 信心度不足時的第一名，沒有使用本地 NLP 或它沒有回應時為空列表。
+    """
+    # 掃描一次症狀文字，同時取得急症與症狀對照表的所有命中（掃描時間計入 emergency_match）
+    with span('emergency_match'):
+        emergency_hits, department_hits = symptom_matcher.match(symptom_text)
+
+    # --- 【核心修改】層級 0: 緊急狀況判斷 ---
+    if emergency_hits:
+        keyword = emergency_hits[0]['keyword']
+        print(f"偵測到緊急關鍵字: {keyword}")
+        # 回傳一個特殊的緊急狀態物件
+        return ({"emergency": True, "matched_keyword": keyword, "matches": emergency_hits}, 200, {}), None
+
+    # --- 層級 1: 優先使用 symptom_map.json 進行關鍵字匹配 ---
+    with span('symptom_map'):
+        found_departments = list(dict.fromkeys(hit['department'] for hit in department_hits))
+    if found_departments:
+        print(f"Symptom Map 高優先度分析結果: {found_departments}")
+        return ({'departments': found_departments, 'matches': department_hits}, 200, {}), None
+    print("關鍵字無匹配，轉交其他模型進行分析...")
+    fallback = []
+
+    # --- 層級 2: 如果關鍵字無匹配，且非雲端部屬模式，則使用本地 NLP 模型 ---
+    if nlp:
+        print("非雲端部屬，檢查 NLP 服務。")
+
+        departments_list = snapshots.current.departments_list
+        if not departments_list:
+            return error("關鍵字無匹配，且 NLP 服務未準備就緒", 500), None
+
+        print("使用本地 NLP 模型進行分析...")
+        with span('nlp'):
+            result = nlp_classifier(symptom_text, departments_list)
+
+        if result is not None:
+            top_label = result['labels'][0]
+            top_score = result['scores'][0]
+            # 門檻由 NLP 服務依模型校準；還沒校準（None）時一律再問 Gemini
+            threshold = result.get('threshold')
+
+            if threshold is not None and top_score >= threshold:
+                print(f"本地 NLP 分析結果: {top_label} (信心分數: {top_score:.2f})")
+                metrics.inc('mednav_nlp_requests_total', outcome='confident')
+                return ({'departments': [top_label]}, 200, {}), None
+            # 信心度不足仍是最接近的猜測，Gemini 無法使用時總比沒有答案好
+            fallback = [top_label]
+
+    # --- 層級 3: 如果本地模型信心度不足，則請求 Gemini 專家分析 ---
+    print("本地 NLP 模型信心度不足，或未使用本地 NLP ，請求 Gemini API 進行分析...")
+    return None, fallback
+
+
+# --- 搜尋 ---
+class SharedLookups:
+    """
+    一次請求內的索引查詢結果。批次搜尋時，相同的縣市區、科別只查一次；
+    同一個位置的半徑查詢用批次中最大的半徑做一次，各查詢再依自己的半徑過濾距離。
+    """
+
+    def __init__(self, snapshot, radius_by_location=None):
+        self.snapshot = snapshot
+        self.radius_by_location = radius_by_location or {}
+        self._areas = {}
+        self._departments = {}
+        self._codes = {}
+        self._candidates = {}
+        self._radius = {}
+
+    def area_rows(self, city, district):
+        key = (city, district)
+        if key not in self._areas:
+            self._areas[key] = self.snapshot.area_index.lookup(city, district)
+        return self._areas[key]
+
+    def department_rows(self, query, match):
+        key = (query, match)
+        if key not in self._departments:
+            self._departments[key] = self.snapshot.department_index.lookup(query, match)
+        return self._departments[key]
+
+    def code_rows(self, index_name, codes):
+        key = (index_name, codes)
+        if key not in self._codes:
+            self._codes[key] = getattr(self.snapshot, index_name).lookup(codes)
+        return self._codes[key]
+
+    def candidate_rows(self, query, match, code_filters):
+        """科別文字與各個代碼條件的列位置取交集；沒有帶科別時只用代碼條件"""
+        key = (query, match, code_filters)
+        if key not in self._candidates:
+            parts = [self.department_rows(query, match)] if query else []
+            parts += [self.code_rows(index_name, codes) for index_name, codes in code_filters]
+            rows = parts[0]
+            for part in parts[1:]:
+                rows = intersect_rows(rows, part)
+            self._candidates[key] = rows
+        return self._candidates[key]
+
+    def area_department_rows(self, city, district, query, match, code_filters):
+        """縣市區內符合科別且有座標的列位置；同樣的（正規化後）縣市區與科別條件由 result_cache 共用"""
+        key = ('area', normalize_area(city), normalize_area(district), query, match, code_filters)
+        rows = result_cache.get(self.snapshot, key)
+        if rows is None:
+            store = self.snapshot.store
+            with span('area_filter'):
+                area_rows = self.area_rows(city, district)
+            with span('department_filter'):
+                rows = intersect_rows(area_rows, self.candidate_rows(query, match, code_filters))
+                rows = rows[np.isfinite(store.latitude[rows]) & np.isfinite(store.longitude[rows])]
+            result_cache.put(self.snapshot, key, rows)
+        return rows
+
+    def nearby_rows(self, lat, lon, radius_km, query, match, code_filters):
+        """
+        半徑內符合科別的列位置的超集合（依列位置排序）：以對齊後的網格中心與半徑級距查詢，
+        同一格、同一級距的查詢由 result_cache 共用，呼叫端再用實際位置算距離過濾
+        """
+        grid, bucket, center_lat, center_lon, reach = snapped_circle(lat, lon, radius_km)
+        key = ('nearby', grid, bucket, query, match, code_filters)
+        rows = result_cache.get(self.snapshot, key)
+        if rows is None:
+            with span('department_filter'):
+                department_rows = self.candidate_rows(query, match, code_filters)
+            rows, _ = self.query_radius(center_lat, center_lon, reach)
+            rows = rows[np.isin(rows, department_rows, assume_unique=True)]
+            result_cache.put(self.snapshot, key, rows)
+        return rows
+
+    def query_radius(self, lat, lon, radius_km):
+        key = (lat, lon)
+        cached = self._radius.get(key)
+        if cached is None or cached[0] < radius_km:
+            widest = max(radius_km, self.radius_by_location.get(key, radius_km))
+            cached = self._radius[key] = (widest, *self.snapshot.spatial_index.query_radius(lat, lon, widest))
+        widest, rows, distances = cached
+        if radius_km < widest:
+            # query_radius 的結果依列位置排序，過濾後與直接用較小半徑查詢的結果完全相同
+            keep = distances <= radius_km
+            return rows[keep], distances[keep]
+        return rows, distances
+
+
+def code_filters(args, snapshot):
+    """
+    讀取專科代碼條件：specialty（專科名稱或別名，例如「牙醫」代表所有牙科代碼）、
+    dept_code（診療科別代碼，逗號分隔）、service_item（服務項目代碼，逗號分隔）。
+    每個條件內的代碼取聯集，條件之間取交集。回傳 (錯誤, None) 或 (None, ((索引名稱, 代碼), ...))
+    """
+    filters = []
+    specialty = args.get('specialty', '')
+    if specialty:
+        if specialty not in snapshot.specialties:
+            return error(f'找不到專科「{specialty}」'), None
+        filters.append(('department_code_index', tuple(snapshot.specialties[specialty])))
+    dept_codes = tuple(code.strip() for code in args.get('dept_code', '').split(',') if code.strip())
+    if dept_codes:
+        filters.append(('department_code_index', dept_codes))
+    service_items = tuple(code.strip() for code in args.get('service_item', '').split(',') if code.strip())
+    if service_items:
+        filters.append(('service_item_index', service_items))
+    for index_name, _ in filters:
+        if getattr(snapshot, index_name).empty:
+            return error('院所資料沒有服務項目代碼，請用 preprocessedData/build_dataset.py 重新建置資料檔', 500), None
+    return None, tuple(filters)
+
+
+def search_area(args):
+    lookups = SharedLookups(snapshots.current)
+    failure, page = area_matches(args, lookups)
+    if failure is not None:
+        return failure
+    with span('serialize'):
+        return paged_result(lookups.snapshot.store, *page)
+
+
+def search_label(args):
+    """查詢紀錄用的科別／專科描述"""
+    parts = [args.get(name, '') for name in ('department', 'specialty', 'dept_code', 'service_item')]
+    return '、'.join(part for part in parts if part)
+
+
+def area_matches(args, lookups):
+    """/search 的篩選、排序與分頁；回傳 (錯誤, None) 或 (None, (rows, distances, offset, limit, total, format))"""
+    snapshot = lookups.snapshot
+    store = snapshot.store
+    with span('parse'):
+        department_query = args.get('department', '').strip()
+        city_query = args.get('city', '')
+        district_query = args.get('district', '')
+        match_mode = args.get('match', DEFAULT_MATCH)
+        sort_mode = args.get('sort', '')
+        response_format = args.get('format', 'records')
+        failure, filters = code_filters(args, snapshot)
+        if failure is not None:
+            return failure, None
+        if store.empty or not (department_query or filters) or not city_query:
+            return error('資料不完整或伺服器資料讀取失敗'), None
+        if match_mode not in MATCH_MODES:
+            return error(f"match 必須是 {'、'.join(MATCH_MODES)} 其中之一"), None
+        if sort_mode and sort_mode not in SORT_MODES:
+            return error(f"sort 必須是 {'、'.join(SORT_MODES)} 其中之一"), None
+        if response_format not in RESPONSE_FORMATS:
+            return error(f"format 必須是 {'、'.join(RESPONSE_FORMATS)} 其中之一"), None
+        try:
+            open_at = requested_time(args)
+            offset, limit = parse_page(args)
+            # 區域搜尋可以另外帶使用者位置，用來依距離排序
+            user_lat = float(args['lat']) if 'lat' in args else None
+            user_lon = float(args['lon']) if 'lon' in args else None
+        except ValueError:
+            return error('open_at、limit、cursor 或經緯度格式錯誤'), None
+        if (user_lat is not None and not -90 <= user_lat <= 90) or (user_lon is not None and not -180 <= user_lon <= 180):
+            return error('緯度必須介於 -90 到 90、經度必須介於 -180 到 180'), None
+        if sort_mode == 'distance' and (user_lat is None or user_lon is None):
+            return error('依距離排序需要提供 lat 與 lon'), None
+    full_address_prefix = city_query + district_query
+
+    rows = lookups.area_department_rows(city_query, district_query, department_query, match_mode, filters)
+    if open_at is not None:
+        with span('open_filter'):
+            rows = rows[open_rows(rows, snapshot.service_hours, open_at)]
+
+    distances = None
+    if user_lat is not None and user_lon is not None:
+        with span('distance'):
+            distances = haversine_km(user_lat, user_lon, store.latitude[rows], store.longitude[rows])
+    with span('sort'):
+        is_open = open_rows(rows, snapshot.service_hours, open_at or datetime.now(TAIPEI)) if sort_mode == 'open_first' else None
+        page = select_page(sort_keys(sort_mode, distances, is_open), offset, limit, total=len(rows))
+
+    print(f"查詢: {full_address_prefix} - {search_label(args)}，找到 {len(rows)} 筆資料，回傳 {len(page)} 筆。")
+    metrics.inc('mednav_search_results_total', len(rows), route='/search')
+
+    return None, (rows[page], None if distances is None else distances[page], offset, limit, len(rows), response_format)
+
+
+def search_nearby(args):
+    lookups = SharedLookups(snapshots.current)
+    failure, page = nearby_matches(args, lookups)
+    if failure is not None:
+        return failure
+    with span('serialize'):
+        return paged_result(lookups.snapshot.store, *page)
+
+
+def nearby_matches(args, lookups):
+    """/search/nearby 的篩選、排序與分頁；回傳格式與 area_matches 相同"""
+    snapshot = lookups.snapshot
+    store = snapshot.store
+    with span('parse'):
+        try:
+            user_lat = float(args.get('lat'))
+            user_lon = float(args.get('lon'))
+            # 帶 k 時為最近 K 筆模式，不需要半徑；有給 radius 的話當作上限
+            nearest_k = int(args['k']) if 'k' in args else None
+            radius_km = float(args.get('radius', 1 if nearest_k is None else np.inf))
+            department_query = args.get('department', '').strip()
+            match_mode = args.get('match', DEFAULT_MATCH)
+            sort_mode = args.get('sort', 'distance')
+            response_format = args.get('format', 'records')
+        except (TypeError, ValueError):
+            return error('緯度、經度與半徑必須是有效的數字'), None
+        if not valid_coordinates(user_lat, user_lon):
+            return error('緯度必須介於 -90 到 90、經度必須介於 -180 到 180'), None
+        # 最近 K 筆模式沒給半徑時才是無限大；使用者給的半徑必須是有限的數字
+        if np.isnan(radius_km) or ('radius' in args and not np.isfinite(radius_km)):
+            return error('緯度、經度與半徑必須是有效的數字'), None
+        try:
+            open_at = requested_time(args)
+            offset, limit = parse_page(args)
+        except ValueError:
+            return error('open_at、limit 或 cursor 格式錯誤'), None
+
+        failure, filters = code_filters(args, snapshot)
+        if failure is not None:
+            return failure, None
+        if store.empty or not (department_query or filters):
+            return error('科別為必填欄位'), None
+        if match_mode not in MATCH_MODES:
+            return error(f"match 必須是 {'、'.join(MATCH_MODES)} 其中之一"), None
+        if sort_mode not in SORT_MODES:
+            return error(f"sort 必須是 {'、'.join(SORT_MODES)} 其中之一"), None
+        if response_format not in RESPONSE_FORMATS:
+            return error(f"format 必須是 {'、'.join(RESPONSE_FORMATS)} 其中之一"), None
+        if nearest_k is not None and nearest_k < 1:
+            return error('k 必須是正整數'), None
+
+    if nearest_k is None:
+        rows = lookups.nearby_rows(user_lat, user_lon, radius_km, department_query, match_mode, filters)
+        # 快取的是涵蓋這次查詢的較大範圍，用實際位置重新算距離並過濾，結果與直接查詢相同
+        with span('distance'):
+            distances = haversine_km(user_lat, user_lon, store.latitude[rows], store.longitude[rows])
+            keep = distances <= radius_km
+            if open_at is not None:
+                keep &= open_rows(rows, snapshot.service_hours, open_at)
+            rows, distances = rows[keep], distances[keep]
+            total = len(rows)
+    else:
+        with span('department_filter'):
+            department_rows = lookups.candidate_rows(department_query, match_mode, filters)
+
+        def accept(rows):
+            keep = np.isin(rows, department_rows, assume_unique=True)
+            if open_at is not None:
+                keep &= open_rows(rows, snapshot.service_hours, open_at)
+            return keep
+
+        # 網格索引的最近 K 筆查詢本身就會算出距離，科別與營業時間的篩選也在這一步裡
+        with span('distance'):
+            rows, distances = snapshot.spatial_index.query_nearest(
+                user_lat, user_lon, nearest_k, accept=accept,
+                max_radius_km=None if np.isinf(radius_km) else radius_km)
+            total = min(nearest_k, len(rows))
+            # 只保留最近的 K 筆，open_first 排序也在這 K 筆內進行
+            nearest = select_page(distances, 0, total)
+            rows, distances = rows[nearest], distances[nearest]
+
+    with span('sort'):
+        is_open = open_rows(rows, snapshot.service_hours, open_at or datetime.now(TAIPEI)) if sort_mode == 'open_first' else None
+        page = select_page(sort_keys(sort_mode, distances, is_open), offset, limit, total=total)
+
+    print(f"附近查詢: ({user_lat}, {user_lon}) 半徑 {radius_km}km - {search_label(args)}，找到 {total} 筆資料，回傳 {len(page)} 筆。")
+    metrics.inc('mednav_search_results_total', total, route='/search/nearby')
+
+    return None, (rows[page], distances[page], offset, limit, total, response_format)
+
+
+def map_view(args):
+    """
+    地圖瀏覽：bbox=西,南,東,北（Leaflet 的 map.getBounds().toBBoxString()）與 zoom。
+    畫面內院所不多或放大超過 CLUSTER_MAX_ZOOM 時回傳 {"zoom", "total", "clinics": [院所]}，
+    否則回傳 {"zoom", "total", "clusters": [{"lat", "lng", "count", "departments"}]}；
+    兩種模式的 zoom 都是實際查詢的聚合層級（畫面太大時會比要求的 zoom 粗），
+    聚合模式的 total 是畫面涵蓋的格子內的院所數，邊緣的格子可能有一部分在畫面外。
+    """
+    pyramid = snapshots.current.cluster_pyramid
+    store = snapshots.current.store
+    with span('parse'):
+        try:
+            west, south, east, north = (float(value) for value in args.get('bbox', '').split(','))
+            zoom = int(args.get('zoom', ''))
+        except ValueError:
+            return error('bbox 必須是「西,南,東,北」四個數字，zoom 必須是整數')
+        if not (valid_coordinates(south, west) and valid_coordinates(north, east)):
+            return error('bbox 的緯度必須介於 -90 到 90、經度必須介於 -180 到 180')
+        if not (south < north and west < east):
+            return error('bbox 的南邊必須小於北邊、西邊必須小於東邊')
+        response_format = args.get('format', 'records')
+        if response_format not in RESPONSE_FORMATS:
+            return error(f"format 必須是 {'、'.join(RESPONSE_FORMATS)} 其中之一")
+
+    box = pyramid.box(south, west, north, east)
+    with span('cluster_lookup'):
+        level_zoom = min(max(zoom, MIN_ZOOM), CLUSTER_MAX_ZOOM)
+        while level_zoom > MIN_ZOOM and pyramid.visible_cells(level_zoom, box) > MAP_MAX_CELLS:
+            level_zoom -= 1
+        level, positions = pyramid.clusters(level_zoom, box)
+        total = int(level.counts[positions].sum())
+        rows = None
+        # 放大到最細一層以上、且畫面沒有大到要改用較粗的一層時，才去查院所本身（查詢成本與畫面高度成正比）
+        if total <= MAP_MAX_CLINICS or (zoom > CLUSTER_MAX_ZOOM and level_zoom == CLUSTER_MAX_ZOOM):
+            rows = pyramid.rows(box)
+            if len(rows) > MAP_MAX_CLINICS:
+                rows = None
+
+    with span('serialize'):
+        if rows is None:
+            body = {'zoom': level_zoom, 'total': total, 'clusters': pyramid.describe(level, positions)}
+            return body, 200, {}
+        if response_format == 'columns':
+            clinics = encode_json(store.columns(rows)).encode('utf-8')
+        else:
+            clinics = store.records_json(rows)
+        body = b'{"zoom":%d,"total":%d,"clinics":%b}' % (level_zoom, len(rows), clinics)
+    return body, 200, {'Content-Type': 'application/json'}
+
+
+def batch_queries(body):
+    """
+    讀取 /search/batch 的 JSON：queries 之外的欄位（open_at、limit、sort 等）是每個查詢的預設值。
+    值一律轉成字串，與 /search、/search/nearby 的查詢參數相同處理。回傳 (錯誤, None) 或 (None, (查詢列表, 格式))
+    """
+    if not isinstance(body, dict) or not isinstance(body.get('queries'), list) or not body['queries']:
+        return error('請提供 queries 列表'), None
+    if len(body['queries']) > BATCH_MAX_QUERIES:
+        return error(f'一次最多 {BATCH_MAX_QUERIES} 個查詢'), None
+    response_format = str(body.get('format', 'records'))
+    if response_format not in RESPONSE_FORMATS:
+        return error(f"format 必須是 {'、'.join(RESPONSE_FORMATS)} 其中之一"), None
+    defaults = {key: value for key, value in body.items() if key not in ('queries', 'format')}
+    queries = []
+    for query in body['queries']:
+        if not isinstance(query, dict):
+            return error('queries 的每一項都必須是物件'), None
+        merged = {**defaults, **query}
+        queries.append({key: str(value).lower() if isinstance(value, bool) else str(value)
+                        for key, value in merged.items() if value is not None})
+    return None, (queries, response_format)
+
+
+def search_batch(body):
+    """
+    一次處理多個科別／地點的搜尋：有 city 的查詢視為 /search，其餘視為 /search/nearby。
+    所有查詢共用同一份 Snapshot 與 SharedLookups，同樣的縣市區、科別、位置只查一次索引；
+    回傳的 clinics 每間院所只出現一次，results 依查詢順序列出各自命中的 clinics 索引與距離。
+    """
+    failure, parsed = batch_queries(body)
+    if failure is not None:
+        return failure
+    queries, response_format = parsed
+
+    # 同一個位置（對齊到快取網格後）的半徑查詢先找出最大半徑，之後只查一次
+    radius_by_location = {}
+    for query in queries:
+        if 'city' in query or 'k' in query:
+            continue
+        try:
+            _, _, center_lat, center_lon, reach = snapped_circle(
+                float(query['lat']), float(query['lon']), float(query.get('radius', 1)))
+        except (KeyError, ValueError):
+            # 格式錯誤的查詢留給 nearby_matches 回傳 400
+            continue
+        key = (center_lat, center_lon)
+        radius_by_location[key] = max(reach, radius_by_location.get(key, reach))
+
+    lookups = SharedLookups(snapshots.current, radius_by_location)
+    store = lookups.snapshot.store
+    results = []
+    for query in queries:
+        matches = area_matches if 'city' in query else nearby_matches
+        results.append(matches(dict(query, format=response_format), lookups))
+
+    with span('serialize'):
+        pages = [page for failure, page in results if failure is None]
+        all_rows = np.concatenate([page[0] for page in pages]) if pages else np.empty(0, dtype=np.int64)
+        unique_rows, positions = np.unique(all_rows, return_inverse=True)
+        positions = positions.tolist()
+
+        groups = []
+        start = 0
+        for failure, page in results:
+            if failure is not None:
+                groups.append(failure[0])
+                continue
+            rows, distances, offset, limit, total, _ = page
+            group = {
+                'total': int(total),
+                'next_cursor': next_cursor(offset, limit, total),
+                'clinics': positions[start:start + len(rows)],
+            }
+            if distances is not None:
+                group['distance_km'] = distance_values(distances)
+            groups.append(group)
+            start += len(rows)
+
+        if response_format == 'columns':
+            clinics = encode_json(store.columns(unique_rows)).encode('utf-8')
+        else:
+            clinics = store.records_json(unique_rows)
+        body = b'{"clinics":%b,"results":%b}' % (clinics, encode_json(groups).encode('utf-8'))
+    print(f"批次查詢: {len(queries)} 個查詢，共 {len(unique_rows)} 間不重複的院所。")
+    return body, 200, {'Content-Type': 'application/json'}
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+
+def array_bytes(value, seen=None):
+    """估計物件裡所有 numpy 陣列佔用的位元組（會往下找 dict、list、tuple 與物件屬性）"""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(array_bytes(item, seen) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(array_bytes(item, seen) for item in value)
+    if hasattr(value, '__dict__'):
+        return array_bytes(vars(value), seen)
+    return 0
+
+
+def rss_bytes():
+    """目前行程的常駐記憶體（只在 Linux 上有 /proc）"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Snapshot:
+    """
+    一份院所資料與由它建出的所有索引。建好之後不再修改，
+    每個請求開始時取一次 SnapshotManager.current，整個請求都用同一份，重新載入時不會讀到一半新一半舊。
+    """
+
+    def __init__(self, store, departments_list, area_data, spatial_index, department_index, area_index,
+                 service_hours, department_code_index, service_item_index, specialties, geocoder, cluster_pyramid):
+        self.store = store
+        self.departments_list = departments_list
+        self.area_data = area_data
+        self.spatial_index = spatial_index
+        self.department_index = department_index
+        self.area_index = area_index
+        self.service_hours = service_hours
+        self.department_code_index = department_code_index
+        self.service_item_index = service_item_index
+        # 專科名稱或別名 → 診療科別代碼
+        self.specialties = specialties
+        self.geocoder = geocoder
+        self.cluster_pyramid = cluster_pyramid
+        self.version = store.meta.get('version') or time.strftime('%Y%m%d%H%M%S')
+        self.loaded_at = time.time()
+        self.build_seconds = None
+        self.mtimes = None
+
+    def info(self):
+        """版本、建置時間與記憶體用量；memmap 開啟的資料檔由作業系統快取，多個 worker 共用"""
+        store_bytes = array_bytes(self.store._arrays())
+        return {
+            'version': self.version,
+            'rows': int(self.store.size),
+            'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.loaded_at)),
+            'build_seconds': None if self.build_seconds is None else round(self.build_seconds, 3),
+            'store_bytes': store_bytes,
+            'store_memmap': self.store.path is not None,
+            'geocoder_addresses': self.geocoder.size,
+            'index_bytes': array_bytes([self.spatial_index, self.department_index, self.area_index,
+                                        self.service_hours, self.department_code_index, self.service_item_index,
+                                        self.cluster_pyramid]),
+        }
+
+
+class SnapshotManager:
+    """
+    持有目前的 Snapshot。reload() 在呼叫的執行緒上建好新的一份才替換 current（單一賦值，其他執行緒不會看到半成品）；
+    start_watching() 另開背景執行緒，每 check_interval 秒檢查來源檔案的修改時間，
+    變動後連續兩次檢查都相同（檔案寫完了）才重新載入，不佔用任何請求的時間。
+    """
+
+    def __init__(self, build, paths, check_interval=5.0, on_swap=None):
+        self.build = build
+        self.paths = paths
+        self.check_interval = check_interval
+        self.on_swap = on_swap
+        self.last_error = None
+        # 上次載入失敗時的檔案修改時間；檔案沒有再變動就不重試
+        self._rejected_mtimes = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self.current = self._build(self._file_mtimes())
+        if on_swap:
+            on_swap(self.current)
+
+    def _file_mtimes(self):
+        return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in self.paths)
+
+    def _build(self, mtimes):
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        snapshot = self.build()
+        snapshot.build_seconds = time.perf_counter() - started
+        snapshot.mtimes = mtimes
+        rss_after = rss_bytes()
+        info = snapshot.info()
+        rss_delta = '' if rss_before is None else f"，常駐記憶體 +{(rss_after - rss_before) / 1e6:.1f} MB"
+        print(f"資料版本 {info['version']}：{info['rows']} 筆院所，建置 {info['build_seconds']} 秒，"
+              f"資料 {info['store_bytes'] / 1e6:.1f} MB{'（memmap）' if info['store_memmap'] else ''}、"
+              f"索引 {info['index_bytes'] / 1e6:.1f} MB{rss_delta}")
+        return snapshot
+
+    def reload(self, reason='manual'):
+        """重新建置並替換；失敗或新資料是空的時保留目前的版本，回傳 (是否替換, 目前的 Snapshot)"""
+        with self._lock:
+            print(f"重新載入院所資料（{reason}）...")
+            mtimes = self._file_mtimes()
+            try:
+                snapshot = self._build(mtimes)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                self._rejected_mtimes = mtimes
+                print(f"重新載入院所資料失敗，繼續使用版本 {self.current.version}: {e}")
+                metrics.inc('mednav_snapshot_reloads_total', outcome='error')
+                return False, self.current
+            if snapshot.store.empty and not self.current.store.empty:
+                self.last_error = '新的院所資料是空的'
+                self._rejected_mtimes = mtimes
+                print(f"新的院所資料是空的，繼續使用版本 {self.current.version}")
+                metrics.inc('mednav_snapshot_reloads_total', outcome='empty')
+                return False, self.current
+            if self.on_swap:
+                self.on_swap(snapshot)
+            # 進行中的請求手上還是舊的 Snapshot，結束後舊的那份就會被回收
+            self.current = snapshot
+            self.last_error = None
+            self._rejected_mtimes = None
+            metrics.inc('mednav_snapshot_reloads_total', outcome='success')
+            return True, snapshot
+
+    def reload_if_changed(self, previous_mtimes=None):
+        """檔案和目前版本不同、且和上一次檢查時相同才重新載入；回傳這次看到的修改時間"""
+        mtimes = self._file_mtimes()
+        if mtimes != self.current.mtimes and mtimes == previous_mtimes and mtimes != self._rejected_mtimes:
+            self.reload('來源檔案變更')
+        return mtimes
+
+    def _watch(self):
+        mtimes = None
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                mtimes = self.reload_if_changed(mtimes)
+            except Exception as e:
+                print(f"檢查院所資料檔案時發生錯誤: {e}")
+
+    def start_watching(self):
+        if self._thread is None and self.check_interval > 0:
+            self._thread = threading.Thread(target=self._watch, name='snapshot-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def info(self):
+        return dict(self.current.info(), last_error=self.last_error)
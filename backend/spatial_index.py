@@ -0,0 +1,134 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371  # 地球半徑（公里）
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """向量化的 haversine 距離（公里），公式與原本逐筆計算的版本相同"""
+    # 資料檔的座標是 float32，先轉成 float64 再算，距離不受 float32 的運算誤差影響
+    lat2 = np.asarray(lat2, dtype=float)
+    lon2 = np.asarray(lon2, dtype=float)
+    dLat = np.radians(lat2 - lat1)
+    dLon = np.radians(lon2 - lon1)
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    a = np.sin(dLat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dLon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+
+def valid_coordinates(lat, lon):
+    """緯度在 -90～90、經度在 -180～180 之間（NaN、無限大都不算）"""
+    return bool(-90 <= lat <= 90 and -180 <= lon <= 180)
+
+
+class GridIndex:
+    """
+    以經緯度網格分桶的空間索引。
+    啟動時把每個院所依 (緯度格, 經度格) 排序好，半徑查詢只會碰到圓形外接框內的格子，
+    剩下的距離計算再用 NumPy 一次算完。
+    """
+
+    def __init__(self, latitudes, longitudes, cell_deg=0.01):
+        lat = np.asarray(latitudes, dtype=float)
+        lon = np.asarray(longitudes, dtype=float)
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        rows = np.flatnonzero(valid)
+        lat, lon = lat[valid], lon[valid]
+
+        self.cell_deg = cell_deg
+        self.size = len(rows)
+        if self.size == 0:
+            self._lat0 = self._lon0 = 0.0
+            self._nx = self._ny = 0
+            self._keys = np.empty(0, dtype=np.int64)
+            self._rows = rows
+            self._lat = self._lon = np.empty(0)
+            return
+
+        self._lat0 = lat.min()
+        self._lon0 = lon.min()
+        iy = self._cell(lat, self._lat0)
+        ix = self._cell(lon, self._lon0)
+        self._ny = int(iy.max()) + 1
+        self._nx = int(ix.max()) + 1
+
+        keys = iy * self._nx + ix
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._rows = rows[order]
+        self._lat = lat[order]
+        self._lon = lon[order]
+
+    def _cell(self, values, origin):
+        return np.floor((values - origin) / self.cell_deg).astype(np.int64)
+
+    def _cell_span(self, low, high, origin, cells):
+        """邊界（度）→ 格子編號範圍，夾在 0..cells-1 之間；範圍完全在網格外時 low > high"""
+        low = np.clip((low - origin) / self.cell_deg, -1, cells)
+        high = np.clip((high - origin) / self.cell_deg, -1, cells)
+        return max(int(np.floor(low)), 0), min(int(np.floor(high)), cells - 1)
+
+    def _bounding_box(self, lat, lon, radius_km):
+        """回傳涵蓋整個查詢圓的 (南, 北, 西, 東) 邊界（度）"""
+        angular = radius_km / EARTH_RADIUS_KM
+        dlat = np.degrees(angular)
+        south, north = lat - dlat, lat + dlat
+        if north >= 90 or south <= -90 or angular >= np.pi / 2:
+            return south, north, -180.0, 180.0
+        dlon = np.degrees(np.arcsin(min(1.0, np.sin(angular) / np.cos(np.radians(lat)))))
+        return south, north, lon - dlon, lon + dlon
+
+    def candidates(self, lat, lon, radius_km):
+        """回傳外接框內所有格子的內部位置（尚未做距離過濾）"""
+        if self.size == 0 or not radius_km >= 0 or not valid_coordinates(lat, lon):
+            return np.empty(0, dtype=np.int64)
+
+        eps = 1e-9
+        south, north, west, east = self._bounding_box(lat, lon, radius_km)
+        # 先夾到網格範圍內再取整數，半徑無限大或經緯度極端時邊界才不會是 ±inf
+        iy0, iy1 = self._cell_span(south - eps, north + eps, self._lat0, self._ny)
+        ix0, ix1 = self._cell_span(west - eps, east + eps, self._lon0, self._nx)
+        if iy0 > iy1 or ix0 > ix1:
+            return np.empty(0, dtype=np.int64)
+
+        # 同一個緯度格列中，ix0..ix1 的 key 是連續的，所以每一列只要兩次二分搜尋
+        row_base = np.arange(iy0, iy1 + 1, dtype=np.int64) * self._nx
+        starts = np.searchsorted(self._keys, row_base + ix0, side='left')
+        ends = np.searchsorted(self._keys, row_base + ix1, side='right')
+        spans = [np.arange(s, e) for s, e in zip(starts, ends) if e > s]
+        if not spans:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(spans)
+
+    def query_radius(self, lat, lon, radius_km):
+        """
+        回傳 (rows, distances)：半徑內的原始列位置（依原順序排序）與對應距離（公里）。
+        """
+        slots = self.candidates(lat, lon, radius_km)
+        if len(slots) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        distances = haversine_km(lat, lon, self._lat[slots], self._lon[slots])
+        hit = distances <= radius_km
+        rows = self._rows[slots[hit]]
+        distances = distances[hit]
+        order = np.argsort(rows, kind='stable')
+        return rows[order], distances[order]
+
+    def query_nearest(self, lat, lon, k, accept=None, max_radius_km=None, start_radius_km=1.0):
+        """
+        不需指定半徑的最近 K 筆查詢：從 start_radius_km 開始每次把半徑加倍，
+        直到範圍內有 K 筆通過 accept 篩選（或已達 max_radius_km）。
+        回傳格式與 query_radius 相同，至少包含最近的 K 筆，但尚未依距離排序。
+        """
+        limit = max_radius_km if max_radius_km is not None else np.pi * EARTH_RADIUS_KM
+        radius = min(start_radius_km, limit)
+        while True:
+            rows, distances = self.query_radius(lat, lon, radius)
+            if accept is not None and len(rows):
+                keep = accept(rows)
+                rows, distances = rows[keep], distances[keep]
+            if len(rows) >= k or radius >= limit:
+                return rows, distances
+            radius = min(radius * 2, limit)
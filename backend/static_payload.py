@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import brotli  # 選用：有安裝才提供 br 壓縮
+except ImportError:
+    brotli = None
+
+CACHE_CONTROL = 'public, max-age=300'
+
+
+def accepted_encodings(accept_encoding):
+    """解析 Accept-Encoding，回傳客戶端接受（q 不為 0）的編碼集合"""
+    encodings = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def etag_matches(if_none_match, etags):
+    """If-None-Match 是否命中；比對時忽略 W/ 前綴（弱比對）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag in etags:
+            return True
+    return False
+
+
+class StaticPayload:
+    """
+    啟動時讀一次 JSON 檔，預先序列化並壓縮好（gzip，有安裝 brotli 時另外加 br），
+    回應時直接送出 bytes，並附上 ETag；客戶端帶相同的 If-None-Match 時回 304。
+    和 SymptomMatcher 一樣，每 check_interval 秒最多檢查一次檔案修改時間，有變動就重新載入。
+    """
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._mtime = None
+        self._bodies = None
+        self.error = None
+        self.reload()
+
+    def reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"讀取 {self.path} 時發生錯誤: {e}")
+            with self._lock:
+                self._bodies, self.error = None, e
+                self._mtime = None
+                self._checked_at = time.monotonic()
+            return
+
+        raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        etag = hashlib.sha1(raw).hexdigest()[:16]
+        # 每種編碼各自一個強 ETag（內容相同，只是壓縮方式不同）
+        bodies = {'identity': (raw, f'"{etag}"'),
+                  'gzip': (gzip.compress(raw, compresslevel=9, mtime=0), f'"{etag}-gzip"')}
+        if brotli is not None:
+            bodies['br'] = (brotli.compress(raw, quality=11), f'"{etag}-br"')
+        with self._lock:
+            self._bodies, self.error = bodies, None
+            self._mtime = mtime
+            self._checked_at = time.monotonic()
+
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime == self._mtime:
+            return False
+        print(f"偵測到 {self.path} 變更，重新載入...")
+        self.reload()
+        return True
+
+    def respond(self, accept_encoding='', if_none_match=''):
+        """
+        回傳 (body, status, headers)；body 為已編碼的 bytes（304 時為空）。
+        檔案讀取失敗時回傳 None，由呼叫端決定錯誤訊息。
+        """
+        self.reload_if_changed()
+        bodies = self._bodies
+        if bodies is None:
+            return None
+
+        accepted = accepted_encodings(accept_encoding)
+        encoding = next((name for name in ('br', 'gzip') if name in bodies and name in accepted), 'identity')
+        body, etag = bodies[encoding]
+        headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
+        if etag_matches(if_none_match, {tag for _, tag in bodies.values()}):
+            return b'', 304, headers
+        headers['Content-Type'] = 'application/json'
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return body, 200, headers
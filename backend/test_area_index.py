@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from area_index import AreaIndex, normalize_area
+
+AREA_DATA = {'臺北市': ['大安區', '中正區'], '新北市': ['板橋區'], '臺中市': ['西區', '西屯區']}
+VALUES = ['臺北市大安區', '台北市大安區', '臺北市中正區', '新北市板橋區', '臺中市西區', '臺中市西屯區', '', '臺北市大安區']
+
+
+@pytest.fixture(scope='module')
+def index():
+    areas = sorted(set(VALUES))
+    codes = np.array([areas.index(value) for value in VALUES], dtype=np.int32)
+    return AreaIndex.from_codes(codes, areas, AREA_DATA)
+
+
+def brute_force(prefix):
+    return np.flatnonzero([normalize_area(value).startswith(normalize_area(prefix)) for value in VALUES])
+
+
+@pytest.mark.parametrize('city, district', [
+    ('臺北市', ''), ('台北市', ''), ('臺北市', '大安區'), ('台北市', '大安區'), ('新北市', '板橋區'), ('臺中市', ''),
+])
+def test_lookup_matches_prefix_scan(index, city, district):
+    np.testing.assert_array_equal(index.lookup(city, district), brute_force(city + district))
+
+
+def test_district_names_do_not_leak_into_each_other(index):
+    # 「西區」不能把「西屯區」也算進來
+    np.testing.assert_array_equal(index.lookup('臺中市', '西區'), [4])
+
+
+def test_non_standard_names_fall_back_to_prefix(index):
+    np.testing.assert_array_equal(index.lookup('臺中市', '西'), [4, 5])
+    assert len(index.lookup('高雄市')) == 0
@@ -0,0 +1,128 @@
+import pytest
+
+PARITY_HEADERS = ['x-total-count', 'x-next-cursor', 'content-type']
+
+
+@pytest.fixture(scope='module')
+def asgi_client(services_module):
+    from starlette.testclient import TestClient
+
+    import asgi_app
+
+    with TestClient(asgi_app.app) as client:
+        yield client
+
+
+def assert_same(flask_response, asgi_response):
+    assert asgi_response.status_code == flask_response.status_code
+    assert asgi_response.json() == flask_response.get_json()
+    for header in PARITY_HEADERS:
+        assert asgi_response.headers.get(header) == flask_response.headers.get(header)
+
+
+@pytest.mark.parametrize('url', [
+    '/api/departments',
+    '/api/districts',
+    '/search?city=臺北市&department=內科&limit=5',
+    '/search?city=臺北市&district=大安區&department=牙醫&match=contains&sort=distance&lat=25.03&lon=121.54',
+    '/search?city=新北市&department=內科&open_at=2026-10-19T09:00',
+    '/search?department=內科',
+    '/search?city=臺北市&department=內科&lat=-91&lon=121.54',
+    '/search/nearby?lat=25.03&lon=121.54&radius=2&department=內科&limit=10',
+    '/search/nearby?lat=25.03&lon=121.54&k=5&department=家醫科',
+    '/search/nearby?lat=25.03&lon=1e308&radius=3&department=內科',
+    '/map/clusters?bbox=119,21,123,26&zoom=7',
+    '/map/clusters?bbox=121.54,25.03,121.545,25.035&zoom=18',
+    '/map/clusters?bbox=nan,24,122,26&zoom=8',
+])
+def test_get_endpoints_match_flask(client, asgi_client, url):
+    assert_same(client.get(url), asgi_client.get(url))
+
+
+def test_cursor_pages_match_flask(client, asgi_client):
+    url = '/search?city=臺北市&department=內科&sort=distance&lat=25.03&lon=121.54&limit=4'
+    cursor = client.get(url).headers['X-Next-Cursor']
+    assert cursor
+    assert_same(client.get(f'{url}&cursor={cursor}'), asgi_client.get(f'{url}&cursor={cursor}'))
+
+
+@pytest.mark.parametrize('body', [
+    {'department': '內科', 'queries': [{'city': '臺北市'}, {'lat': 25.03, 'lon': 121.54, 'radius': 2},
+                                      {'lat': 25.03, 'lon': 1e308}]},
+    {'city': '新北市', 'limit': 3, 'format': 'columns', 'queries': [{'department': '內科'}, {'department': '家醫科'}]},
+    {'queries': 'not a list'},
+])
+def test_batch_matches_flask(client, asgi_client, body):
+    assert_same(client.post('/search/batch', json=body), asgi_client.post('/search/batch', json=body))
+
+
+def test_suggest_emergency_matches_flask(client, asgi_client):
+    body = {'symptoms': '突然胸痛而且呼吸困難'}
+    assert_same(client.post('/api/suggest-department', json=body),
+                asgi_client.post('/api/suggest-department', json=body))
+
+
+@pytest.mark.parametrize('data, content_type', [
+    ('{"symptoms": ', 'application/json'),
+    ('["頭痛"]', 'application/json'),
+    ('', 'application/json'),
+    ('symptoms=頭痛', 'application/x-www-form-urlencoded'),
+])
+def test_suggest_rejects_malformed_bodies(client, asgi_client, data, content_type):
+    flask_response = client.post('/api/suggest-department', data=data.encode('utf-8'), content_type=content_type)
+    assert flask_response.status_code == 400 and 'error' in flask_response.get_json()
+    assert_same(flask_response, asgi_client.post('/api/suggest-department', content=data.encode('utf-8'),
+                                                 headers={'Content-Type': content_type}))
+
+
+def test_handlers_keep_blocking_calls_off_the_event_loop(asgi_client, services_module, monkeypatch):
+    """會碰 SQLite 或磁碟的 services 函式都要在執行緒池裡執行，不能卡住事件迴圈"""
+    import asyncio
+
+    loop_calls = []
+
+    def watch(fn):
+        def wrapper(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                loop_calls.append(fn.__name__)
+            except RuntimeError:
+                pass
+            return fn(*args, **kwargs)
+        return wrapper
+
+    for name in ['geocode_from_cache', 'geocode_params', 'geocode_fallback', 'static_json', 'snapshot_info',
+                 'search_area']:
+        monkeypatch.setattr(services_module, name, watch(getattr(services_module, name)))
+    # 上游連不到，走 geocode_params → 失敗 → geocode_fallback
+    import asgi_app
+
+    monkeypatch.setattr(asgi_app, 'GEOCODE_API_URL', 'http://127.0.0.1:9/geocode/json')
+    asgi_client.get('/api/geocode?address=臺中市西區民權路999號之99')
+    asgi_client.get('/api/departments')
+    asgi_client.get('/admin/snapshot')
+    asgi_client.get('/search?city=臺北市&department=內科')
+    assert loop_calls == []
+
+
+def test_profile_follows_the_request_into_the_threadpool(asgi_client, services_module, monkeypatch, tmp_path):
+    import time
+
+    import metrics
+
+    def slow_search(args):
+        with metrics.span('area_filter'):
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                sum(range(100))
+        return {'ok': True}, 200, {}
+
+    monkeypatch.setattr(metrics, 'PROFILE_TOKEN', 'token')
+    monkeypatch.setattr(metrics, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(services_module, 'search_area', slow_search)
+    response = asgi_client.get('/search', headers={'X-Profile': 'token'})
+    with open(response.headers['x-profile-file'], encoding='utf-8') as f:
+        stacks = f.read()
+    assert 'slow_search' in stacks
+    # 事件迴圈執行緒同時在處理其他請求，不取樣
+    assert 'base_events.py' not in stacks
@@ -0,0 +1,68 @@
+from urllib.parse import urlencode
+
+import pytest
+
+QUERIES = [
+    {'city': '臺北市', 'department': '內科'},
+    {'city': '臺北市', 'district': '大安區', 'department': '牙醫', 'match': 'substring'},
+    {'city': '臺北市', 'department': '內科', 'sort': 'distance', 'lat': 25.03, 'lon': 121.54, 'limit': 6},
+    {'city': '新北市', 'department': '內科', 'open_at': '2026-10-19T13:00'},
+    {'city': '臺北市', 'department': '內科', 'cursor': '4', 'limit': 4},
+    {'lat': 25.03, 'lon': 121.54, 'radius': 1.5, 'department': '內科'},
+    {'lat': 25.031, 'lon': 121.541, 'radius': 3, 'department': '內科', 'limit': 50},
+    {'lat': 25.03, 'lon': 121.54, 'k': 5, 'department': '家醫科'},
+    {'lat': 25.014, 'lon': 121.465, 'radius': 2, 'department': '中醫', 'match': 'substring', 'sort': 'open_first'},
+]
+
+
+def single(client, query):
+    path = '/search' if 'city' in query else '/search/nearby'
+    return client.get(f'{path}?{urlencode(query)}')
+
+
+def test_batch_matches_single_queries(client):
+    response = client.post('/search/batch', json={'queries': QUERIES})
+    assert response.status_code == 200
+    body = response.get_json()
+    # 每間院所只出現一次
+    names = [clinic['機構名稱'] for clinic in body['clinics']]
+    assert len(names) == len(set(names))
+
+    for query, group in zip(QUERIES, body['results']):
+        expected = single(client, query)
+        assert expected.status_code == 200
+        records = expected.get_json()
+        assert records, query
+        assert group['total'] == int(expected.headers['X-Total-Count'])
+        assert (group['next_cursor'] or '') == expected.headers.get('X-Next-Cursor', '')
+        assert [body['clinics'][i] for i in group['clinics']] == [
+            {key: value for key, value in record.items() if key != 'distance_km'} for record in records]
+        if 'distance_km' in records[0]:
+            assert group['distance_km'] == [record['distance_km'] for record in records]
+        else:
+            assert 'distance_km' not in group
+
+
+def test_batch_defaults_apply_to_every_query(client):
+    body = client.post('/search/batch', json={'department': '內科', 'limit': 3, 'queries': [
+        {'city': '臺中市'}, {'lat': 24.143, 'lon': 120.667, 'radius': 2}, {'city': '臺中市', 'limit': 1},
+    ]}).get_json()
+    for query, group in zip([{'city': '臺中市', 'limit': 3}, {'lat': 24.143, 'lon': 120.667, 'radius': 2, 'limit': 3},
+                             {'city': '臺中市', 'limit': 1}], body['results']):
+        expected = single(client, dict(query, department='內科'))
+        assert [body['clinics'][i]['機構名稱'] for i in group['clinics']] == [
+            record['機構名稱'] for record in expected.get_json()]
+
+
+@pytest.mark.parametrize('query', [
+    {'city': '臺北市', 'department': '內科', 'sort': 'distance'},
+    {'city': '臺北市', 'department': '內科', 'open_at': 'soon'},
+    {'lat': 25.03, 'department': '內科'},
+    {'lat': 95, 'lon': 121.54, 'department': '內科'},
+])
+def test_batch_errors_match_single_queries(client, query):
+    body = client.post('/search/batch', json={'queries': [query, QUERIES[0]]}).get_json()
+    expected = single(client, query)
+    assert expected.status_code == 400
+    assert body['results'][0] == expected.get_json()
+    assert body['results'][1]['total'] > 0
@@ -0,0 +1,86 @@
+import json
+
+import numpy as np
+import pytest
+
+from clinic_store import ClinicStore, load_store
+from conftest import clinic_frame
+from spatial_index import haversine_km
+
+
+@pytest.fixture(scope='module')
+def store():
+    return ClinicStore.from_dataframe(clinic_frame(40))
+
+
+def test_records_json_matches_records(store):
+    rows = np.array([0, 3, 7, 11])
+    assert json.loads(store.records_json(rows)) == store.records(rows)
+
+
+def test_records_json_inserts_distances(store):
+    rows = np.array([1, 2])
+    records = json.loads(store.records_json(rows, [0.12345, 2.0]))
+    assert [record['distance_km'] for record in records] == [0.123, 2.0]
+    assert list(records[0])[0] == 'distance_km'
+
+
+@pytest.mark.parametrize('bad', [np.nan, np.inf, -np.inf])
+def test_non_finite_distances_are_refused(store, bad):
+    with pytest.raises(ValueError):
+        store.records_json(np.array([1, 2]), [1.0, bad])
+    with pytest.raises(ValueError):
+        store.columns(np.array([1, 2]), [bad, 1.0])
+
+
+def test_save_and_open_round_trip(store, tmp_path):
+    path = str(tmp_path / 'clinic_store.bin')
+    store.save(path)
+    opened = ClinicStore.open(path, verify=True)
+    rows = np.arange(store.size)
+    assert opened.records_json(rows) == store.records_json(rows)
+    assert opened.columns(rows[:5]) == store.columns(rows[:5])
+
+
+def test_coordinates_are_float32_within_a_metre():
+    rng = np.random.default_rng(1)
+    frame = clinic_frame(2000).assign(latitude=rng.uniform(21.8, 26.4, 2000), longitude=rng.uniform(118.2, 122.1, 2000))
+    store = ClinicStore.from_dataframe(frame)
+    assert store.latitude.dtype == np.float32 and store.longitude.dtype == np.float32
+    # float32 在台灣的誤差不到 1 公尺，距離四捨五入到公尺時最多差 0.001 公里
+    error = haversine_km(frame['latitude'].to_numpy(), frame['longitude'].to_numpy(), store.latitude, store.longitude)
+    assert error.max() < 0.001
+    # 回傳的座標取到小數第 6 位，不會出現 float32 轉回來的一長串尾數
+    latitudes = [record['latitude'] for record in store.records(np.arange(50))]
+    longitudes = store.columns(np.arange(50))['longitude']
+    for values, source in [(latitudes, frame['latitude']), (longitudes, frame['longitude'])]:
+        assert all(value == round(value, 6) for value in values)
+        np.testing.assert_allclose(values, source.head(50), atol=1e-5)
+
+
+def test_open_checks_size_but_only_verify_reads_the_data(store, tmp_path):
+    path = tmp_path / 'clinic_store.bin'
+    store.save(str(path))
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    # 內容被改過但大小相同：一般開啟不會讀過整個資料區，verify=True 才會發現
+    assert ClinicStore.open(str(path)).size == store.size
+    with pytest.raises(ValueError, match='checksum'):
+        ClinicStore.open(str(path), verify=True)
+    path.write_bytes(bytes(data[:-100]))
+    with pytest.raises(ValueError, match='大小不符'):
+        ClinicStore.open(str(path))
+
+
+def test_load_store_verifies_only_when_asked(store, tmp_path, capsys):
+    path = tmp_path / 'clinic_store.bin'
+    store.save(str(path))
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    missing_csv = str(tmp_path / 'missing.csv')
+    assert load_store(missing_csv, str(path)).path == str(path)
+    # 完整檢查失敗時退回讀 CSV
+    with pytest.raises(FileNotFoundError):
+        load_store(missing_csv, str(path), verify=True)
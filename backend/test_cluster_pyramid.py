@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from cluster_pyramid import CLUSTER_MAX_ZOOM, MIN_ZOOM, ClusterPyramid
+
+
+@pytest.fixture(scope='module')
+def pyramid():
+    rng = np.random.default_rng(5)
+    lat = rng.uniform(22.0, 25.3, 3000)
+    lon = rng.uniform(120.0, 122.0, 3000)
+    lat[::50] = np.nan
+    codes = rng.integers(0, 3, 3000)
+    dept_mask = (np.uint64(1) << codes.astype(np.uint64)).reshape(-1, 1)
+    return ClusterPyramid(lat, lon, dept_mask, ['內科', '家醫科', '牙醫一般科']), lat, lon, codes
+
+
+def test_every_level_counts_every_located_point(pyramid):
+    pyramid, lat, _, _ = pyramid
+    world = pyramid.box(-90, -180, 90, 180)
+    for zoom in range(MIN_ZOOM, CLUSTER_MAX_ZOOM + 1):
+        level, positions = pyramid.clusters(zoom, world)
+        assert level.counts[positions].sum() == np.isfinite(lat).sum()
+
+
+def test_rows_match_brute_force(pyramid):
+    pyramid, lat, lon, _ = pyramid
+    south, west, north, east = 24.9, 121.3, 25.1, 121.6
+    rows = pyramid.rows(pyramid.box(south, west, north, east))
+    expected = np.flatnonzero((lat >= south) & (lat <= north) & (lon >= west) & (lon <= east))
+    np.testing.assert_array_equal(rows, expected)
+
+
+def test_describe_lists_top_departments(pyramid):
+    pyramid, lat, _, codes = pyramid
+    level, positions = pyramid.clusters(MIN_ZOOM, pyramid.box(-90, -180, 90, 180))
+    clusters = pyramid.describe(level, positions)
+    totals = {}
+    for cluster in clusters:
+        for name, count in cluster['departments'].items():
+            totals[name] = totals.get(name, 0) + count
+    located = np.isfinite(lat)
+    assert totals == {name: int((codes[located] == code).sum()) for code, name in enumerate(pyramid.departments)}
+
+
+def test_out_of_map_box_is_empty(pyramid):
+    pyramid = pyramid[0]
+    assert pyramid.visible_cells(10, (2.0, 3.0, 2.0, 3.0)) == 0
+    assert len(pyramid.rows((-np.inf, -0.5, -np.inf, -0.5))) == 0
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from clinic_store import ClinicStore
+from conftest import clinic_frame
+from department_index import CodeIndex, DepartmentIndex, intersect_rows
+
+
+@pytest.fixture(scope='module')
+def frame():
+    return clinic_frame(120)
+
+
+@pytest.fixture(scope='module')
+def index(frame):
+    store = ClinicStore.from_dataframe(frame)
+    return DepartmentIndex.from_mask(store.dept_mask, store.departments)
+
+
+def brute_force(frame, accept):
+    return np.flatnonzero([any(accept(name) for name in text.split(',')) for text in frame['科別']])
+
+
+@pytest.mark.parametrize('query, match, accept', [
+    ('內科', 'exact', lambda name: name == '內科'),
+    ('牙醫', 'prefix', lambda name: name.startswith('牙醫')),
+    ('牙', 'substring', lambda name: '牙' in name),
+    ('科', 'substring', lambda name: '科' in name),
+])
+def test_lookup_matches_brute_force(frame, index, query, match, accept):
+    np.testing.assert_array_equal(index.lookup(query, match), brute_force(frame, accept))
+
+
+def test_multi_department_rows_are_in_each_posting(frame, index):
+    both = np.flatnonzero(frame['科別'] == '內科,家醫科')
+    assert set(both) <= set(index.lookup('內科')) and set(both) <= set(index.lookup('家醫科'))
+
+
+def test_unknown_department_and_mode(index):
+    assert len(index.lookup('不存在的科')) == 0
+    assert len(index.lookup('內', 'exact')) == 0
+    with pytest.raises(ValueError):
+        index.lookup('內科', 'regex')
+
+
+def test_more_than_64_departments():
+    names = [f'科別{i}' for i in range(70)]
+    frame = clinic_frame(70).assign(科別=names)
+    store = ClinicStore.from_dataframe(frame)
+    index = DepartmentIndex.from_mask(store.dept_mask, store.departments)
+    for i in (0, 63, 64, 69):
+        np.testing.assert_array_equal(index.lookup(f'科別{i}'), [i])
+
+
+def test_intersect_rows():
+    np.testing.assert_array_equal(intersect_rows(np.array([1, 3, 5, 7]), np.array([3, 4, 7])), [3, 7])
+
+
+def test_code_index_matches_brute_force(frame):
+    index = CodeIndex.from_store(ClinicStore.from_dataframe(frame), '診療科別代碼')
+    codes = frame['診療科別代碼'].str.split(',')
+    for query in [('02',), ('45',), ('01', '02'), ('40', '41', '45'), ('99',), ()]:
+        expected = np.flatnonzero([bool(set(row) & set(query)) for row in codes])
+        np.testing.assert_array_equal(index.lookup(query), expected)
+
+
+def test_code_index_without_column_is_empty(frame):
+    store = ClinicStore.from_dataframe(frame.drop(columns=['服務項目代碼']))
+    index = CodeIndex.from_store(store, '服務項目代碼')
+    assert index.empty and len(index.lookup(('01',))) == 0
+    # 欄位存在但每列都空白時同樣沒有任何代碼
+    assert CodeIndex.from_store(ClinicStore.from_dataframe(frame), '服務項目代碼').empty
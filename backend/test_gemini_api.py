@@ -0,0 +1,229 @@
+import json
+import threading
+
+import pytest
+import requests
+
+import gemini_api
+from gemini_api import CircuitBreaker, SingleFlight, TTLCache, call_gemini_for_suggestion
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class StubResponse:
+    def __init__(self, status_code, department=None):
+        self.status_code = status_code
+        self.department = department
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'HTTP {self.status_code}')
+
+    def json(self):
+        text = json.dumps({'department': self.department}, ensure_ascii=False)
+        return {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+
+
+class StubSession:
+    """依序回傳預先排好的回應；Exception 會直接拋出"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def post(self, *args, **kwargs):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def gemini(monkeypatch, clock):
+    """每個測試各自一份快取、斷路器與 single flight，重試不等待"""
+    monkeypatch.setattr(gemini_api, 'suggestion_cache', TTLCache(clock=clock))
+    monkeypatch.setattr(gemini_api, 'breaker', CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock))
+    monkeypatch.setattr(gemini_api, 'single_flight', SingleFlight())
+    monkeypatch.setattr(gemini_api, 'retry_delay', lambda attempt: 0)
+
+    def use(*responses):
+        session = StubSession(*responses)
+        monkeypatch.setattr(gemini_api, 'session', session)
+        return session
+    return use
+
+
+def suggest(text='頭痛', fallback=None):
+    return call_gemini_for_suggestion(text, ['內科', '神經科'], 'key', fallback=fallback)
+
+
+def test_ttl_cache_expires(clock):
+    cache = TTLCache(ttl=60, clock=clock)
+    cache.put('a', ['內科'])
+    clock.advance(59)
+    assert cache.get('a') == ['內科']
+    clock.advance(1)
+    assert cache.get('a') is None
+
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    cache = TTLCache(max_entries=2, clock=clock)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+
+
+class CountingEvent(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self.waiters = 0
+
+    def wait(self, timeout=None):
+        self.waiters += 1
+        return super().wait(timeout)
+
+
+def test_single_flight_runs_once_for_concurrent_callers():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return ['內科']
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', slow)))
+    leader.start()
+    started.wait(5)
+    # 換成會計算等待者的 Event，確定四個跟隨者都在等同一個呼叫後才放行
+    done = flight._calls['k']['done'] = CountingEvent()
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', slow))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    for _ in range(500):
+        if done.waiters == 4:
+            break
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert done.waiters == 4
+    assert calls == [1]
+    assert results == [['內科']] * 5
+    assert flight._calls == {}
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        flight.do('k', fail)
+    # 失敗後不會留下卡住的呼叫
+    assert flight.do('k', lambda: 'ok') == 'ok'
+
+
+def test_breaker_transitions(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    assert breaker.allow() == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open' and breaker.allow() is None
+
+    clock.advance(30)
+    assert breaker.state == 'half-open'
+    assert breaker.allow() == 'half-open'
+    # 同時只放一個試探
+    assert breaker.allow() is None
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    clock.advance(30)
+    assert breaker.allow() == 'half-open'
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow() == 'closed'
+
+
+def test_breaker_release_frees_an_unfinished_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.advance(30)
+    permit = breaker.allow()
+    breaker.release(permit)
+    assert breaker.allow() == 'half-open'
+
+
+def test_retries_then_caches(gemini):
+    session = gemini(StubResponse(429), StubResponse(503), StubResponse(200, '神經科'))
+    assert suggest() == ['神經科']
+    assert session.calls == 3
+    # 只差標點的描述共用快取，不再打上游
+    assert suggest('頭痛。') == ['神經科'] and session.calls == 3
+
+
+def test_failures_open_the_breaker_and_return_fallback(gemini, clock):
+    session = gemini(*[StubResponse(500)] * 6)
+    assert suggest('a', fallback=['內科']) == ['內科']
+    assert suggest('b', fallback=['內科']) == ['內科']
+    assert gemini_api.breaker.state == 'open'
+    calls = session.calls
+    assert suggest('c', fallback=['內科']) == ['內科']
+    assert session.calls == calls
+
+    clock.advance(30)
+    gemini(StubResponse(200, '神經科'))
+    assert suggest('d') == ['神經科']
+    assert gemini_api.breaker.state == 'closed'
+
+
+def test_probe_answered_from_cache_releases_the_breaker(gemini, clock, monkeypatch):
+    gemini(*[StubResponse(500)] * 6)
+    suggest('a')
+    suggest('b')
+    clock.advance(30)
+
+    class RacingCache(TTLCache):
+        """外層檢查時還沒有，ask() 裡再檢查時已經被同時的請求寫入"""
+
+        def get(self, key):
+            self.checks = getattr(self, 'checks', 0) + 1
+            return None if self.checks == 1 else ['內科']
+
+    monkeypatch.setattr(gemini_api, 'suggestion_cache', RacingCache(clock=clock))
+    assert suggest('c') == ['內科']
+    assert gemini_api.breaker.state == 'half-open'
+    assert gemini_api.breaker.allow() == 'half-open'
+
+
+def test_http_error_is_not_retried(gemini):
+    session = gemini(StubResponse(400))
+    assert suggest(fallback=['內科']) == ['內科']
+    assert session.calls == 1
+
+
+def test_network_errors_are_retried(gemini):
+    session = gemini(requests.exceptions.ConnectionError('down'), StubResponse(200, '內科'))
+    assert suggest() == ['內科'] and session.calls == 2
@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+import geocode_cache
+from geocode_cache import MISS, GeocodeCache, normalize_address
+
+LOCATION = {'lat': 25.03, 'lng': 121.54}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'geocode_cache.sqlite3')
+
+
+def test_normalize_address():
+    assert normalize_address(' 台北市 大安區復興南路1號（2樓）、3號') == '臺北市大安區復興南路1號'
+
+
+def test_memory_and_sqlite_tiers(db_path):
+    cache = GeocodeCache(db_path)
+    assert cache.get('臺北市大安區復興南路1號') is MISS
+    cache.put('台北市大安區復興南路1號', LOCATION)
+    assert cache.get('臺北市大安區復興南路1號') == LOCATION
+
+    # 另一個 worker（新的行程）從 SQLite 讀到
+    other = GeocodeCache(db_path)
+    assert other.get('臺北市大安區復興南路1號') == LOCATION
+    assert other.stats()['sqlite_hits'] == 1
+
+
+def test_negative_entries_expire_sooner(db_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(geocode_cache.time, 'time', lambda: now[0])
+    cache = GeocodeCache(db_path, ttl=100, negative_ttl=10)
+    cache.put('查無此地址', None)
+    cache.put('臺北市大安區復興南路1號', LOCATION)
+    assert cache.get('查無此地址') is None
+    now[0] += 11
+    assert cache.get('查無此地址') is MISS
+    assert cache.get('臺北市大安區復興南路1號') == LOCATION
+
+
+def test_locked_database_falls_back_to_memory(db_path, monkeypatch):
+    monkeypatch.setattr(geocode_cache, 'BUSY_TIMEOUT', 0.05)
+    cache = GeocodeCache(db_path)
+    blocker = sqlite3.connect(db_path)
+    blocker.execute('BEGIN EXCLUSIVE')
+    try:
+        # 其他 worker 鎖住資料庫時，寫入失敗不會變成錯誤回應，結果仍留在記憶體
+        cache.put('臺北市大安區復興南路1號', LOCATION)
+        cache.count_upstream_call()
+        assert cache.get('臺北市大安區復興南路1號') == LOCATION
+        assert cache.stats()['sqlite_errors'] >= 2
+    finally:
+        blocker.rollback()
+        blocker.close()
+    # 鎖解除後照常寫入
+    cache.put('臺北市大安區復興南路2號', LOCATION)
+    assert GeocodeCache(db_path).get('臺北市大安區復興南路2號') == LOCATION
+
+
+def test_broken_database_reads_fall_back(db_path):
+    cache = GeocodeCache(db_path)
+    cache.count_upstream_call()
+    cache._db.execute('DROP TABLE geocode')
+    cache._db.execute('DROP TABLE upstream_usage')
+    assert cache.get('臺北市大安區復興南路1號') is MISS
+    assert cache.monthly_upstream_calls() == 1
+    assert cache.stats()['sqlite_errors'] == 2
+
+
+def test_memory_only_cache():
+    cache = GeocodeCache(None, max_entries=2)
+    for i in range(3):
+        cache.put(f'地址{i}', LOCATION)
+    assert cache.get('地址0') is MISS and cache.get('地址2') == LOCATION
+    cache.count_upstream_call()
+    assert cache.monthly_upstream_calls() == 1
@@ -0,0 +1,92 @@
+import json
+import os
+import random
+
+import pytest
+
+from keyword_matcher import AhoCorasick, SymptomMatcher
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def brute_force(keywords, text):
+    """逐一關鍵字做子字串搜尋，列出所有（包含重疊的）命中，排序與 find_all 相同"""
+    matches = set()
+    for keyword in set(filter(None, keywords)):
+        start = text.find(keyword)
+        while start != -1:
+            matches.add((start, start + len(keyword), keyword))
+            start = text.find(keyword, start + 1)
+    return sorted(matches, key=lambda match: (match[1], -len(match[2])))
+
+
+def find_all(automaton, text):
+    return sorted(automaton.find_all(text), key=lambda match: (match[1], -len(match[2])))
+
+
+def test_overlapping_keywords():
+    automaton = AhoCorasick(['he', 'she', 'his', 'hers', 'h', ''])
+    assert find_all(automaton, 'ushers') == brute_force(['he', 'she', 'his', 'hers', 'h'], 'ushers')
+    assert automaton.find_all('') == []
+
+
+def test_matches_brute_force_on_random_text():
+    rng = random.Random(11)
+    for _ in range(200):
+        # 字母很少，關鍵字之間大量互為前後綴，考驗失敗連結
+        keywords = [''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 12))]
+        text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 60)))
+        assert find_all(AhoCorasick(keywords), text) == brute_force(keywords, text)
+
+
+def test_matches_brute_force_on_real_keywords():
+    with open(os.path.join(BACKEND_DIR, 'emergency_keywords.json'), encoding='utf-8') as f:
+        keywords = json.load(f)
+    with open(os.path.join(BACKEND_DIR, 'symptom_map.json'), encoding='utf-8') as f:
+        keywords += list(json.load(f))
+    automaton = AhoCorasick(keywords)
+    rng = random.Random(5)
+    for _ in range(100):
+        text = '，'.join(rng.sample(keywords, 3)) + '還有一點' + rng.choice(keywords)[::-1]
+        assert find_all(automaton, text) == brute_force(keywords, text)
+
+
+@pytest.fixture
+def keyword_files(tmp_path):
+    emergency = tmp_path / 'emergency_keywords.json'
+    symptoms = tmp_path / 'symptom_map.json'
+
+    def write(emergency_keywords, symptom_map, mtime):
+        emergency.write_text(json.dumps(emergency_keywords, ensure_ascii=False), encoding='utf-8')
+        symptoms.write_text(json.dumps(symptom_map, ensure_ascii=False), encoding='utf-8')
+        for path in (emergency, symptoms):
+            os.utime(path, (mtime, mtime))
+    write(['胸痛', '呼吸困難', '胸'], {'頭痛': '神經科', '胸痛': '心臟內科', '咳嗽': '胸腔內科'}, 1000)
+    return str(emergency), str(symptoms), write
+
+
+def test_symptom_matcher_hits(keyword_files, capsys):
+    emergency, symptoms, _ = keyword_files
+    matcher = SymptomMatcher(emergency, symptoms, check_interval=3600)
+    emergency_hits, department_hits = matcher.match('咳嗽又呼吸困難，胸痛')
+    # 急症依檔案中的順序，同一個關鍵字再依位置
+    assert [hit['keyword'] for hit in emergency_hits] == ['胸痛', '呼吸困難', '胸']
+    assert emergency_hits[0] == {'keyword': '胸痛', 'start': 8, 'end': 10}
+    assert [(hit['keyword'], hit['department']) for hit in department_hits] == [('咳嗽', '胸腔內科'), ('胸痛', '心臟內科')]
+    assert matcher.match('沒有關鍵字') == ([], [])
+
+
+def test_symptom_matcher_reloads_changed_files(keyword_files, capsys):
+    emergency, symptoms, write = keyword_files
+    matcher = SymptomMatcher(emergency, symptoms, check_interval=0)
+    assert matcher.match('頭痛')[1][0]['department'] == '神經科'
+    write(['頭痛欲裂'], {'頭痛': '家庭醫學科'}, 2000)
+    emergency_hits, department_hits = matcher.match('頭痛欲裂')
+    assert [hit['keyword'] for hit in emergency_hits] == ['頭痛欲裂']
+    assert department_hits[0]['department'] == '家庭醫學科'
+    assert '重新編譯' in capsys.readouterr().out
+
+
+def test_symptom_matcher_missing_files(tmp_path, capsys):
+    matcher = SymptomMatcher(str(tmp_path / 'none.json'), str(tmp_path / 'none2.json'))
+    assert matcher.match('胸痛') == ([], [])
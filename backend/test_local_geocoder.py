@@ -0,0 +1,119 @@
+import pytest
+
+from local_geocoder import MAX_NUMBER_GAP, NEAR_NUMBER, LocalGeocoder, chinese_to_int, normalize_numbers
+
+AREA_DATA = {'臺北市': ['大安區', '中正區'], '苗栗縣': ['頭份鎮'], '高雄市': ['前鎮區']}
+
+
+@pytest.fixture(scope='module')
+def geocoder():
+    geocoder = LocalGeocoder(AREA_DATA)
+    # 復興南路一段：10 號到 50 號之間有門牌，路段的院所分布不到 1.5 公里
+    for number, lat in [(10, 25.030), (20, 25.032), (50, 25.038)]:
+        geocoder.add(f'臺北市大安區復興南路一段{number}號', lat, 121.543)
+    geocoder.add('臺北市大安區復興南路一段100巷5號', 25.040, 121.545)
+    geocoder.add('苗栗縣頭份市中華路100號', 24.688, 120.903)
+    # 前鎮區：路名裡有「村」，還有已知門牌相差很遠的路
+    geocoder.add('高雄市前鎮區新村路10號', 22.600, 120.310)
+    geocoder.add('高雄市前鎮區中村路3號', 22.601, 120.311)
+    geocoder.add('高雄市前鎮區中山四路1號', 22.590, 120.300)
+    geocoder.add(f'高雄市前鎮區中山四路{1 + MAX_NUMBER_GAP * 5}號', 22.596, 120.300)
+    return geocoder
+
+
+@pytest.mark.parametrize('text, expected', [('三一八', 318), ('三十二', 32), ('一百零五', 105), ('十', 10)])
+def test_chinese_to_int(text, expected):
+    assert chinese_to_int(text) == expected
+
+
+def test_normalize_numbers_keeps_road_names():
+    assert normalize_numbers('八德路三段十二巷５號') == '八德路3段12巷5號'
+
+
+def test_parse(geocoder):
+    assert geocoder.parse('台北市大安區復興南路一段100巷5號3樓') == ('臺北市', '大安區', '復興南路1段', '100', None, 5, '')
+    assert geocoder.parse('臺北市大安區復興南路一段12號旁') == ('臺北市', '大安區', '復興南路1段', None, None, 12, '旁')
+
+
+@pytest.mark.parametrize('address, road, number', [
+    ('高雄市前鎮區新村路12號', '新村路', 12),
+    ('高雄市前鎮區中村路3巷5號', '中村路', 5),
+    ('高雄市前鎮區三村路', '三村路', None),
+    ('高雄市前鎮區中村里中村路5號2樓之1', '中村路', 5),
+    ('高雄市前鎮區新村里8鄰中山四路7號', '中山四路', 7),
+])
+def test_parse_village_only_before_a_road_or_neighbourhood(geocoder, address, road, number):
+    city, district, parsed_road, _, _, parsed_number, rest = geocoder.parse(address)
+    assert (parsed_road, parsed_number, rest) == (road, number, '')
+
+
+def test_exact_address(geocoder):
+    location, tier, confident = geocoder.lookup('臺北市大安區復興南路一段20號')
+    assert tier == 'address' and confident and location['lat'] == pytest.approx(25.032)
+
+
+def test_interpolates_between_known_numbers(geocoder):
+    location, tier, confident = geocoder.lookup('臺北市大安區復興南路一段35號')
+    assert tier == 'street_number' and confident
+    assert location['lat'] == pytest.approx(25.035)
+
+
+def test_just_past_the_known_numbers_uses_the_nearest(geocoder):
+    location, tier, confident = geocoder.lookup(f'臺北市大安區復興南路一段{50 + NEAR_NUMBER}號')
+    assert tier == 'street_number' and confident and location['lat'] == pytest.approx(25.038)
+
+
+def test_number_just_before_the_known_numbers(geocoder):
+    # 1 號離最近的 10 號只差 9 號
+    location, tier, confident = geocoder.lookup('臺北市大安區復興南路一段1號之3')
+    assert tier == 'street_number' and confident and location['lat'] == pytest.approx(25.030)
+
+
+@pytest.mark.parametrize('address', ['臺北市大安區復興南路一段900號', '臺北市大安區復興南路一段7巷2號'])
+def test_unknown_part_of_road_is_not_confident(geocoder, address):
+    # 路段本身很短，但查詢的門牌（巷）不在已知範圍內，路段中心點可能差很遠
+    location, tier, confident = geocoder.lookup(address)
+    assert tier == 'road' and location is not None and not confident
+
+
+def test_road_without_number_is_confident_when_compact(geocoder):
+    _, tier, confident = geocoder.lookup('臺北市大安區復興南路一段')
+    assert tier == 'road' and confident
+
+
+def test_lane(geocoder):
+    location, tier, confident = geocoder.lookup('臺北市大安區復興南路一段100巷')
+    assert tier == 'lane' and confident and location['lat'] == pytest.approx(25.040)
+
+
+def test_road_named_after_a_village(geocoder):
+    # 「新村路」不能被當成「新村」里加上沒有路名，再回答一個有把握的行政區中心點
+    location, tier, confident = geocoder.lookup('高雄市前鎮區新村路10號')
+    assert tier == 'address' and confident and location['lat'] == pytest.approx(22.600)
+    assert geocoder.lookup('高雄市前鎮區三村路12號')[1:] == ('district', False)
+
+
+@pytest.mark.parametrize('address', ['臺北市大安區大安里', '臺北市大安區某某大樓', '臺北市大安區復興南路一段20號旁',
+                                     '臺北市大安區復興南路一段對面', '臺北市大安區復興南路一段35號後門', '臺北市市政府'])
+def test_unparsed_text_is_never_confident(geocoder, address):
+    location, _, confident = geocoder.lookup(address)
+    assert location is not None and not confident
+
+
+def test_interpolation_across_a_wide_gap_is_not_confident(geocoder):
+    location, tier, confident = geocoder.lookup(f'高雄市前鎮區中山四路{1 + MAX_NUMBER_GAP}號')
+    assert tier == 'street_number' and not confident
+    assert 22.590 < location['lat'] < 22.596
+
+
+def test_district_and_city(geocoder):
+    assert geocoder.lookup('臺北市大安區')[1:] == ('district', True)
+    assert geocoder.lookup('臺北市大安區不存在路5號')[1:] == ('district', False)
+    assert geocoder.lookup('臺北市中正區')[1:] == ('city', False)
+    assert geocoder.lookup('花蓮縣花蓮市中正路1號') == (None, None, False)
+
+
+def test_renamed_district(geocoder):
+    # 行政區資料還是「頭份鎮」，地址已經改寫成「頭份市」
+    location, tier, confident = geocoder.lookup('苗栗縣頭份鎮中華路100號')
+    assert tier == 'address' and confident
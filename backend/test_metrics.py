@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+import metrics
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def profiled_request_work(stop):
+    spin(stop)
+
+
+def other_request_work(stop):
+    spin(stop)
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'PROFILE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def run_for(seconds, profiler, target):
+    """target 在目前的執行緒跑 seconds 秒，同時另一個執行緒跑別的請求"""
+    stop = threading.Event()
+    other = threading.Thread(target=other_request_work, args=(stop,))
+    other.start()
+    timer = threading.Timer(seconds, stop.set)
+    timer.start()
+    try:
+        target(stop)
+    finally:
+        stop.set()
+        other.join()
+    return profiler
+
+
+def read_stacks(filename):
+    with open(filename, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_profiler_samples_only_the_request_thread(profile_dir):
+    trace, token = metrics.start_request('/search')
+    profiler = metrics.SamplingProfiler(interval=0.0005).start(trace)
+    run_for(0.2, profiler, profiled_request_work)
+    stacks = read_stacks(profiler.stop('/search'))
+    metrics.finish_request(trace, token, 200)
+    assert 'profiled_request_work' in stacks
+    assert 'other_request_work' not in stacks
+
+
+def test_profiler_follows_spans_into_worker_threads(profile_dir):
+    """ASGI：事件迴圈執行緒不取樣，請求在執行緒池裡進入 span() 時才取樣那個執行緒"""
+    trace, token = metrics.start_request('/search')
+    profiler = metrics.SamplingProfiler(interval=0.0005).start(trace, sample_current=False)
+    context = metrics._current.get()
+
+    def worker():
+        token = metrics._current.set(context)
+        with metrics.span('area_filter'):
+            run_for(0.2, profiler, profiled_request_work)
+        metrics._current.reset(token)
+        # 離開 span 之後這個執行緒可能去處理別的請求，不再取樣
+        assert threading.get_ident() not in profiler.threads
+        stop = threading.Event()
+        threading.Timer(0.05, stop.set).start()
+        other_request_work(stop)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    time.sleep(0.01)
+    stacks = read_stacks(profiler.stop('/search'))
+    metrics.finish_request(trace, token, 200)
+    assert 'profiled_request_work' in stacks
+    assert 'other_request_work' not in stacks
+    assert profiler.threads == set()
@@ -0,0 +1,170 @@
+import json
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+import requests
+
+import nlp_service
+from nlp_service import (CALIBRATION_FILE, TEMPERATURE, DepartmentClassifier, MicroBatcher, calibrate_threshold,
+                         load_threshold)
+
+AXES = {'牙': 0, '內': 1, '咳': 1, '眼': 2}
+
+
+class FakeEncoder:
+    """依字元對應到固定的軸，「咳嗽」和「內科」相近；記錄載入次數與每次編碼的文字"""
+    loads = 0
+
+    def __init__(self, model_dir=None):
+        FakeEncoder.loads += 1
+        self.calls = []
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        vectors = np.full((len(texts), len(set(AXES.values())) + 1), 0.05)
+        for i, text in enumerate(texts):
+            for char, axis in AXES.items():
+                vectors[i, axis] += text.count(char)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def fake_encoder(monkeypatch):
+    FakeEncoder.loads = 0
+    monkeypatch.setattr(nlp_service, 'SentenceEncoder', FakeEncoder)
+    return FakeEncoder
+
+
+LABELS = ['牙醫一般科', '內科', '眼科']
+
+
+def test_calibrate_picks_lowest_threshold_meeting_precision():
+    scored = [(0.99, True), (0.95, True), (0.9, True), (0.8, False), (0.7, True), (0.6, False), (0.5, False)]
+    threshold, precision, coverage = calibrate_threshold(scored, 0.75)
+    assert threshold == 0.7 and precision == 0.8 and coverage == 5 / 7
+    assert calibrate_threshold(scored, 1.0)[0] == 0.9
+
+
+def test_calibrate_keeps_ties_together():
+    scored = [(0.9, True), (0.8, True), (0.8, False), (0.8, False)]
+    assert calibrate_threshold(scored, 0.9)[0] == 0.9
+
+
+def test_calibrate_without_a_passing_threshold():
+    assert calibrate_threshold([(0.9, False), (0.5, True)], 0.9) == (None, None, 0.0)
+
+
+def test_load_threshold(tmp_path, monkeypatch):
+    monkeypatch.delenv('NLP_CONFIDENCE_THRESHOLD', raising=False)
+    assert load_threshold(str(tmp_path)) is None
+    path = tmp_path / CALIBRATION_FILE
+    path.write_text(json.dumps({'threshold': 0.42, 'temperature': TEMPERATURE}))
+    assert load_threshold(str(tmp_path)) == 0.42
+    # 換了溫度，之前的校準就不適用
+    path.write_text(json.dumps({'threshold': 0.42, 'temperature': TEMPERATURE * 2}))
+    assert load_threshold(str(tmp_path)) is None
+    monkeypatch.setenv('NLP_CONFIDENCE_THRESHOLD', '0.7')
+    assert load_threshold(str(tmp_path)) == 0.7
+
+
+def test_classify_reports_threshold(fake_encoder):
+    classifier = DepartmentClassifier('unused', threshold=0.6)
+    result = classifier.classify('一直咳嗽', LABELS)
+    assert result['labels'][0] == '內科'
+    assert result['threshold'] == 0.6
+    assert abs(sum(result['scores']) - 1) < 1e-3
+
+
+def test_warm_up_loads_once_and_caches_label_vectors(fake_encoder):
+    classifier = DepartmentClassifier('unused')
+    classifier.warm_up(LABELS)
+    assert fake_encoder.loads == 1 and classifier.stats()['labels_ready']
+    encoder = classifier.encoder
+    classifier.classify('牙痛', LABELS)
+    # 預熱後第一個請求只需要編碼症狀文字
+    assert encoder.calls[-1] == ['牙痛'] and fake_encoder.loads == 1
+
+
+def test_batch_failure_only_fails_the_bad_item():
+    def run_batch(items):
+        if 'bad' in items:
+            raise ValueError('bad input')
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(run_batch, window=0.2)
+    results = {}
+
+    def submit(item):
+        try:
+            results[item] = batcher.submit(item, timeout=5)
+        except ValueError as e:
+            results[item] = e
+
+    threads = [threading.Thread(target=submit, args=(item,)) for item in ['a', 'bad', 'b']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results['a'] == 'A' and results['b'] == 'B'
+    assert isinstance(results['bad'], ValueError)
+    assert batcher.items == 2 and len(batcher.latencies) == 2
+
+
+def test_stats_report_latency_percentiles(fake_encoder):
+    classifier = DepartmentClassifier('unused')
+    assert classifier.stats()['latency_ms'] is None
+    for _ in range(5):
+        classifier.classify('牙痛', LABELS)
+    latency = classifier.stats()['latency_ms']
+    assert 0 <= latency['p50'] <= latency['p95']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(classifier, **kwargs):
+    port = free_port()
+    threading.Thread(target=nlp_service.serve, args=('127.0.0.1', port, classifier, LABELS), kwargs=kwargs,
+                     daemon=True).start()
+    return f'http://127.0.0.1:{port}'
+
+
+def wait_for_health(url, ready=lambda health: True):
+    for _ in range(200):
+        try:
+            health = requests.get(f'{url}/health', timeout=1).json()
+            if ready(health):
+                return health
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.01)
+    return health
+
+
+def test_server_loads_the_model_on_first_request(fake_encoder):
+    url = start_server(DepartmentClassifier('unused'), warm_up=False)
+    assert not wait_for_health(url)['model_loaded']
+    time.sleep(0.05)
+    assert fake_encoder.loads == 0
+    result = requests.post(f'{url}/classify', json={'text': '牙痛', 'labels': LABELS}, timeout=5).json()
+    assert result['labels'][0] == '牙醫一般科'
+    health = requests.get(f'{url}/health', timeout=1).json()
+    assert health['model_loaded'] and health['requests'] == 1 and fake_encoder.loads == 1
+
+
+def test_server_warms_up_in_background(fake_encoder):
+    url = start_server(DepartmentClassifier('unused', threshold=0.5), warm_up=True)
+    health = wait_for_health(url, lambda health: health['labels_ready'])
+    assert health['model_loaded'] and health['threshold'] == 0.5
+
+    response = requests.post(f'{url}/warmup', json={'labels': ['眼科', '內科']}, timeout=5)
+    assert response.status_code == 200 and response.json()['labels_ready']
+    result = requests.post(f'{url}/classify', json={'text': '眼睛痛', 'labels': ['眼科', '內科']}, timeout=5).json()
+    assert result['labels'][0] == '眼科'
+    assert requests.post(f'{url}/classify', json={'text': ''}, timeout=5).status_code == 400
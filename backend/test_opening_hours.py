@@ -0,0 +1,98 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from clinic_store import ClinicStore
+from conftest import clinic_frame
+from opening_hours import TAIPEI, load_schedule, open_rows, parse_time, requested_time, schedule_masks, slot_bit
+
+MONDAY = datetime(2026, 10, 19, tzinfo=TAIPEI)
+
+
+@pytest.mark.parametrize('hour, minute, bit', [
+    (7, 59, None), (8, 0, 0), (11, 59, 0), (12, 0, 7), (17, 59, 7), (18, 0, 14), (21, 59, 14), (22, 0, None), (3, 0, None),
+])
+def test_slot_bit_monday(hour, minute, bit):
+    assert slot_bit(MONDAY.replace(hour=hour, minute=minute)) == bit
+
+
+def test_slot_bit_follows_weekday():
+    # 第 (時段 * 7 + 星期) 位：星期日晚上是最後一位
+    for day in range(7):
+        moment = MONDAY + timedelta(days=day)
+        assert slot_bit(moment.replace(hour=9)) == day
+        assert slot_bit(moment.replace(hour=13)) == 7 + day
+        assert slot_bit(moment.replace(hour=19)) == 14 + day
+
+
+def test_open_rows_checks_the_slot_bit():
+    # 與 get_service_hours.py 的 21 碼格式相同：N 有看診、Y 休診，前 7 碼上午、中間 7 碼下午、最後 7 碼晚上
+    patterns = ['N' + 'Y' * 20, 'Y' * 7 + 'N' + 'Y' * 13, 'Y' * 20 + 'N', 'N' * 21, 'Y' * 21]
+    masks = np.array([sum(1 << slot for slot, flag in enumerate(p) if flag == 'N') for p in patterns], dtype=np.uint32)
+    rows = np.arange(len(patterns))
+    np.testing.assert_array_equal(open_rows(rows, masks, MONDAY.replace(hour=9)), [True, False, False, True, False])
+    np.testing.assert_array_equal(open_rows(rows, masks, MONDAY.replace(hour=13)), [False, True, False, True, False])
+    sunday_night = (MONDAY + timedelta(days=6)).replace(hour=20)
+    np.testing.assert_array_equal(open_rows(rows, masks, sunday_night), [False, False, True, True, False])
+    # 只看候選列，順序照候選列
+    np.testing.assert_array_equal(open_rows(np.array([3, 0]), masks, MONDAY.replace(hour=9)), [True, True])
+
+
+def test_open_rows_outside_any_period_is_all_closed():
+    masks = np.full(4, (1 << 21) - 1, dtype=np.uint32)
+    assert not open_rows(np.arange(4), masks, MONDAY.replace(hour=23)).any()
+
+
+def test_parse_time_converts_to_taipei():
+    assert parse_time('2026-10-19T09:30') == MONDAY.replace(hour=9, minute=30)
+    moment = parse_time('2026-10-19T01:30+00:00')
+    assert moment.tzinfo == TAIPEI and moment.hour == 9 and slot_bit(moment) == 0
+    with pytest.raises(ValueError):
+        parse_time('明天早上')
+
+
+def test_requested_time():
+    assert requested_time({}) is None
+    assert requested_time({'open_now': '0'}) is None
+    assert requested_time({'open_at': '2026-10-19T13:00', 'open_now': '1'}) == MONDAY.replace(hour=13)
+    before = datetime.now(timezone.utc)
+    now = requested_time({'open_now': 'True'})
+    assert now.tzinfo == TAIPEI and before <= now <= datetime.now(timezone.utc)
+    with pytest.raises(ValueError):
+        requested_time({'open_at': '2026-13-40'})
+
+
+def test_schedule_masks_follow_row_order(capsys):
+    store = ClinicStore.from_dataframe(clinic_frame(n=20))
+    schedule = {store.text('機構代碼', 3): 5, store.text('機構代碼', 0): 1 << 20, '9999999999': 7}
+    masks = schedule_masks(store, schedule)
+    assert masks.dtype == np.uint32 and len(masks) == store.size
+    expected = np.zeros(store.size, dtype=np.uint32)
+    expected[3], expected[0] = 5, 1 << 20
+    np.testing.assert_array_equal(masks, expected)
+    assert not schedule_masks(store, {}).any()
+
+
+def test_load_schedule(tmp_path, capsys):
+    path = tmp_path / 'service_hours.json'
+    assert load_schedule(str(path)) == {}
+    path.write_text(json.dumps({'0000000001': 3}), encoding='utf-8')
+    assert load_schedule(str(path)) == {'0000000001': 3}
+    path.write_text('{', encoding='utf-8')
+    assert load_schedule(str(path)) == {}
+
+
+def test_search_open_at_matches_the_masks(client, services_module):
+    snapshot = services_module.snapshots.current
+    rows = np.intersect1d(snapshot.area_index.lookup('臺北市'), snapshot.department_index.lookup('內科', 'exact'))
+    rows = rows[np.isfinite(snapshot.store.latitude[rows])]
+    for hour, bit in [(9, 0), (13, 7), (19, 14)]:
+        response = client.get(f'/search?city=臺北市&department=內科&open_at=2026-10-19T{hour:02d}:00&limit=1')
+        assert response.status_code == 200
+        expected = int(((snapshot.service_hours[rows] >> bit) & 1).sum())
+        assert int(response.headers['X-Total-Count']) == expected
+    response = client.get('/search?city=臺北市&department=內科&open_at=2026-10-19T23:00')
+    assert response.status_code == 200 and response.get_json() == []
+    assert client.get('/search?city=臺北市&department=內科&open_at=soon').status_code == 400
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from pagination import MAX_LIMIT, next_cursor, parse_page, select_page, sort_keys
+
+
+def full_sort(keys):
+    return np.argsort(keys, kind='stable')
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pages_match_full_sort(seed):
+    rng = np.random.default_rng(seed)
+    # 距離相同的院所很多時，分頁仍要與完整的穩定排序一致
+    keys = rng.integers(0, 30, 400).astype(float)
+    expected = full_sort(keys)
+    pages = [select_page(keys, offset, 37) for offset in range(0, 400, 37)]
+    np.testing.assert_array_equal(np.concatenate(pages), expected)
+
+
+def test_page_past_the_end_is_empty():
+    keys = np.arange(10, dtype=float)
+    assert len(select_page(keys, 10, 5)) == 0
+    np.testing.assert_array_equal(select_page(keys, 8, 5), [8, 9])
+
+
+def test_no_sort_keeps_original_order():
+    np.testing.assert_array_equal(select_page(None, 3, 4, total=5), [3, 4])
+
+
+def test_open_first_puts_open_rows_first():
+    distances = np.array([5.0, 1.0, 3.0, 2.0])
+    is_open = np.array([True, False, True, False])
+    keys = sort_keys('open_first', distances, is_open)
+    np.testing.assert_array_equal(select_page(keys, 0, 4), [2, 0, 1, 3])
+    keys = sort_keys('open_first', None, is_open)
+    np.testing.assert_array_equal(select_page(keys, 0, 4), [0, 2, 1, 3])
+
+
+@pytest.mark.parametrize('args', [{'limit': '0'}, {'limit': str(MAX_LIMIT + 1)}, {'cursor': '-1'}, {'limit': 'x'}])
+def test_parse_page_rejects_out_of_range(args):
+    with pytest.raises(ValueError):
+        parse_page(args)
+
+
+def test_cursor_round_trip():
+    assert parse_page({'limit': '20', 'cursor': '40'}) == (40, 20)
+    assert next_cursor(40, 20, 61) == '60'
+    assert next_cursor(40, 20, 60) == ''
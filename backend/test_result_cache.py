@@ -0,0 +1,94 @@
+import math
+
+import numpy as np
+import pytest
+
+from result_cache import ENTRY_OVERHEAD, GRID_DEG, RADIUS_STEP_KM, ResultCache, snapped_circle
+from spatial_index import haversine_km
+
+
+def test_snapped_circle_covers_query_circle():
+    rng = np.random.default_rng(3)
+    for lat, lon, radius in zip(rng.uniform(-60, 60, 500), rng.uniform(-179, 179, 500), rng.uniform(0, 20, 500)):
+        grid, bucket, center_lat, center_lon, reach = snapped_circle(lat, lon, radius)
+        assert bucket >= radius and bucket - radius < RADIUS_STEP_KM
+        assert abs(center_lat - lat) <= GRID_DEG / 2 + 1e-12 and abs(center_lon - lon) <= GRID_DEG / 2 + 1e-12
+        # 查詢圓一定在以網格中心為圓心、涵蓋半徑畫的圓內
+        assert haversine_km(center_lat, center_lon, lat, lon) + radius <= reach
+
+
+def test_snapped_circle_shares_key_within_cell():
+    a = snapped_circle(25.0301, 121.5401, 1.2)
+    b = snapped_circle(25.0318, 121.5419, 1.4)
+    assert a[:2] == b[:2]
+
+
+def test_snapped_circle_unbounded_radius():
+    _, bucket, _, _, reach = snapped_circle(25.0, 121.5, math.inf)
+    assert bucket == math.inf and reach == math.inf
+
+
+@pytest.mark.parametrize('lat, lon, radius', [
+    (25.0, 1e308, 1), (1e308, 121.5, 1), (math.nan, 121.5, 1), (25.0, -math.inf, 1), (91, 0, 1), (25.0, 121.5, math.nan),
+])
+def test_snapped_circle_rejects_invalid_input(lat, lon, radius):
+    with pytest.raises(ValueError):
+        snapped_circle(lat, lon, radius)
+
+
+def rows(n):
+    return np.arange(n, dtype=np.int64)
+
+
+def test_get_put_and_stats():
+    snapshot = object()
+    cache = ResultCache(1 << 20)
+    cache.reset(snapshot)
+    assert cache.get(snapshot, ('area', 'x')) is None
+    cache.put(snapshot, ('area', 'x'), rows(10))
+    np.testing.assert_array_equal(cache.get(snapshot, ('area', 'x')), rows(10))
+    stats = cache.stats()
+    assert stats['entries'] == 1 and stats['bytes'] == rows(10).nbytes + ENTRY_OVERHEAD
+    assert stats['area'] == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_lru_eviction_by_bytes():
+    snapshot = object()
+    size = rows(100).nbytes + ENTRY_OVERHEAD
+    cache = ResultCache(size * 8)
+    cache.reset(snapshot)
+    for i in range(8):
+        cache.put(snapshot, ('nearby', i), rows(100))
+    cache.get(snapshot, ('nearby', 0))  # 最近用過，不會被擠掉
+    cache.put(snapshot, ('nearby', 8), rows(100))
+    assert cache.get(snapshot, ('nearby', 1)) is None
+    assert cache.get(snapshot, ('nearby', 0)) is not None
+    assert cache.stats()['evictions'] == 1 and cache.bytes <= cache.max_bytes
+
+
+def test_oversized_values_are_not_cached():
+    snapshot = object()
+    cache = ResultCache(8 * (ENTRY_OVERHEAD + 80))
+    cache.reset(snapshot)
+    cache.put(snapshot, ('area', 'big'), rows(1000))
+    assert cache.get(snapshot, ('area', 'big')) is None and cache.bytes == 0
+
+
+def test_stale_snapshot_is_ignored_and_reset_clears():
+    old, new = object(), object()
+    cache = ResultCache(1 << 20)
+    cache.reset(old)
+    cache.put(old, ('area', 'x'), rows(5))
+    cache.reset(new)
+    assert cache.get(new, ('area', 'x')) is None
+    # 重新載入前就開始的請求帶的是舊的 Snapshot，讀寫都直接略過
+    cache.put(old, ('area', 'y'), rows(5))
+    assert cache.get(old, ('area', 'y')) is None and cache.stats()['entries'] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    snapshot = object()
+    cache = ResultCache(0)
+    cache.reset(snapshot)
+    cache.put(snapshot, ('area', 'x'), rows(1))
+    assert cache.get(snapshot, ('area', 'x')) is None
@@ -0,0 +1,179 @@
+import threading
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('query', [
+    'lat=25.03&lon=121.54&radius=inf&department=內科',
+    'lat=25.03&lon=121.54&radius=nan&department=內科',
+    'lat=25.03&lon=1e308&radius=3&department=內科',
+    'lat=95&lon=121.54&radius=3&department=內科',
+    'lat=25.03&lon=-181&k=5&department=內科',
+    'lat=nan&lon=121.54&radius=3&department=內科',
+    'lat=25.03&lon=inf&k=5&department=內科',
+    'lat=abc&lon=121.54&department=內科',
+])
+def test_nearby_rejects_invalid_location(client, query):
+    response = client.get('/search/nearby?' + query)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_nearby_large_radius_returns_every_match(client, services_module):
+    response = client.get('/search/nearby?lat=25.03&lon=121.54&radius=1e300&department=內科&limit=500')
+    assert response.status_code == 200
+    snapshot = services_module.snapshots.current
+    rows = snapshot.department_index.lookup('內科', 'exact')
+    located = np.isfinite(snapshot.store.latitude[rows]).sum()
+    assert int(response.headers['X-Total-Count']) == located
+
+
+def test_batch_isolates_invalid_nearby_items(client):
+    response = client.post('/search/batch', json={'department': '內科', 'queries': [
+        {'lat': 25.03, 'lon': 1e308}, {'lat': 25.03, 'lon': 121.54, 'radius': 'inf'}, {'lat': 25.03, 'lon': 121.54},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert 'error' in results[0] and 'error' in results[1]
+    assert results[2]['total'] > 0
+
+
+@pytest.mark.parametrize('query', [
+    'bbox=-inf,-inf,inf,inf&zoom=8',
+    'bbox=nan,24,122,26&zoom=8',
+    'bbox=120,-100,122,26&zoom=8',
+    'bbox=-200,20,200,26&zoom=8',
+    'bbox=122,24,120,26&zoom=8',
+    'bbox=120,24,122&zoom=8',
+    'bbox=120,24,122,26&zoom=abc',
+])
+def test_map_rejects_invalid_bbox(client, query):
+    response = client.get('/map/clusters?' + query)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('query', [
+    'bbox=119,21,123,26&zoom=7',  # 聚合
+    'bbox=121.54,25.03,121.545,25.035&zoom=18',  # 院所
+    'bbox=-180,-90,180,90&zoom=18',  # 畫面太大，改用較粗的一層
+])
+def test_map_zoom_is_the_level_used(client, query):
+    body = client.get('/map/clusters?' + query).get_json()
+    assert 5 <= body['zoom'] <= 15
+    assert ('clusters' in body) != ('clinics' in body)
+
+
+@pytest.mark.parametrize('query', [
+    'city=臺北市&department=內科&sort=distance&lat=nan&lon=121.54',
+    'city=臺北市&department=內科&sort=distance&lat=25.03&lon=inf',
+    'city=臺北市&department=內科&lat=-91&lon=121.54',
+    'city=臺北市&department=內科&sort=distance&lat=25.03&lon=1e308',
+])
+def test_area_rejects_invalid_location(client, query):
+    response = client.get('/search?' + query)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_area_distance_sort_pages_are_consistent(client):
+    query = '/search?city=臺北市&department=內科&sort=distance&lat=25.03&lon=121.54&limit=7'
+    first = client.get(query)
+    body = first.get_json()
+    assert first.status_code == 200 and len(body) == 7
+    distances = [record['distance_km'] for record in body]
+    assert distances == sorted(distances)
+    seen = [record['機構名稱'] for record in body]
+    cursor = first.headers['X-Next-Cursor']
+    while cursor:
+        page = client.get(f'{query}&cursor={cursor}')
+        seen += [record['機構名稱'] for record in page.get_json()]
+        cursor = page.headers['X-Next-Cursor']
+    assert len(seen) == len(set(seen)) == int(first.headers['X-Total-Count'])
+
+
+def test_low_confidence_nlp_guess_is_the_gemini_fallback(services_module, monkeypatch):
+    monkeypatch.setattr(services_module, 'nlp', True)
+    monkeypatch.setattr(services_module, 'nlp_classifier',
+                        lambda text, labels: {'labels': ['神經科', '內科'], 'scores': [0.55, 0.45]})
+    result, fallback = services_module.suggest_locally('說不太出來的不舒服')
+    assert result is None and fallback == ['神經科']
+
+
+def test_without_nlp_the_gemini_fallback_is_empty(services_module):
+    result, fallback = services_module.suggest_locally('說不太出來的不舒服')
+    assert result is None and fallback == []
+
+
+def test_confident_nlp_answer_needs_a_threshold(services_module, monkeypatch):
+    monkeypatch.setattr(services_module, 'nlp', True)
+    answer = {'labels': ['神經科', '內科'], 'scores': [0.97, 0.03]}
+    monkeypatch.setattr(services_module, 'nlp_classifier', lambda text, labels: dict(answer, threshold=0.95))
+    result, _ = services_module.suggest_locally('說不太出來的不舒服')
+    assert result[0] == {'departments': ['神經科']}
+    # 服務還沒校準時不回傳門檻，再高的分數也要問 Gemini
+    monkeypatch.setattr(services_module, 'nlp_classifier', lambda text, labels: dict(answer, threshold=None))
+    result, fallback = services_module.suggest_locally('說不太出來的不舒服')
+    assert result is None and fallback == ['神經科']
+
+
+@pytest.mark.parametrize('eager', [False, True])
+def test_snapshot_swap_warms_up_the_nlp_service_only_when_eager(services_module, monkeypatch, eager):
+    posted = []
+    monkeypatch.setattr(services_module, 'nlp', True)
+    monkeypatch.setattr(services_module, 'NLP_EAGER_WARMUP', eager)
+    monkeypatch.setattr(services_module, 'nlp_warm_up', posted.append)
+    services_module.on_snapshot_swap(services_module.snapshots.current)
+    for thread in threading.enumerate():
+        if thread.name == 'nlp-warmup':
+            thread.join(5)
+    assert posted == ([services_module.snapshots.current.departments_list] if eager else [])
+
+
+def area_rows(snapshot, city, codes):
+    rows = np.intersect1d(snapshot.area_index.lookup(city), snapshot.department_code_index.lookup(codes))
+    return rows[np.isfinite(snapshot.store.latitude[rows])]
+
+
+@pytest.mark.parametrize('query, codes', [
+    ('dept_code=45', ('45',)),
+    ('dept_code=01,%2002', ('01', '02')),
+    ('specialty=牙醫', tuple(str(code) for code in range(40, 50))),
+    ('specialty=兒童牙科', ('45',)),
+])
+def test_code_filters_select_rows_by_code(client, services_module, query, codes):
+    response = client.get(f'/search?city=臺北市&{query}&limit=1')
+    assert response.status_code == 200
+    expected = area_rows(services_module.snapshots.current, '臺北市', codes)
+    assert len(expected) > 0 and int(response.headers['X-Total-Count']) == len(expected)
+
+
+def test_code_filters_intersect_with_department_text(client, services_module):
+    # 合成資料裡只有「內科,家醫科」（第 6n+5 列）同時符合科別文字與 01 代碼
+    response = client.get('/search?city=臺北市&department=內科&dept_code=01')
+    assert response.status_code == 200
+    numbers = [int(record['機構名稱'].removeprefix('測試診所')) for record in response.get_json()]
+    assert numbers and all(number % 6 == 5 for number in numbers)
+
+
+@pytest.mark.parametrize('query, status', [
+    ('specialty=不存在的科', 400),
+    ('service_item=E1', 500),  # 合成資料沒有服務項目代碼
+])
+def test_code_filter_errors(client, query, status):
+    response = client.get(f'/search?city=臺北市&{query}')
+    assert response.status_code == status
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('path', ['/search?city=臺北市', '/search/nearby?lat=25.03&lon=121.54&radius=5'])
+def test_department_defaults_to_substring_match(client, path):
+    def total(query):
+        response = client.get(f'{path}&{query}&limit=1')
+        assert response.status_code == 200
+        return int(response.headers['X-Total-Count'])
+
+    # 沒有帶 match 時與以前的 str.contains 相同，「牙醫」找得到「牙醫一般科」
+    assert total('department=牙醫') == total('department=牙醫&match=substring') > 0
+    assert total('department=牙醫&match=exact') == 0
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from spatial_index import GridIndex, haversine_km, valid_coordinates
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(1)
+    lat = rng.uniform(21.9, 25.3, 2000)
+    lon = rng.uniform(120.0, 122.0, 2000)
+    # 沒有座標的院所不進索引
+    lat[::97] = np.nan
+    return lat, lon
+
+
+def brute_force(lat, lon, user_lat, user_lon, radius_km):
+    distances = haversine_km(user_lat, user_lon, lat, lon)
+    return np.flatnonzero(distances <= radius_km)
+
+
+@pytest.mark.parametrize('user_lat, user_lon, radius_km', [
+    (25.03, 121.54, 0.5), (25.03, 121.54, 5), (23.0, 120.5, 30), (22.0, 121.9, 300), (40.0, 100.0, 10),
+])
+def test_query_radius_matches_brute_force(points, user_lat, user_lon, radius_km):
+    lat, lon = points
+    index = GridIndex(lat, lon)
+    rows, distances = index.query_radius(user_lat, user_lon, radius_km)
+    expected = brute_force(lat, lon, user_lat, user_lon, radius_km)
+    np.testing.assert_array_equal(rows, expected)
+    np.testing.assert_allclose(distances, haversine_km(user_lat, user_lon, lat[rows], lon[rows]))
+
+
+def test_candidates_cover_every_hit(points):
+    lat, lon = points
+    index = GridIndex(lat, lon)
+    slots = index.candidates(24.5, 121.0, 12)
+    hits = brute_force(lat, lon, 24.5, 121.0, 12)
+    assert set(hits) <= set(index._rows[slots].tolist())
+    # 只會碰到外接框內的格子，不是整個資料表
+    assert len(slots) < index.size
+
+
+@pytest.mark.parametrize('radius_km', [np.inf, 1e300])
+def test_unbounded_radius_returns_every_point(points, radius_km):
+    lat, lon = points
+    index = GridIndex(lat, lon)
+    rows, _ = index.query_radius(25.05, 121.55, radius_km)
+    np.testing.assert_array_equal(rows, np.flatnonzero(np.isfinite(lat) & np.isfinite(lon)))
+
+
+@pytest.mark.parametrize('user_lat, user_lon, radius_km', [
+    (np.nan, 121.5, 3), (25.0, np.inf, 3), (25.0, 1e308, 3), (-1e308, 121.5, 3), (25.0, 121.5, np.nan), (25.0, 121.5, -1),
+])
+def test_invalid_queries_return_nothing(points, user_lat, user_lon, radius_km):
+    lat, lon = points
+    rows, distances = GridIndex(lat, lon).query_radius(user_lat, user_lon, radius_km)
+    assert len(rows) == 0 and len(distances) == 0
+
+
+def test_query_nearest_returns_k_closest(points):
+    lat, lon = points
+    index = GridIndex(lat, lon)
+    rows, distances = index.query_nearest(24.0, 121.0, 10)
+    closest = np.sort(haversine_km(24.0, 121.0, lat, lon)[np.isfinite(lat)])[:10]
+    np.testing.assert_allclose(np.sort(distances)[:10], closest)
+
+
+def test_query_nearest_respects_accept(points):
+    lat, lon = points
+    index = GridIndex(lat, lon)
+    rows, _ = index.query_nearest(24.0, 121.0, 5, accept=lambda rows: rows % 2 == 0)
+    assert len(rows) >= 5 and np.all(rows % 2 == 0)
+
+
+def test_empty_index():
+    index = GridIndex(np.empty(0), np.empty(0))
+    rows, distances = index.query_radius(25.0, 121.5, np.inf)
+    assert len(rows) == 0 and len(distances) == 0
+
+
+@pytest.mark.parametrize('lat, lon, expected', [
+    (25.0, 121.5, True), (-90, 180, True), (90.1, 0, False), (0, -180.5, False),
+    (np.nan, 0, False), (0, np.inf, False), (1e308, 1e308, False),
+])
+def test_valid_coordinates(lat, lon, expected):
+    assert valid_coordinates(lat, lon) is expected
@@ -0,0 +1,257 @@
+"""
+搜尋相關端點的效能測試：
+  stages   ：各個篩選步驟的微基準（縣市區索引、科別索引、交集、營業時間、空間查詢、分頁、序列化、關鍵字比對）
+  requests ：透過 Flask test client 量測 /search、/search/nearby、/api/suggest-department 的端到端延遲
+每一項都回報 p50/p95/p99（毫秒），可以輸出 JSON，並用 --baseline 和之前的結果比較。
+
+查詢參數由 --seed 決定，同一份資料、同一個 seed 每次跑的查詢都相同。
+資料可以指定現有的 backend 工作目錄（--data-dir），或用 synthetic_data.py 即時產生（--scale）。
+Gemini 在測試時停用（API_KEY 設為空），沒有關鍵字命中的症狀會直接走備援，不會連外。
+
+用法（在專案根目錄）：
+    python benchmarks/bench_search.py --scale 1 --json bench_x1.json
+    python benchmarks/bench_search.py --scale 10 --json bench_x10.json --baseline bench_x10_old.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..', 'backend'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic_data  # noqa: E402
+
+PERCENTILES = (50, 95, 99)
+SYMPTOMS = ['頭痛', '咳嗽流鼻水', '肚子痛拉肚子', '皮膚很癢起疹子', '牙齒痛', '眼睛紅腫', '胸痛', '腰痠背痛',
+            '最近睡不好', '發燒喉嚨痛']
+# 固定的時間點，讓營業時間篩選的結果不受執行當下的時間影響（星期三上午）
+OPEN_AT = '2025-08-06T10:30'
+
+
+def summarize(samples):
+    values = np.percentile(samples, PERCENTILES)
+    summary = {f'p{p}_ms': round(float(v), 4) for p, v in zip(PERCENTILES, values)}
+    summary['mean_ms'] = round(float(np.mean(samples)), 4)
+    summary['n'] = len(samples)
+    return summary
+
+
+def measure(fn, inputs, repeat):
+    """對每個輸入各呼叫 fn 一次（共 repeat 輪），回傳每次呼叫時間的分布"""
+    for item in inputs[:3]:
+        fn(item)  # 暖機
+    samples = []
+    for _ in range(repeat):
+        for item in inputs:
+            started = time.perf_counter()
+            fn(item)
+            samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+def sample_queries(snapshot, count, seed):
+    """依 seed 產生查詢：縣市區、科別、使用者位置（在有座標的院所附近）"""
+    rng = np.random.default_rng(seed)
+    store = snapshot.store
+    located = np.flatnonzero(np.isfinite(store.latitude) & np.isfinite(store.longitude))
+    cities = list(snapshot.area_data)
+    departments = list(snapshot.department_index.postings)
+    queries = []
+    for _ in range(count):
+        city = cities[rng.integers(len(cities))]
+        districts = snapshot.area_data[city]
+        row = located[rng.integers(len(located))]
+        department = departments[rng.integers(len(departments))]
+        queries.append({
+            'city': city,
+            'district': districts[rng.integers(len(districts))] if rng.random() < 0.7 else '',
+            'department': department,
+            'fragment': department[:2],
+            'lat': float(store.latitude[row] + rng.normal(0, 0.01)),
+            'lon': float(store.longitude[row] + rng.normal(0, 0.01)),
+            'radius': float(rng.choice([1, 3, 5])),
+            'symptoms': SYMPTOMS[rng.integers(len(SYMPTOMS))],
+        })
+    return queries
+
+
+def bench_stages(snapshot, symptom_matcher, queries, repeat):
+    from department_index import intersect_rows
+    from opening_hours import open_rows, parse_time
+    from pagination import select_page
+
+    store = snapshot.store
+    moment = parse_time(OPEN_AT)
+    area_rows = [snapshot.area_index.lookup(q['city'], q['district']) for q in queries]
+    dept_rows = [snapshot.department_index.lookup(q['department']) for q in queries]
+    candidates = [intersect_rows(a, d) for a, d in zip(area_rows, dept_rows)]
+    radius_hits = [snapshot.spatial_index.query_radius(q['lat'], q['lon'], q['radius']) for q in queries]
+    indexed = list(range(len(queries)))
+
+    def nearest(i):
+        q = queries[i]
+        keep_rows = dept_rows[i]
+        snapshot.spatial_index.query_nearest(
+            q['lat'], q['lon'], 10, accept=lambda rows: np.isin(rows, keep_rows, assume_unique=True))
+
+    def first_page(i):
+        return select_page(radius_hits[i][1], 0, 100)
+
+    return {
+        'area_lookup': measure(lambda q: snapshot.area_index.lookup(q['city'], q['district']), queries, repeat),
+        'department_lookup_exact': measure(lambda q: snapshot.department_index.lookup(q['department']), queries, repeat),
+        'department_lookup_substring': measure(
+            lambda q: snapshot.department_index.lookup(q['fragment'], 'substring'), queries, repeat),
+        'intersect_rows': measure(lambda i: intersect_rows(area_rows[i], dept_rows[i]), indexed, repeat),
+        'coordinate_filter': measure(
+            lambda i: candidates[i][np.isfinite(store.latitude[candidates[i]])], indexed, repeat),
+        'open_filter': measure(lambda i: open_rows(candidates[i], snapshot.service_hours, moment), indexed, repeat),
+        'radius_query': measure(
+            lambda q: snapshot.spatial_index.query_radius(q['lat'], q['lon'], q['radius']), queries, repeat),
+        'nearest_k': measure(nearest, indexed, repeat),
+        'select_page': measure(first_page, indexed, repeat),
+        'serialize_page': measure(
+            lambda i: store.records_json(radius_hits[i][0][first_page(i)], radius_hits[i][1][first_page(i)]),
+            indexed, repeat),
+        'symptom_match': measure(lambda q: symptom_matcher.match(q['symptoms']), queries, repeat),
+    }
+
+
+def bench_requests(app, queries, repeat):
+    client = app.test_client()
+
+    def get(path, **params):
+        return lambda q: client.get(f"{path}?{urlencode({k: v(q) if callable(v) else v for k, v in params.items()})}")
+
+    area = dict(city=lambda q: q['city'], district=lambda q: q['district'], department=lambda q: q['department'])
+    nearby = dict(lat=lambda q: q['lat'], lon=lambda q: q['lon'], department=lambda q: q['department'])
+    cases = {
+        'search': get('/search', **area),
+        'search_sorted_distance': get('/search', **area, sort='distance', lat=lambda q: q['lat'], lon=lambda q: q['lon']),
+        'search_open_at': get('/search', **area, open_at=OPEN_AT),
+        'search_columns': get('/search', **area, format='columns'),
+        'search_nearby_radius': get('/search/nearby', **nearby, radius=lambda q: q['radius']),
+        'search_nearby_k10': get('/search/nearby', **nearby, k=10),
+        'search_nearby_open_first': get('/search/nearby', **nearby, radius=lambda q: q['radius'],
+                                        sort='open_first', open_at=OPEN_AT),
+        'suggest_department': lambda q: client.post('/api/suggest-department', json={'symptoms': q['symptoms']}),
+    }
+    return {name: measure(fn, queries, repeat) for name, fn in cases.items()}
+
+
+def compare(results, baseline):
+    """印出與 baseline 相比 p50/p95 的變化百分比"""
+    print("\n與 baseline 比較（正數代表變慢）：")
+    for section in ('stages', 'requests'):
+        for name, current in results[section].items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms'):
+                if previous[key]:
+                    changes.append(f"{key[:3]} {100 * (current[key] - previous[key]) / previous[key]:+.1f}%")
+            print(f"  {section}.{name:28} {'  '.join(changes)}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='搜尋端點的效能測試')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--data-dir', help='現有的 backend 工作目錄')
+    source.add_argument('--scale', type=float, default=1, help='用合成資料測試時的資料量倍數')
+    parser.add_argument('--seed', type=int, default=0, help='合成資料與查詢參數的亂數種子')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='把結果另外寫成 JSON 檔')
+    parser.add_argument('--baseline', help='之前輸出的 JSON，用來比較')
+    parser.add_argument('--result-cache', action='store_true',
+                        help='開啟搜尋結果快取（預設關閉，重複的查詢才不會只量到快取命中）')
+    args = parser.parse_args()
+
+    if args.data_dir:
+        data_dir = os.path.abspath(args.data_dir)
+    else:
+        data_dir = tempfile.mkdtemp(prefix='mednav_bench_')
+        print(f"generating synthetic data (scale={args.scale}) in '{data_dir}' ...")
+        synthetic_data.write_dataset(data_dir, args.scale, args.seed)
+
+    # 不呼叫 Gemini：沒有 API key 時直接回傳關鍵字分析的結果；測試期間也不自動重新載入資料
+    os.environ['API_KEY'] = ''
+    os.environ['SNAPSHOT_CHECK_INTERVAL'] = '0'
+    if not args.result_cache:
+        os.environ['RESULT_CACHE_MB'] = '0'
+    os.chdir(data_dir)
+    sys.path.insert(0, BACKEND_DIR)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as flask_app
+        import services
+    startup_s = time.perf_counter() - started
+    snapshot = services.snapshots.current
+    print(f"{snapshot.store.size} 筆院所，啟動 {startup_s:.2f} 秒")
+
+    queries = sample_queries(snapshot, args.queries, args.seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stages = bench_stages(snapshot, services.symptom_matcher, queries, args.repeat)
+        requests = bench_requests(flask_app.app, queries, args.repeat)
+
+    results = {
+        'meta': {
+            'rows': int(snapshot.store.size),
+            'data_dir': data_dir if args.data_dir else None,
+            'scale': None if args.data_dir else args.scale,
+            'seed': args.seed,
+            'queries': args.queries,
+            'repeat': args.repeat,
+            'startup_s': round(startup_s, 3),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'stages': stages,
+        'requests': requests,
+    }
+
+    for section in ('stages', 'requests'):
+        print(f"\n[{section}]")
+        for name, result in results[section].items():
+            print(f"  {name:28} p50={result['p50_ms']:9.4f}ms p95={result['p95_ms']:9.4f}ms p99={result['p99_ms']:9.4f}ms")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"successfully saved {args.json}")
+
+    if not args.data_dir:
+        os.chdir(BENCH_DIR)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
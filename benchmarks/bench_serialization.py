@@ -0,0 +1,94 @@
+"""
+比較搜尋結果的三種序列化方式（以整個臺北市的院所為例）：
+  dicts    ：原本的做法，每列建一個 dict、補預設文字，再交給 jsonify
+  fragments：接起 store 預先編好的 JSON 片段（/search 預設）
+  columns  ：format=columns 的欄式格式
+另外透過 Flask test client 量測 /search 端到端的延遲。
+
+用法（在專案根目錄）：
+    python benchmarks/bench_serialization.py --data-dir backend --json serialization.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+
+def measure(fn, repeat):
+    fn()  # 暖機
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3), 'p99_ms': round(p99, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='搜尋結果序列化方式比較')
+    parser.add_argument('--data-dir', default=BACKEND_DIR)
+    parser.add_argument('--city', default='臺北市')
+    parser.add_argument('--department', default='家庭醫學科')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--json', help='把結果另外寫成 JSON 檔')
+    args = parser.parse_args()
+
+    os.chdir(os.path.abspath(args.data_dir))
+    sys.path.insert(0, BACKEND_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as flask_app
+        import services
+    snapshot = services.snapshots.current
+    store = snapshot.store
+
+    rows = snapshot.area_index.lookup(args.city)
+    rows = rows[np.isfinite(store.latitude[rows])]
+    distances = np.random.default_rng(0).uniform(0, 20, len(rows))
+    print(f"{args.city}：{len(rows)} 筆院所")
+
+    def dicts():
+        clinics = store.records(rows)
+        for clinic, distance in zip(clinics, distances):
+            clinic['distance_km'] = round(float(distance), 3)
+        with flask_app.app.app_context():
+            return flask_app.jsonify(clinics).get_data()
+
+    results = {
+        'rows': int(len(rows)),
+        'dicts': measure(dicts, args.repeat),
+        'fragments': measure(lambda: store.records_json(rows, distances), args.repeat),
+        'columns': measure(lambda: services.encode_json(store.columns(rows, distances)).encode('utf-8'), args.repeat),
+    }
+    results['bytes'] = {
+        'dicts': len(dicts()),
+        'fragments': len(store.records_json(rows, distances)),
+        'columns': len(services.encode_json(store.columns(rows, distances)).encode('utf-8')),
+    }
+
+    client = flask_app.app.test_client()
+    path = f'/search?department={args.department}&city={args.city}&limit=500'
+    with contextlib.redirect_stdout(io.StringIO()):
+        results['endpoint_records'] = measure(lambda: client.get(path), args.repeat)
+        results['endpoint_columns'] = measure(lambda: client.get(path + '&format=columns'), args.repeat)
+
+    for name in ('dicts', 'fragments', 'columns', 'endpoint_records', 'endpoint_columns'):
+        result = results[name]
+        print(f"{name:17} p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms")
+    print(f"bytes: {results['bytes']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"successfully saved {args.json}")
+
+
+if __name__ == "__main__":
+    main()
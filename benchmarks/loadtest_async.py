@@ -0,0 +1,183 @@
+"""
+比較同步 Flask（gunicorn sync worker）與 ASGI（gunicorn + UvicornWorker）在上游很慢時的 /search 延遲。
+
+啟動一個本機假上游（Gemini 與 Google Geocoding 都會延遲 --upstream-delay 秒才回應），
+分別量測：
+  1. baseline：只有 /search 請求
+  2. loaded：同時有 --slow-clients 個使用者不斷送出需要問 Gemini 的症狀
+同步模式下慢請求會佔滿 worker，/search 只能排隊；ASGI 模式下 /search 的延遲應該幾乎不變。
+
+用法（在專案根目錄）：
+    python benchmarks/loadtest_async.py --data-dir backend --duration 10 --json loadtest.json
+data-dir 需要有 medical_data_geocoded.csv（或 clinic_store.bin）等 app.py 啟動所需的檔案。
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import requests
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_stub_upstream(delay):
+    """假的 Gemini（POST）與 Geocoding（GET）服務，每個請求都延遲 delay 秒"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, body):
+            time.sleep(delay)
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            text = json.dumps({'department': '家庭醫學科'}, ensure_ascii=False)
+            self._reply({'candidates': [{'content': {'parts': [{'text': text}]}}]})
+
+        def do_GET(self):
+            self._reply({'status': 'OK', 'results': [{'geometry': {'location': {'lat': 25.0, 'lng': 121.5}}}]})
+
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_server(mode, port, workers, data_dir, upstream_url):
+    env = dict(os.environ,
+               PYTHONPATH=BACKEND_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''),
+               API_KEY='loadtest',
+               GEMINI_API_URL=upstream_url + '/gemini',
+               GEOCODE_API_URL=upstream_url + '/geocode')
+    # 兩種模式都用 gunicorn 管理 worker，差別只在 worker 類型
+    # （uvicorn --workers 產生的 socket 不會設定 TCP_NODELAY，每個回應會多出約 40ms 的延遲）
+    gunicorn = shutil.which('gunicorn', path=os.path.dirname(sys.executable)) or 'gunicorn'
+    worker_class, target = ('sync', 'app:app') if mode == 'flask' else ('uvicorn.workers.UvicornWorker', 'asgi_app:app')
+    cmd = [gunicorn, '-w', str(workers), '-k', worker_class, '-b', f'127.0.0.1:{port}', '--timeout', '120', target]
+    process = subprocess.Popen(cmd, cwd=data_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} 伺服器啟動失敗，請確認 {data_dir} 裡的資料檔')
+        try:
+            requests.get(base_url + '/api/departments', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} 伺服器啟動逾時')
+
+
+def search_loop(base_url, path, stop, latencies, errors):
+    with requests.Session() as http:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                response = http.get(base_url + path, timeout=60)
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - started) * 1000)
+            except requests.RequestException:
+                errors.append(1)
+
+
+def slow_loop(base_url, stop, completed):
+    with requests.Session() as http:
+        while not stop.is_set():
+            # 每次都是不同、不會命中關鍵字的描述，避開建議快取與 single-flight，一定會打到上游
+            symptoms = f'說不上來的不舒服 {uuid.uuid4().hex}'
+            try:
+                http.post(base_url + '/api/suggest-department', json={'symptoms': symptoms}, timeout=60)
+                completed.append(1)
+            except requests.RequestException:
+                pass
+
+
+def run_phase(base_url, path, duration, search_clients, slow_clients):
+    stop = threading.Event()
+    latencies, errors, slow_done = [], [], []
+    threads = [threading.Thread(target=slow_loop, args=(base_url, stop, slow_done)) for _ in range(slow_clients)]
+    for thread in threads:
+        thread.start()
+    if slow_clients:
+        time.sleep(0.5)  # 先讓慢請求佔住 worker
+    searchers = [threading.Thread(target=search_loop, args=(base_url, path, stop, latencies, errors))
+                 for _ in range(search_clients)]
+    for thread in searchers:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in searchers + threads:
+        thread.join()
+
+    result = {'requests': len(latencies), 'errors': len(errors), 'slow_completed': len(slow_done),
+              'throughput_rps': round(len(latencies) / duration, 1)}
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        result.update(p50_ms=round(p50, 2), p95_ms=round(p95, 2), p99_ms=round(p99, 2))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同步 Flask 與 ASGI 在上游很慢時的 /search 延遲比較')
+    parser.add_argument('--data-dir', default=BACKEND_DIR, help='伺服器的工作目錄（放資料檔的地方）')
+    parser.add_argument('--search-path', default='/search?department=家庭醫學科&city=臺北市&limit=50')
+    parser.add_argument('--modes', nargs='+', default=['flask', 'asgi'], choices=['flask', 'asgi'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10, help='每個階段的秒數')
+    parser.add_argument('--upstream-delay', type=float, default=3, help='假上游的回應延遲（秒）')
+    parser.add_argument('--search-clients', type=int, default=4)
+    parser.add_argument('--slow-clients', type=int, default=16)
+    parser.add_argument('--json', help='把結果另外寫成 JSON 檔')
+    args = parser.parse_args()
+
+    upstream = start_stub_upstream(args.upstream_delay)
+    upstream_url = f'http://127.0.0.1:{upstream.server_address[1]}'
+    report = {'config': vars(args), 'results': {}}
+
+    for mode in args.modes:
+        process, base_url = start_server(mode, free_port(), args.workers, os.path.abspath(args.data_dir), upstream_url)
+        try:
+            requests.get(base_url + args.search_path, timeout=30)  # 暖機
+            baseline = run_phase(base_url, args.search_path, args.duration, args.search_clients, 0)
+            loaded = run_phase(base_url, args.search_path, args.duration, args.search_clients, args.slow_clients)
+        finally:
+            process.terminate()
+            process.wait()
+        report['results'][mode] = {'baseline': baseline, 'slow_upstream': loaded}
+        for phase, result in (('baseline', baseline), ('slow_upstream', loaded)):
+            print(f"{mode:5} {phase:13} p50={result.get('p50_ms', '-')}ms p95={result.get('p95_ms', '-')}ms "
+                  f"rps={result['throughput_rps']} errors={result['errors']} slow_done={result['slow_completed']}")
+
+    upstream.shutdown()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"successfully saved {args.json}")
+
+
+if __name__ == "__main__":
+    main()
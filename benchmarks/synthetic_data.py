@@ -0,0 +1,171 @@
+"""
+產生全台灣的合成院所資料，欄位與 medical_data_geocoded.csv 完全相同，用來做效能測試。
+縣市區取自 preprocessedData/行政區/admin_districts.py，院所數量依各縣市人口比例分配，
+座標落在各縣市中心附近；同一個 seed 一定產生同一份資料。
+
+輸出目錄可以直接當成 backend 的工作目錄（會一併複製科別、行政區、症狀對照表等 JSON，
+並產生對應的 service_hours.json）。
+
+用法（在專案根目錄）：
+    python benchmarks/synthetic_data.py --scale 10 --out-dir /tmp/mednav_x10
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BACKEND_DIR = os.path.join(ROOT_DIR, 'backend')
+ADMIN_DISTRICTS_PATH = os.path.join(ROOT_DIR, 'preprocessedData', '行政區', 'admin_districts.py')
+
+BASE_ROWS = 23000  # 全台健保特約院所大約的數量，scale=1 時的筆數
+CSV_COLUMNS = ['機構代碼', '機構名稱', '縣市區名', '地址', '電話', '科別', 'latitude', 'longitude']
+STATIC_FILES = ['departments_list.json', 'admin_districts.json', 'symptom_map.json', 'emergency_keywords.json']
+
+# 縣市中心（緯度, 經度）、院所散布範圍（度）、人口（百萬，用來分配院所數量）
+CITY_PROFILES = {
+    '臺北市': (25.05, 121.55, 0.03, 2.5),
+    '新北市': (25.01, 121.46, 0.08, 4.0),
+    '基隆市': (25.13, 121.74, 0.03, 0.36),
+    '桃園市': (24.95, 121.25, 0.08, 2.3),
+    '新竹縣': (24.83, 121.10, 0.06, 0.58),
+    '新竹市': (24.80, 120.97, 0.03, 0.45),
+    '苗栗縣': (24.56, 120.82, 0.08, 0.54),
+    '臺中市': (24.15, 120.67, 0.08, 2.8),
+    '南投縣': (23.91, 120.69, 0.10, 0.48),
+    '彰化縣': (24.07, 120.54, 0.07, 1.25),
+    '雲林縣': (23.70, 120.43, 0.08, 0.67),
+    '嘉義縣': (23.45, 120.33, 0.08, 0.49),
+    '嘉義市': (23.48, 120.45, 0.02, 0.26),
+    '臺南市': (23.00, 120.21, 0.08, 1.86),
+    '高雄市': (22.63, 120.30, 0.08, 2.75),
+    '屏東縣': (22.67, 120.49, 0.10, 0.8),
+    '宜蘭縣': (24.70, 121.74, 0.06, 0.45),
+    '花蓮縣': (23.98, 121.60, 0.08, 0.32),
+    '臺東縣': (22.76, 121.14, 0.10, 0.21),
+    '澎湖縣': (23.57, 119.58, 0.04, 0.1),
+    '金門縣': (24.44, 118.33, 0.03, 0.14),
+    '連江縣': (26.16, 119.95, 0.02, 0.013),
+}
+ROADS = ['中山路', '中正路', '民生路', '民權路', '復興路', '忠孝路', '仁愛路', '信義路', '和平路', '成功路']
+# 常見的看診時段組合（21-bit，第 時段*7+星期 位），再加上一部分隨機時段
+SCHEDULE_PATTERNS = [
+    0b0011111_0011111_0011111,  # 週一到週五 早午晚
+    0b0000000_0011111_0011111,  # 週一到週五 早午
+    0b0111111_0000000_0111111,  # 週一到週六 早晚
+    0b1111111_1111111_1111111,  # 全天
+]
+GEOCODE_FAILURE_RATE = 0.03
+
+
+def load_area_data(path=ADMIN_DISTRICTS_PATH):
+    spec = importlib.util.spec_from_file_location('admin_districts', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.area_data
+
+
+def load_departments():
+    with open(os.path.join(BACKEND_DIR, 'departments_list.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def generate_clinics(scale=1.0, seed=0, area_data=None, departments=None):
+    """回傳 medical_data_geocoded.csv 格式的 DataFrame，約 BASE_ROWS * scale 筆"""
+    rng = np.random.default_rng(seed)
+    area_data = area_data or load_area_data()
+    departments = departments or load_departments()
+    n = int(BASE_ROWS * scale)
+
+    # 每個縣市區一個中心點，院所散布在它周圍；縣市區的院所數量依縣市人口分配
+    districts, weights, centers, spreads = [], [], [], []
+    for city, names in area_data.items():
+        lat, lon, spread, population = CITY_PROFILES.get(city, (23.7, 121.0, 0.1, 0.1))
+        for name in names:
+            districts.append((city, name))
+            weights.append(population / len(names))
+            centers.append((lat + rng.normal(0, spread), lon + rng.normal(0, spread)))
+            spreads.append(spread / 3)
+    weights = np.asarray(weights) / np.sum(weights)
+    centers = np.asarray(centers)
+    spreads = np.asarray(spreads)
+
+    district = rng.choice(len(districts), size=n, p=weights)
+    latitude = centers[district, 0] + rng.normal(0, 1, n) * spreads[district]
+    longitude = centers[district, 1] + rng.normal(0, 1, n) * spreads[district]
+
+    # 科別：0 到 3 個，前面幾個科別（牙醫、西醫、中醫一般科）比較常見
+    dept_weights = 1 / np.arange(1, len(departments) + 1)
+    dept_weights /= dept_weights.sum()
+    dept_count = rng.choice([0, 1, 2, 3], size=n, p=[0.05, 0.6, 0.25, 0.1])
+    dept_draws = rng.choice(len(departments), size=(n, 3), p=dept_weights)
+    dept_text = [','.join(dict.fromkeys(departments[d] for d in draws[:count])) or None
+                 for draws, count in zip(dept_draws.tolist(), dept_count.tolist())]
+
+    area_names = [districts[d][0] + districts[d][1] for d in district.tolist()]
+    roads = rng.choice(len(ROADS), size=n)
+    numbers = rng.integers(1, 400, size=n)
+    addresses = [f"{area}{ROADS[road]}{number}號"
+                 for area, road, number in zip(area_names, roads.tolist(), numbers.tolist())]
+    missing_address = rng.random(n) < 0.02
+    phones = [f"0{rng_digits}" for rng_digits in rng.integers(20000000, 99999999, size=n).tolist()]
+    missing_phone = rng.random(n) < 0.05
+
+    codes = rng.choice(9_000_000_000, size=n, replace=False) + 1_000_000_000
+
+    df = pd.DataFrame({
+        '機構代碼': codes.astype(str),
+        '機構名稱': [f"合成診所{i}" for i in range(n)],
+        '縣市區名': area_names,
+        '地址': np.where(missing_address, None, np.asarray(addresses, dtype=object)),
+        '電話': np.where(missing_phone, None, np.asarray(phones, dtype=object)),
+        '科別': dept_text,
+        'latitude': latitude.round(7),
+        'longitude': longitude.round(7).astype(object),
+    }, columns=CSV_COLUMNS)
+
+    # 和 get_geocode.py 的輸出一樣：查不到座標的院所緯度留空，經度欄寫失敗原因
+    failed = rng.random(n) < GEOCODE_FAILURE_RATE
+    df.loc[failed, 'latitude'] = np.nan
+    df.loc[failed, 'longitude'] = 'ZERO_RESULTS'
+    return df
+
+
+def generate_schedule(codes, seed=0):
+    """產生 {機構代碼: 21-bit 看診遮罩}，格式與 get_service_hours.py 的輸出相同"""
+    rng = np.random.default_rng(seed + 1)
+    n = len(codes)
+    patterns = np.asarray(SCHEDULE_PATTERNS)[rng.choice(len(SCHEDULE_PATTERNS), size=n, p=[0.5, 0.2, 0.2, 0.1])]
+    random_masks = rng.integers(0, 1 << 21, size=n)
+    masks = np.where(rng.random(n) < 0.2, random_masks, patterns)
+    # 有一部分院所沒有登錄固定服務時段
+    listed = rng.random(n) < 0.9
+    return {code: int(mask) for code, mask, ok in zip(codes, masks.tolist(), listed.tolist()) if ok}
+
+
+def write_dataset(out_dir, scale=1.0, seed=0):
+    """把合成資料與 backend 啟動需要的 JSON 寫進 out_dir，回傳筆數"""
+    os.makedirs(out_dir, exist_ok=True)
+    df = generate_clinics(scale, seed)
+    df.to_csv(os.path.join(out_dir, 'medical_data_geocoded.csv'), index=False, encoding='utf-8-sig')
+    with open(os.path.join(out_dir, 'service_hours.json'), 'w', encoding='utf-8') as f:
+        json.dump(generate_schedule(df['機構代碼'].tolist(), seed), f)
+    for filename in STATIC_FILES:
+        shutil.copy(os.path.join(BACKEND_DIR, filename), os.path.join(out_dir, filename))
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='產生全台灣的合成院所資料')
+    parser.add_argument('--scale', type=float, default=1, help=f'資料量倍數，1 倍約 {BASE_ROWS} 筆')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out-dir', required=True)
+    args = parser.parse_args()
+
+    print(f"generating {int(BASE_ROWS * args.scale)} rows (seed={args.seed}) ...")
+    rows = write_dataset(args.out_dir, args.scale, args.seed)
+    print(f"successfully saved '{args.out_dir}' ({rows} rows)！")
@@ -0,0 +1,271 @@
+"""
+把各份健保開放資料合併成 backend 載入的單一資料檔（clinic_store.bin）：
+  institutions   ：../backend/medical_data_geocoded.csv（醫療機構基本資料 + get_geocode.py 查到的座標）
+  service_hours  ：全民健康保險特約院所固定服務時段/A21030000I-D21006-001.csv → 21-bit 看診遮罩
+  service_items  ：醫療院所服務項目明細/A21030000I-D2100C-001.csv（診療科別代碼）、-D2100H-001.csv（服務項目代碼）
+  admin_districts：行政區/admin_districts.py → ../backend/admin_districts.json
+服務時段與服務項目明細（每份數萬到十萬列）分塊讀取，每塊處理完就縮減成 {機構代碼: 值} 後丟掉；
+院所資料最後要整份寫進資料檔，直接一次讀進來。各來源以醫事機構代碼合併。
+診療科別代碼依 ../backend/department_codes.json 解碼成名稱，存成獨立的一欄（診療科別名稱），
+和代碼、服務項目代碼一樣不併入科別文字，department= 的比對結果和原本的科別欄位一致；
+專科篩選（specialty=、dept_code=）直接用代碼查詢。對照表裡沒有的代碼不解碼，列在統計的 undecoded_department_codes。
+
+增量建置：build/manifest.json 記錄每個來源檔案的 sha256，只有輸入變動的來源會重新處理，
+其餘直接讀 build/ 裡上次的中間結果；所有輸入都沒變時不重寫資料檔。
+資料檔表頭帶有版本、各來源檔案的 sha256，以及資料區的 checksum（寫完後檢查一次；backend 載入時只檢查大小）。
+
+用法（在 preprocessedData 目錄）：
+    python build_dataset.py            # 增量建置
+    python build_dataset.py --force    # 全部重建
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import sys
+import time
+
+import pandas as pd
+
+from get_service_hours import compile_schedule
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(ROOT_DIR, '..', 'backend'))
+sys.path.insert(0, BACKEND_DIR)
+
+from clinic_store import ClinicStore, CODE_COLUMNS, DECODED_DEPARTMENTS_COLUMN, SCHEDULE_COLUMN  # noqa: E402
+
+# 處理邏輯改變時加一，讓所有步驟重跑
+PIPELINE_VERSION = 3
+CHUNK_ROWS = 50000
+
+INSTITUTIONS_PATH = os.path.join(BACKEND_DIR, 'medical_data_geocoded.csv')
+SERVICE_HOURS_PATH = os.path.join(ROOT_DIR, '全民健康保險特約院所固定服務時段', 'A21030000I-D21006-001.csv')
+DEPARTMENT_ITEMS_PATH = os.path.join(ROOT_DIR, '醫療院所服務項目明細', 'A21030000I-D2100C-001.csv')
+SERVICE_ITEMS_PATH = os.path.join(ROOT_DIR, '醫療院所服務項目明細', 'A21030000I-D2100H-001.csv')
+ADMIN_DISTRICTS_PATH = os.path.join(ROOT_DIR, '行政區', 'admin_districts.py')
+DEPARTMENT_CODES_PATH = os.path.join(BACKEND_DIR, 'department_codes.json')
+OUTPUT_PATH = os.path.join(BACKEND_DIR, 'clinic_store.bin')
+ADMIN_DISTRICTS_OUTPUT = os.path.join(BACKEND_DIR, 'admin_districts.json')
+BUILD_DIR = os.path.join(ROOT_DIR, 'build')
+
+
+def file_sha256(path, cached=None):
+    """檔案的 sha256；大小與修改時間都和上次相同時直接沿用 manifest 裡的值，不必重讀"""
+    stat = os.stat(path)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+
+def read_chunks(path, **kwargs):
+    return pd.read_csv(path, encoding='utf-8-sig', chunksize=CHUNK_ROWS, **kwargs)
+
+
+# --- 各來源的處理步驟：輸入檔案路徑，回傳可以 pickle 的中間結果 ---
+
+def load_institutions(path):
+    """
+    院所基本資料與座標；get_geocode.py 會把失敗原因寫進 longitude 欄，這裡統一轉成數值。
+    每一列最後都要寫進資料檔，分塊讀再接起來不會比較省記憶體，所以一次讀完。
+    """
+    df = pd.read_csv(path, encoding='utf-8-sig', dtype={'機構代碼': str, '電話': str})
+    for col in ['latitude', 'longitude']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def load_service_hours(path):
+    """{機構代碼: 21-bit 看診遮罩}，規則與 get_service_hours.py 相同"""
+    schedule = {}
+    for chunk in read_chunks(path, dtype=str, usecols=['醫事機構代碼', '看診星期', '開業狀況']):
+        chunk = chunk[(chunk['開業狀況'] == '0') & (chunk['看診星期'].str.len() == 21)]
+        schedule.update(zip(chunk['醫事機構代碼'], map(compile_schedule, chunk['看診星期'])))
+    return schedule
+
+
+def load_item_codes(path, column):
+    """{機構代碼: 以逗號串接的代碼}，同一間院所的代碼維持檔案中的順序"""
+    codes = {}
+    for chunk in read_chunks(path, dtype=str):
+        chunk = chunk.dropna(subset=['醫事機構代碼', column])
+        for code, item in zip(chunk['醫事機構代碼'], chunk[column].str.strip()):
+            codes.setdefault(code, []).append(item)
+    return {code: ','.join(dict.fromkeys(items)) for code, items in codes.items()}
+
+
+def load_admin_districts(path):
+    spec = importlib.util.spec_from_file_location('admin_districts', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.area_data
+
+
+# 步驟名稱 → (處理函式, 預設輸入檔)
+STAGES = {
+    'institutions': (load_institutions, INSTITUTIONS_PATH),
+    'service_hours': (load_service_hours, SERVICE_HOURS_PATH),
+    'department_items': (lambda path: load_item_codes(path, '診療科別'), DEPARTMENT_ITEMS_PATH),
+    'service_items': (lambda path: load_item_codes(path, '機構服務項目代碼'), SERVICE_ITEMS_PATH),
+    'admin_districts': (load_admin_districts, ADMIN_DISTRICTS_PATH),
+}
+
+
+def decode_departments(codes, department_codes):
+    """以逗號串接的診療科別代碼 → 以逗號串接的科別名稱；沒有對照名稱的代碼略過，重複的名稱只留一個"""
+    if not codes:
+        return ''
+    return ','.join(dict.fromkeys(department_codes[code] for code in codes.split(',') if code in department_codes))
+
+
+def join_sources(results, department_codes):
+    """以機構代碼把服務時段、服務項目代碼併到院所資料上，並解碼診療科別代碼，回傳 (DataFrame, 統計)"""
+    df = results['institutions'].copy()
+    codes = df['機構代碼']
+    df[SCHEDULE_COLUMN] = codes.map(results['service_hours']).fillna(0).astype('uint32')
+    df[CODE_COLUMNS[0]] = codes.map(results['department_items']).fillna('')
+    df[CODE_COLUMNS[1]] = codes.map(results['service_items']).fillna('')
+    df[DECODED_DEPARTMENTS_COLUMN] = [decode_departments(value, department_codes) for value in df[CODE_COLUMNS[0]]]
+
+    known = set(codes)
+    used_codes = {code for value in results['department_items'].values() for code in value.split(',')}
+    stats = {
+        'rows': len(df),
+        'with_schedule': int((df[SCHEDULE_COLUMN] > 0).sum()),
+        'with_department_codes': int((df[CODE_COLUMNS[0]] != '').sum()),
+        'with_service_items': int((df[CODE_COLUMNS[1]] != '').sum()),
+        'with_decoded_departments': int((df[DECODED_DEPARTMENTS_COLUMN] != '').sum()),
+        'unmatched_service_items': len(set(results['service_items']) - known),
+        'undecoded_department_codes': sorted(used_codes - set(department_codes)),
+    }
+    return df, stats
+
+
+def write_json_if_changed(path, value):
+    """內容相同時不動檔案，避免改到修改時間讓 backend 重新載入"""
+    text = json.dumps(value, ensure_ascii=False, indent=2)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == text:
+                return False
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+
+class Manifest:
+    """build/manifest.json：來源檔案的 sha256、各步驟上次的輸入，以及上次輸出的資料檔"""
+
+    def __init__(self, build_dir):
+        self.path = os.path.join(build_dir, 'manifest.json')
+        self.data = {'files': {}, 'stages': {}, 'dataset': {}}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def digest(self, path):
+        key = os.path.abspath(path)
+        self.data['files'][key] = file_sha256(path, self.data['files'].get(key))
+        return self.data['files'][key]['sha256']
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def run_stage(name, path, manifest, build_dir, force=False):
+    """輸入沒變且中間結果還在時直接讀 pickle，否則重新處理；回傳 (結果, 輸入檔的 sha256)"""
+    fn = STAGES[name][0]
+    inputs = {os.path.basename(path): manifest.digest(path)}
+    cache_path = os.path.join(build_dir, f'{name}.pkl')
+    previous = manifest.data['stages'].get(name, {})
+    if not force and previous.get('inputs') == inputs and previous.get('version') == PIPELINE_VERSION \
+            and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f), inputs
+
+    started = time.perf_counter()
+    result = fn(path)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    seconds = time.perf_counter() - started
+    manifest.data['stages'][name] = {'inputs': inputs, 'version': PIPELINE_VERSION,
+                                     'rows': len(result), 'seconds': round(seconds, 3)}
+    print(f"  {name:17} rebuilt: {len(result)} rows in {seconds:.2f}s")
+    return result, inputs
+
+
+def build_dataset(out_path=OUTPUT_PATH, build_dir=BUILD_DIR, force=False, institutions_path=INSTITUTIONS_PATH):
+    os.makedirs(build_dir, exist_ok=True)
+    manifest = Manifest(build_dir)
+    paths = {name: path for name, (_, path) in STAGES.items()}
+    paths['institutions'] = institutions_path
+    results, sources = {}, {}
+    for name, path in paths.items():
+        results[name], sources[name] = run_stage(name, path, manifest, build_dir, force)
+    department_codes_sha = manifest.digest(DEPARTMENT_CODES_PATH)
+
+    if write_json_if_changed(ADMIN_DISTRICTS_OUTPUT, results['admin_districts']):
+        print(f"successfully saved '{ADMIN_DISTRICTS_OUTPUT}'")
+
+    # 資料檔的輸入：所有來源檔案加上科別代碼表；和上次相同且檔案還在時不重寫
+    inputs_sha = hashlib.sha256(json.dumps(
+        [PIPELINE_VERSION, sources, department_codes_sha], sort_keys=True).encode('utf-8')).hexdigest()
+    previous = manifest.data['dataset']
+    if not force and previous.get('inputs_sha256') == inputs_sha and previous.get('path') == out_path \
+            and os.path.exists(out_path) \
+            and ClinicStore.open(out_path).meta.get('checksum') == previous.get('checksum'):
+        manifest.save()
+        print(f"'{out_path}' is up to date (version {previous['version']})")
+        return previous
+
+    started = time.perf_counter()
+    with open(DEPARTMENT_CODES_PATH, 'r', encoding='utf-8') as f:
+        department_codes = json.load(f)
+    df, stats = join_sources(results, department_codes)
+    version = f"{time.strftime('%Y%m%d')}-{inputs_sha[:8]}"
+    store = ClinicStore.from_dataframe(df, meta={
+        'source': 'build_dataset.py',
+        'version': version,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'sources': sources,
+        'department_codes': department_codes_sha,
+        'stats': stats,
+    })
+    store.save(out_path)
+    # 發布前完整檢查一次寫出的檔案；backend 載入時只檢查表頭與大小，不會再讀過整個檔案
+    ClinicStore.open(out_path, verify=True)
+    seconds = time.perf_counter() - started
+
+    manifest.data['dataset'] = {'path': out_path, 'version': version, 'inputs_sha256': inputs_sha,
+                                'checksum': store.meta['checksum'], 'stats': stats, 'seconds': round(seconds, 3)}
+    manifest.save()
+    print(f"  {'join':17} {stats}")
+    print(f"successfully saved '{out_path}' (version {version}, {store.size} rows, {seconds:.2f}s)！")
+    return manifest.data['dataset']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='合併健保開放資料，建出 backend 使用的院所資料檔')
+    parser.add_argument('--out', default=OUTPUT_PATH, help='輸出的資料檔路徑')
+    parser.add_argument('--build-dir', default=BUILD_DIR, help='中間結果與 manifest 的目錄')
+    parser.add_argument('--institutions', default=INSTITUTIONS_PATH, help='含座標的院所資料 CSV')
+    parser.add_argument('--force', action='store_true', help='忽略 manifest，全部重建')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    build_dataset(os.path.abspath(args.out), os.path.abspath(args.build_dir), args.force,
+                  os.path.abspath(args.institutions))
+    print(f"done in {time.perf_counter() - started:.2f}s")
@@ -1,11 +1,13 @@
 import pandas as pd
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+import argparse
+import threading
+import random
 import time
-import re 
+import re
 import requests
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 
@@ -16,19 +18,135 @@ def clean_address(address):
     address = address.split('、')[0].split(',')[0]
     return address.strip()
 
-# geolocator = Nominatim(user_agent="MediNav_Project_App/1.0", timeout=20)
-
 # --- 設定區 ---
-load_dotenv()  
+load_dotenv()
 API_KEY = os.getenv("API_KEY")
 GEOCODE_API_URL = "https://maps.googleapis.com/maps/api/geocode/json"
 inputFilename = '醫療機構與人員基本資料_20231231.csv'
 outputFilename = '../backend/medical_data_geocoded.csv'
+checkpointFilename = 'geocode_checkpoint.json'
 processArea = '臺北市南港區'
 
+# 這些狀態代表這個地址已經有確定的答案，續跑時不用再查
+FINAL_STATUSES = {'OK', 'ZERO_RESULTS'}
+RETRY_STATUSES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+RETRY_HTTP_STATUSES = {429}  # 另外 5xx 一律重試
+
+
+class TokenBucket:
+    """簡單的 token bucket：平均每秒 rate 次，最多累積 capacity 次的突發量"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """以 {清理後地址: [狀態, 緯度, 經度]} 的 JSON 檔記錄進度，中斷後可以從這裡續跑"""
 
-def get_geocode():
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.results = json.load(f)
+            print(f"從 {path} 載入 {len(self.results)} 筆已完成的地址。")
 
+    def done(self, address):
+        result = self.results.get(address)
+        return result is not None and result[0] in FINAL_STATUSES
+
+    def record(self, address, result):
+        with self.lock:
+            self.results[address] = list(result)
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            snapshot = dict(self.results)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def backoff_delay(attempt):
+    """第 attempt 次重試前等待的秒數：指數退避加上抖動，最多 30 秒"""
+    return min(30, 0.5 * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+def geocode_one(session, bucket, address, api_url=GEOCODE_API_URL, api_key=API_KEY, max_retries=5):
+    """
+    查詢單一地址，回傳 (狀態, 緯度, 經度)。
+    429、5xx、OVER_QUERY_LIMIT 與網路錯誤會以指數退避（加上抖動）重試。
+    """
+    params = {
+        'address': address,
+        'key': api_key,
+        'language': 'zh-TW' # 指定回傳語言為繁體中文
+    }
+    status = 'request_error'
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(backoff_delay(attempt))
+        bucket.acquire()
+        try:
+            res = session.get(api_url, params=params, timeout=10)
+            if res.status_code >= 500 or res.status_code in RETRY_HTTP_STATUSES:
+                status = f'http_{res.status_code}'
+                continue
+            res.raise_for_status() # 其他 4xx 重試也沒有用，直接拋出
+            data = res.json()
+        except requests.exceptions.HTTPError as e:
+            print(f" -> HTTP 錯誤: {e}  {address}")
+            return 'request_error', None, None
+        except requests.exceptions.RequestException:
+            status = 'request_error'
+            continue
+        except ValueError:
+            status = 'unknown_error'
+            continue
+
+        status = data.get('status', 'unknown_error')
+        if status == 'OK':
+            location = data['results'][0]['geometry']['location']
+            return status, location['lat'], location['lng']
+        if status not in RETRY_STATUSES:
+            # 如果 Google 找不到地址，狀態會是 'ZERO_RESULTS'
+            return status, None, None
+    return status, None, None
+
+
+def select_rows(df, areas=None):
+    """挑出指定縣市區（前綴比對）中還沒有經緯度的資料；areas 為 None 時代表全台灣"""
+    is_missing_coords = df['latitude'].isnull() | df['longitude'].isnull()
+    if not areas:
+        return df[is_missing_coords]
+    area_names = df['縣市區名'].fillna('').str.replace('台', '臺')
+    is_in_area = pd.Series(False, index=df.index)
+    for area in areas:
+        is_in_area |= area_names.str.startswith(area.replace('台', '臺'))
+    return df[is_in_area & is_missing_coords]
+
+
+def load_output():
     if not os.path.exists(outputFilename):
         print(f"輸出檔案 {outputFilename} 不存在，將從 {inputFilename} 建立")
         df = pd.read_csv(inputFilename)
@@ -38,110 +156,113 @@ def get_geocode():
         print(f"已從 {inputFilename} 建立 {outputFilename} 。")
 
     print(f"正在讀取資料: {outputFilename}")
-    df = pd.read_csv(outputFilename)
+    df = pd.read_csv(outputFilename, dtype={'機構代碼': str, '電話': str})
 
     for col in ['latitude', 'longitude']:
         if col not in df.columns:
             df[col] = None
         else:
             df[col] = pd.to_numeric(df[col], errors='coerce')
-    
-    is_in_area = df['縣市區名'].str.startswith(processArea)
-    is_missing_coords = df['latitude'].isnull() | df['longitude'].isnull()
-    df_to_process = df[is_in_area & is_missing_coords].copy()
+    # 失敗原因會寫回 longitude 欄，所以這一欄要能放字串
+    df['longitude'] = df['longitude'].astype(object)
+    return df
 
-    total_rows = len(df_to_process)
 
-    yn = input(f"共有 {total_rows} 筆資料需要處理，是否處理？ y/n\n")
-    if yn != 'y' and yn != 'Y':
-        print("已取消處理。")
-        return
+def apply_results(df, rows_by_address, checkpoint):
+    for address, indexes in rows_by_address.items():
+        result = checkpoint.results.get(address)
+        if result is None:
+            continue
+        status, lat, lng = result
+        for index in indexes:
+            if status == 'OK':
+                df.at[index, 'latitude'] = lat
+                df.at[index, 'longitude'] = lng
+            else:
+                df.at[index, 'longitude'] = status # 記錄失敗原因
 
-    print(f"將處理 {total_rows} 筆 {processArea} 的資料...")
 
+def get_geocode(areas=None, workers=8, qps=20, checkpoint_path=checkpointFilename,
+                checkpoint_every=200, api_url=GEOCODE_API_URL, api_key=API_KEY, max_retries=5):
+    """
+    批次地理編碼：同樣的地址只查一次，以固定數量的執行緒並行查詢並限制每秒請求數，
+    每完成 checkpoint_every 筆就寫一次進度檔，中斷（包含 Ctrl+C）時會先把結果存下來。
+    """
+    df = load_output()
+    df_to_process = select_rows(df, areas)
 
+    rows_by_address = {}
+    for index, address in df_to_process['地址'].fillna('').astype(str).items():
+        cleaned_address = clean_address(address)
+        if cleaned_address:
+            rows_by_address.setdefault(cleaned_address, []).append(index)
 
-    if total_rows == 0:
-        print("所有醫療院所皆已有經緯度資料，無需處理。")
-    else:
-        print(f"將處理 {total_rows} 筆尚未有經緯度的資料...")
+    checkpoint = Checkpoint(checkpoint_path)
+    pending = [address for address in rows_by_address if not checkpoint.done(address)]
+    area_label = '、'.join(areas) if areas else '全台灣'
+    print(f"{area_label} 共有 {len(df_to_process)} 筆尚未有經緯度的資料，"
+          f"去除重複後 {len(rows_by_address)} 個地址，其中 {len(pending)} 個需要查詢。")
 
-        for index, row in df_to_process.iterrows():
-            current_index = df_to_process.index.get_loc(index)
-            print(f"進度: {current_index+1}/{total_rows}", end=" | ")
-            
-            original_address = f"{row['地址']}"
-            cleaned_address = clean_address(original_address)
+    if pending:
+        bucket = TokenBucket(qps)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
 
-            if not cleaned_address:
-                print(" -> 地址為空，跳過")
-                continue
-            
-            # 【核心修改】改用 Google Geocoding API
-            params = {
-                'address': cleaned_address,
-                'key': API_KEY,
-                'language': 'zh-TW' # 指定回傳語言為繁體中文
+        completed = 0
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = {
+                executor.submit(geocode_one, session, bucket, address, api_url, api_key, max_retries): address
+                for address in pending
             }
-            
-            try:
-                # 為了避免過於頻繁的請求，仍然保留延遲
-                time.sleep(0.1) # Google API 較強健，可縮短延遲
-                
-                res = requests.get(GEOCODE_API_URL, params=params)
-                res.raise_for_status() # 確認請求成功
-                
-                data = res.json() # 解析回傳的 JSON
-                
-                if data['status'] == 'OK':
-                    location = data['results'][0]['geometry']['location']
-                    lat = location['lat']
-                    lng = location['lng']
-                    df.at[index, 'latitude'] = lat
-                    df.at[index, 'longitude'] = lng
-                    print(f" -> 成功: ({lat:.4f}, {lng:.4f})  {cleaned_address}")
+            for future in as_completed(futures):
+                address = futures[future]
+                status, lat, lng = future.result()
+                checkpoint.record(address, (status, lat, lng))
+                completed += 1
+                if status == 'OK':
+                    print(f"進度: {completed}/{len(pending)} | -> 成功: ({lat:.4f}, {lng:.4f})  {address}")
                 else:
-                    # 如果 Google 找不到地址，狀態會是 'ZERO_RESULTS'
-                    df.at[index, 'longitude'] = data['status'] # 記錄失敗原因
-                    print(f" -> 失敗: {data['status']}  {cleaned_address}")
-
-            except requests.exceptions.RequestException as e:
-                print(f" -> 發生網路請求錯誤: {e}  {cleaned_address}")
-                df.at[index, 'longitude'] = 'request_error'
-                # Optional: break or continue based on desired error handling
-            except Exception as e:
-                print(f" -> 發生未知錯誤: {e}  {cleaned_address}")
-                df.at[index, 'longitude'] = 'unknown_error'
-                break
-    
-                
-            """
-            for attempt in range(3): 
-                try:
-                    time.sleep(1) 
-                    
-                    location = geolocator.geocode(cleaned_address)
-                    
-                    if location:
-                        df.at[index, 'latitude'] = location.latitude
-                        df.at[index, 'longitude'] = location.longitude
-                        print(f"成功: {cleaned_address} -> ({location.latitude:.4f}, {location.longitude:.4f})")
-                    else:
-                        print(f"失敗: 找不到地址 {cleaned_address}")
-                    
-                    break # 如果成功或找不到地址，就跳出重試迴圈
-
-                except GeocoderTimedOut:
-                    print(f"超時錯誤 (第 {attempt+1} 次嘗試)... 正在等待更長時間後重試...")
-                    time.sleep(5) # 如果超時，就等更久一點
-                except Exception as e:
-                    print(f"發生未知錯誤: {e}")
-                    break # 發生其他錯誤就直接放棄
-                """
-        print(f"\n地理編碼完成，正在儲存至 {outputFilename}")
-        df.to_csv(outputFilename, index=False, encoding='utf-8-sig')
-        print("檔案儲存成功！")
+                    print(f"進度: {completed}/{len(pending)} | -> 失敗: {status}  {address}")
+                if completed % checkpoint_every == 0:
+                    checkpoint.save()
+        except KeyboardInterrupt:
+            print("\n收到中斷，正在儲存目前進度...")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            checkpoint.save()
+
+    apply_results(df, rows_by_address, checkpoint)
+    print(f"\n地理編碼完成，正在儲存至 {outputFilename}")
+    df.to_csv(outputFilename, index=False, encoding='utf-8-sig')
+    print("檔案儲存成功！")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='批次地理編碼醫療院所地址')
+    parser.add_argument('areas', nargs='*', default=[processArea],
+                        help=f'要處理的縣市或縣市區名（前綴比對），預設為 {processArea}')
+    parser.add_argument('--all', action='store_true', help='處理全台灣所有尚未有經緯度的資料')
+    parser.add_argument('--workers', type=int, default=8, help='並行的請求數')
+    parser.add_argument('--qps', type=float, default=20, help='每秒最多幾個請求')
+    parser.add_argument('--checkpoint', default=checkpointFilename, help='進度檔路徑')
+    parser.add_argument('--checkpoint-every', type=int, default=200, help='每完成幾個地址寫一次進度檔')
+    parser.add_argument('--retries', type=int, default=5, help='429 / 5xx / OVER_QUERY_LIMIT 時的最多重試次數')
+    parser.add_argument('--api-url', default=GEOCODE_API_URL, help='Geocoding API 位址（測試時可指向本機 stub）')
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
-    get_geocode()
-    print("地理編碼腳本執行完畢！")
\ No newline at end of file
+    args = parse_args()
+    get_geocode(
+        areas=None if args.all else args.areas,
+        workers=args.workers,
+        qps=args.qps,
+        checkpoint_path=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+        api_url=args.api_url,
+        max_retries=args.retries,
+    )
+    print("地理編碼腳本執行完畢！")
@@ -0,0 +1,40 @@
+import pandas as pd
+import json
+
+## 健保特約院所固定服務時段：看診星期為 21 碼，依序為星期一～日的上午、下午、晚上
+## （前 7 碼上午、中間 7 碼下午、最後 7 碼晚上），N 表示有看診、Y 表示休診。
+## 這裡把它編成 21-bit 遮罩：第 (時段 * 7 + 星期) 位為 1 代表該時段有看診。
+
+def compile_schedule(pattern):
+    mask = 0
+    for slot, flag in enumerate(str(pattern)[:21]):
+        if flag == 'N':
+            mask |= 1 << slot
+    return mask
+
+def get_service_hours(input_file, output_file):
+    try:
+        print(f"reading '{input_file}' ...")
+        df = pd.read_csv(input_file, encoding='utf-8-sig', dtype=str)
+        df = df[df['開業狀況'] == '0']
+        df = df[df['看診星期'].str.len() == 21]
+        schedule = {
+            code: compile_schedule(pattern)
+            for code, pattern in zip(df['醫事機構代碼'], df['看診星期'])
+        }
+
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(schedule, f, ensure_ascii=False, separators=(',', ':'))
+
+        print(f"successfully saved '{output_file}' ({len(schedule)} institutions)！")
+
+    except FileNotFoundError:
+        print(f"error: cannot find file '{input_file}'. ")
+    except Exception as e:
+        print(f"unknown error {e}")
+
+if __name__ == "__main__":
+    INPUT_PATH = './全民健康保險特約院所固定服務時段/A21030000I-D21006-001.csv'
+    OUTPUT_PATH = '../backend/service_hours.json'
+
+    get_service_hours(INPUT_PATH, OUTPUT_PATH)
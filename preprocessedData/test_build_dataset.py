@@ -0,0 +1,123 @@
+import json
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import build_dataset
+from build_dataset import DEPARTMENT_CODES_PATH, decode_departments, join_sources
+from clinic_store import CODE_COLUMNS, DECODED_DEPARTMENTS_COLUMN, SCHEDULE_COLUMN, ClinicStore
+
+
+def load_codes():
+    with open(DEPARTMENT_CODES_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_department_codes_have_unique_names():
+    duplicates = [name for name, count in Counter(load_codes().values()).items() if count > 1]
+    assert duplicates == []
+
+
+def test_aliases_only_use_known_codes():
+    with open(DEPARTMENT_CODES_PATH.replace('department_codes.json', 'department_aliases.json'), 'r',
+              encoding='utf-8') as f:
+        aliases = json.load(f)
+    known = set(load_codes())
+    assert {alias: [code for code in codes if code not in known] for alias, codes in aliases.items()
+            if not set(codes) <= known} == {}
+
+
+def test_join_keeps_department_text_and_codes_apart():
+    institutions = pd.DataFrame({'機構代碼': ['A', 'B', 'C'], '科別': ['內科', '牙醫一般科', None]})
+    results = {
+        'institutions': institutions,
+        'service_hours': {'A': 7},
+        'department_items': {'A': '02,01', 'B': '40,45,99'},
+        'service_items': {'B': 'X1', 'Z': 'X2'},
+    }
+    df, stats = join_sources(results, load_codes())
+    # 科別文字維持原樣，department= 的比對不受解碼後的代碼影響
+    assert df['科別'].tolist()[:2] == ['內科', '牙醫一般科'] and pd.isna(df['科別'][2])
+    assert df[CODE_COLUMNS[0]].tolist() == ['02,01', '40,45,99', '']
+    assert df[CODE_COLUMNS[1]].tolist() == ['', 'X1', '']
+    # 解碼後的名稱存在獨立的一欄，對照表沒有的 99 不解碼
+    assert df[DECODED_DEPARTMENTS_COLUMN].tolist() == ['內科,家庭醫學科', '牙醫一般科,兒童牙科', '']
+    assert df[SCHEDULE_COLUMN].tolist() == [7, 0, 0]
+    assert stats['undecoded_department_codes'] == ['99']
+    assert stats['unmatched_service_items'] == 1
+    assert stats['with_department_codes'] == 2
+
+
+def test_decode_departments():
+    codes = {'01': '家庭醫學科', '02': '內科', '82': '放射診斷科'}
+    assert decode_departments('02,01', codes) == '內科,家庭醫學科'
+    assert decode_departments('99,82,82', codes) == '放射診斷科'
+    assert decode_departments('', codes) == ''
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    """最小的四份來源檔；build_dataset 的預設路徑換成暫存目錄裡的檔案"""
+    institutions = tmp_path / 'medical_data_geocoded.csv'
+    pd.DataFrame({
+        '機構代碼': ['0101090517', '0201010011', '0301010022'],
+        '機構名稱': ['甲診所', '乙牙醫', '丙醫院'],
+        '縣市區名': ['臺北市大安區', '臺北市中正區', '新北市板橋區'],
+        '地址': ['臺北市大安區復興南路1號', '臺北市中正區羅斯福路2號', '新北市板橋區文化路3號'],
+        '電話': ['02-1', '02-2', '02-3'],
+        '科別': ['內科', '牙醫一般科', '內科,家醫科'],
+        'latitude': [25.03, 25.02, 'ZERO_RESULTS'],
+        'longitude': [121.54, 121.52, None],
+    }).to_csv(institutions, index=False, encoding='utf-8-sig')
+    hours = tmp_path / 'hours.csv'
+    pd.DataFrame({'醫事機構代碼': ['0101090517', '0201010011'], '看診星期': ['N' * 21, 'Y' * 20 + 'N'],
+                  '開業狀況': ['0', '0']}).to_csv(hours, index=False, encoding='utf-8-sig')
+    department_items = tmp_path / 'd2100c.csv'
+    pd.DataFrame({'醫事機構代碼': ['0101090517', '0101090517', '0201010011', '0201010011'],
+                  '診療科別': ['02', '01', '40', '45']}).to_csv(department_items, index=False, encoding='utf-8-sig')
+    service_items = tmp_path / 'd2100h.csv'
+    pd.DataFrame({'醫事機構代碼': ['0301010022'], '機構服務項目代碼': ['A']}).to_csv(
+        service_items, index=False, encoding='utf-8-sig')
+    districts = tmp_path / 'admin_districts.py'
+    districts.write_text("area_data = {'臺北市': ['大安區', '中正區']}\n", encoding='utf-8')
+
+    monkeypatch.setattr(build_dataset, 'CHUNK_ROWS', 1)
+    monkeypatch.setattr(build_dataset, 'ADMIN_DISTRICTS_OUTPUT', str(tmp_path / 'admin_districts.json'))
+    for name, path in [('service_hours', hours), ('department_items', department_items),
+                       ('service_items', service_items), ('admin_districts', districts)]:
+        monkeypatch.setitem(build_dataset.STAGES, name, (build_dataset.STAGES[name][0], str(path)))
+    return tmp_path, str(institutions), hours
+
+
+def test_build_writes_a_decoded_dataset_and_rebuilds_only_changed_sources(sources, capsys):
+    tmp_path, institutions, hours = sources
+    out_path = str(tmp_path / 'clinic_store.bin')
+    build_dir = str(tmp_path / 'build')
+    dataset = build_dataset.build_dataset(out_path, build_dir, institutions_path=institutions)
+
+    store = ClinicStore.open(out_path, verify=True)
+    assert store.meta['version'] == dataset['version'] and store.meta['checksum'] == dataset['checksum']
+    rows = np.arange(store.size)
+    assert store.text_values(CODE_COLUMNS[0], rows) == ['02,01', '40,45', '']
+    assert store.text_values(DECODED_DEPARTMENTS_COLUMN, rows) == ['內科,家庭醫學科', '牙醫一般科,兒童牙科', '']
+    assert store.text_values(CODE_COLUMNS[1], rows) == ['', '', 'A']
+    assert store.schedule.tolist() == [(1 << 21) - 1, 1 << 20, 0]
+    # 科別文字維持原樣
+    assert store.departments == ['內科', '牙醫一般科', '家醫科']
+    assert np.isnan(store.latitude[2])
+    capsys.readouterr()
+
+    # 什麼都沒變：不重建任何步驟，也不重寫資料檔
+    assert build_dataset.build_dataset(out_path, build_dir, institutions_path=institutions) == dataset
+    assert 'rebuilt' not in capsys.readouterr().out
+
+    # 只改服務時段：只有那一步重跑
+    pd.DataFrame({'醫事機構代碼': ['0101090517'], '看診星期': ['Y' * 21], '開業狀況': ['0']}).to_csv(
+        hours, index=False, encoding='utf-8-sig')
+    updated = build_dataset.build_dataset(out_path, build_dir, institutions_path=institutions)
+    rebuilt = [line.split()[0] for line in capsys.readouterr().out.splitlines() if 'rebuilt' in line]
+    assert rebuilt == ['service_hours']
+    assert updated['version'] != dataset['version']
+    assert ClinicStore.open(out_path).schedule.tolist() == [0, 0, 0]
@@ -0,0 +1,137 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+import get_geocode
+
+
+class StubGeocoder:
+    """
+    本機的 Geocoding API stub：每個地址依序回傳預先排好的 (HTTP 狀態, Google 狀態)，
+    排完之後一律回傳 OK；記錄每個地址被查了幾次。
+    """
+
+    def __init__(self, script=None):
+        self.script = {address: list(steps) for address, steps in (script or {}).items()}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                address = parse_qs(urlparse(self.path).query)['address'][0]
+                stub.requests.append(address)
+                steps = stub.script.get(address)
+                http_status, status = steps.pop(0) if steps else (200, 'OK')
+                body = {'status': status, 'results': []}
+                if status == 'OK':
+                    body['results'] = [{'geometry': {'location': stub.location(address)}}]
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(http_status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/geocode/json'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def location(address):
+        return {'lat': 25.0 + len(address) / 1000, 'lng': 121.5}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    delays = []
+    monkeypatch.setattr(get_geocode, 'backoff_delay', lambda attempt: delays.append(attempt) or 0)
+    return delays
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(script=None):
+        servers.append(StubGeocoder(script))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
+
+
+def geocode(stub_server, address, max_retries=5):
+    import requests
+
+    return get_geocode.geocode_one(requests.Session(), get_geocode.TokenBucket(1000), address,
+                                   api_url=stub_server.url, api_key='key', max_retries=max_retries)
+
+
+def test_backs_off_on_429_5xx_and_over_query_limit(stub, no_backoff):
+    server = stub({'臺北市南港區忠孝東路1號': [(429, 'OK'), (503, 'OK'), (200, 'OVER_QUERY_LIMIT'), (200, 'UNKNOWN_ERROR')]})
+    status, lat, lng = geocode(server, '臺北市南港區忠孝東路1號')
+    assert status == 'OK' and (lat, lng) == tuple(StubGeocoder.location('臺北市南港區忠孝東路1號').values())
+    assert len(server.requests) == 5
+    assert no_backoff == [1, 2, 3, 4]
+
+
+def test_gives_up_after_max_retries(stub, no_backoff):
+    server = stub({'a': [(500, 'OK')] * 10, 'b': [(200, 'OVER_QUERY_LIMIT')] * 10})
+    assert geocode(server, 'a', max_retries=2) == ('http_500', None, None)
+    assert geocode(server, 'b', max_retries=2) == ('OVER_QUERY_LIMIT', None, None)
+    assert server.requests.count('a') == 3 and server.requests.count('b') == 3
+
+
+def test_final_answers_are_not_retried(stub, no_backoff):
+    server = stub({'a': [(200, 'ZERO_RESULTS')], 'b': [(403, 'REQUEST_DENIED')]})
+    assert geocode(server, 'a') == ('ZERO_RESULTS', None, None)
+    assert geocode(server, 'b') == ('request_error', None, None)
+    assert len(server.requests) == 2 and no_backoff == []
+
+
+def test_resumes_from_checkpoint(stub, no_backoff, tmp_path, monkeypatch):
+    output = tmp_path / 'medical_data_geocoded.csv'
+    pd.DataFrame({
+        '機構代碼': ['1', '2', '3', '4', '5'],
+        '縣市區名': ['臺北市南港區'] * 4 + ['新北市板橋區'],
+        '地址': ['南港路1號', '南港路2號（2樓）', '南港路2號', '南港路3號', '文化路1號'],
+        'latitude': [None] * 5,
+        'longitude': [None] * 5,
+    }).to_csv(output, index=False, encoding='utf-8-sig')
+    monkeypatch.setattr(get_geocode, 'outputFilename', str(output))
+
+    # 上次跑到一半：1 號已有結果，3 號當時超過配額（不算完成，這次要重查）
+    checkpoint = tmp_path / 'geocode_checkpoint.json'
+    checkpoint.write_text(json.dumps({'南港路1號': ['OK', 25.05, 121.6],
+                                      '南港路3號': ['OVER_QUERY_LIMIT', None, None]}, ensure_ascii=False),
+                          encoding='utf-8')
+
+    server = stub({'南港路3號': [(429, 'OK')]})
+    get_geocode.get_geocode(areas=['台北市南港區'], workers=2, qps=1000, checkpoint_path=str(checkpoint),
+                            api_url=server.url, api_key='key')
+
+    # 2 號的兩種寫法清理後是同一個地址，只查一次；1 號直接用進度檔，板橋區不在範圍內
+    assert sorted(server.requests) == ['南港路2號', '南港路3號', '南港路3號']
+    df = pd.read_csv(output, dtype={'機構代碼': str})
+    assert df['latitude'].notna().sum() == 4
+    assert df.loc[0, 'latitude'] == 25.05
+    assert df.loc[1, 'latitude'] == df.loc[2, 'latitude'] == StubGeocoder.location('南港路2號')['lat']
+    assert pd.isna(df.loc[4, 'latitude'])
+    saved = json.loads(checkpoint.read_text(encoding='utf-8'))
+    assert all(saved[address][0] == 'OK' for address in ['南港路1號', '南港路2號', '南港路3號'])
+
+    # 再跑一次：全部都在進度檔裡，不會再打 API
+    server.requests.clear()
+    get_geocode.get_geocode(areas=['臺北市南港區'], checkpoint_path=str(checkpoint), api_url=server.url, api_key='key')
+    assert server.requests == []